@@ -0,0 +1,146 @@
+"""
+Load benchmark for the HTTP bridges against a local SOCKS5 stand-in.
+
+    python -m benchmarks.bench_bridge --engine async --clients 2000 --requests 10000
+    python -m benchmarks.bench_bridge --engine thread --clients 200
+    python -m benchmarks.bench_bridge --engine thread --clients 50 --keep-alive
+
+The threaded engine needs PySocks (see requirements.txt).
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from types import SimpleNamespace
+
+from benchmarks.standins import StandIns
+from onions_farmer.app.tools.socks_pool import SocksPool
+
+
+def makeBridge(engine: str, socks_port: int) -> object:
+    onion = SimpleNamespace(
+        conf={"Name": "bench", "LocalSocks": str(socks_port)},
+        stopEvent=threading.Event(),
+        socksPool=SocksPool(),
+    )
+    if engine == "async":
+        from onions_farmer.app.tools.bridge_async import AsyncBridgeHTTP
+        bridge = AsyncBridgeHTTP(onion, "127.0.0.1:0")
+    else:
+        from onions_farmer.app.tools.bridge_http import BridgeHTTP
+        bridge = BridgeHTTP(onion, "127.0.0.1:0")
+    return bridge, onion
+
+
+async def oneRequest(port: int, latencies: list) -> bool:
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET http://origin.test/ HTTP/1.1\r\nHost: origin.test\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        data = await reader.read()
+        writer.close()
+    except OSError:
+        return False
+    latencies.append(time.perf_counter() - start)
+    return data.startswith(b"HTTP/1.1 200")
+
+
+async def keepAliveRequests(port: int, count: int, latencies: list, body: int) -> int:
+    # one client connection, `count` sequential requests; returns the number of failures
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return count
+    done = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            writer.write(b"GET http://origin.test/ HTTP/1.1\r\nHost: origin.test\r\n\r\n")
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            await reader.readexactly(body)
+        except (OSError, asyncio.IncompleteReadError):
+            break
+        if head.startswith(b"HTTP/1.1 200"):
+            done += 1
+            latencies.append(time.perf_counter() - start)
+    writer.close()
+    return count - done
+
+
+async def load(port: int, clients: int, requests: int, keep_alive: bool = False, body: int = 0) -> dict:
+    latencies = []
+    errors = 0
+    queue = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in queue:
+            if not await oneRequest(port, latencies):
+                errors += 1
+
+    async def keepAliveWorker(count: int):
+        nonlocal errors
+        mine = []
+        errors += await keepAliveRequests(port, count, mine, body)
+        latencies.extend(mine)
+
+    start = time.perf_counter()
+    if keep_alive:
+        share = [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+        await asyncio.gather(*(keepAliveWorker(n) for n in share if n))
+    else:
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    total = time.perf_counter() - start
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(total, 4),
+        "rps": round(requests / total, 1),
+        "p50_ms": round(pick(0.50) * 1000, 3) if latencies else None,
+        "p95_ms": round(pick(0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(pick(0.99) * 1000, 3) if latencies else None,
+        "threads_peak": threading.active_count(),
+    }
+
+
+def boundPort(bridge: object) -> int:
+    # bridges were asked for port 0; wait until the real port is known
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        sock = getattr(bridge, "http", None)
+        if sock is not None and sock.getsockname()[1]:
+            return sock.getsockname()[1]
+        if bridge.port:
+            return bridge.port
+        time.sleep(0.01)
+    raise RuntimeError("bridge did not start listening")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=["async", "thread"], default="async")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--body", type=int, default=1024)
+    parser.add_argument("--latency", type=float, default=0.0, help="origin think time in seconds")
+    parser.add_argument("--keep-alive", action="store_true", help="reuse one client connection per worker")
+    args = parser.parse_args()
+
+    standins = StandIns(args.body, args.latency)
+    bridge, onion = makeBridge(args.engine, standins.socksAddr[1])
+    bridge.start()
+    port = boundPort(bridge)
+    result = asyncio.run(load(port, args.clients, args.requests, args.keep_alive, args.body))
+    onion.stopEvent.set()
+    result.update({"engine": args.engine, "clients": args.clients, "body": args.body, "keep_alive": args.keep_alive})
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Bag construction benchmark: wall time of OnionsFarmer() + makeOnionsBag() against the bag size. Nothing is
+started, this measures directory preparation, torrc generation and Onion object creation only.
+
+    python -m benchmarks.bench_construct --sizes 10 50 100 500
+    python -m benchmarks.bench_construct --sizes 200 --bridge random
+
+Needs `tor` on PATH (TorConstructor checks the installation once per process).
+"""
+import argparse
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import time
+
+from onions_farmer import OnionsFarmer
+
+
+def construct(size: int, bridge: str, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        base = tempfile.mkdtemp(prefix="onions_bench_")
+        try:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                farmer = OnionsFarmer(base)
+                bag = farmer.makeOnionsBag(size, local_sock_port_num_start=20000, http_bridge_ip=bridge)
+            times.append(time.perf_counter() - start)
+            if bag.len != size:
+                raise RuntimeError(f"expected {size} Onions, got {bag.len}")
+        finally:
+            shutil.rmtree(base, ignore_errors=True)
+    best = min(times)
+    return {
+        "size": size,
+        "best_s": round(best, 4),
+        "mean_s": round(sum(times) / len(times), 4),
+        "per_onion_ms": round(best / size * 1000, 3),
+        "bridge": bridge,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 500])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--bridge", default=None, help="http_bridge value for every Onion, e.g. random")
+    args = parser.parse_args()
+
+    results = [construct(size, args.bridge, args.repeat) for size in args.sizes]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Benchmark suite running the whole OnionsFarmer stack against the fake Tor (benchmarks/fake_tor.py), so results
+do not depend on the Tor network and can be compared from one commit to the next:
+
+  * construct:  OnionsFarmer() + makeOnionsBag() wall time per bag size,
+  * bootstrap:  bag start until every Onion is at 100%,
+  * isTorConn:  cost of one Onion.isTorConn / OnionsBag.isTorConn call,
+  * bridge:     throughput and latency percentiles through one Onion's HTTPBridge,
+  * carousel:   the same through a CarouselProxyHttp over the whole bag.
+
+    python -m benchmarks.bench_suite --out bench.json
+    python -m benchmarks.bench_suite --onions 8 --engine async --latency 0.005 --out new.json --compare bench.json
+
+The output is one JSON document: the settings, the results of every benchmark and a flat "metrics" map
+("bridge.p99_ms": 3.1, ...) that --compare diffs against an earlier run. A bridge that never listens or fails
+every request is marked "valid": false, kept out of the metrics, and the suite exits with status 1. Needs PySocks
+for the threaded bridge and the carousel (see requirements.txt).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_tor
+from benchmarks.bench_bridge import load, boundPort
+from benchmarks.bench_construct import construct
+from benchmarks.standins import StandIns
+from onions_farmer import OnionsFarmer, CarouselProxyHttp
+
+
+# metrics where a smaller value is the better one
+LOWER_IS_BETTER = ("_s", "_ms", "_ns", "errors")
+# result keys repeating the settings, not measurements
+SETTINGS_KEYS = ("size", "onions", "calls", "requests")
+
+
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {
+        "p50_s": round(pick(0.50), 4),
+        "p90_s": round(pick(0.90), 4),
+        "max_s": round(values[-1], 4),
+    }
+
+
+def benchBootstrap(bag: object, timeout: float) -> dict:
+    ready_at = {}
+    start = time.perf_counter()
+    done = bag.start(concurrency=0, rate=0, timeout=timeout,
+                     progress=lambda onion, ready, total: ready_at.setdefault(onion.name, time.perf_counter() - start))
+    ready = done.result(timeout)
+    result = {"onions": bag.len, "ready": len(ready), "total_s": round(time.perf_counter() - start, 4)}
+    if ready_at:
+        result.update(percentiles(list(ready_at.values())))
+    return result
+
+
+def benchIsTorConn(bag: object, calls: int) -> dict:
+    onion = bag.openBag()[0]
+    start = time.perf_counter()
+    for _ in range(calls):
+        onion.isTorConn
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(calls // 10 or 1):
+        bag.isTorConn
+    whole = time.perf_counter() - start
+    return {
+        "calls": calls,
+        "onion_ns": round(single / calls * 1e9, 1),
+        "bag_ns": round(whole / (calls // 10 or 1) * 1e9, 1),
+        "connected": bag.isTorConn,
+    }
+
+
+def waitListening(port: int, timeout: float = 10) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def benchBridge(port: int, args: argparse.Namespace) -> dict:
+    if not waitListening(port):
+        return {"valid": False, "reason": f"nothing listening on port {port}"}
+    # one untimed round first: SOCKS pools, thread pools and event loops warm up
+    asyncio.run(load(port, min(args.clients, 10), min(args.requests, 50), args.keep_alive, args.body))
+    result = asyncio.run(load(port, args.clients, args.requests, args.keep_alive, args.body))
+    if result["errors"] >= result["requests"]:
+        # no request got through: the timings measure refused connections, not the bridge
+        return {"valid": False, "reason": "every request failed", "requests": result["requests"], "errors": result["errors"]}
+    return result
+
+
+def gitCommit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def flatten(results: dict) -> dict:
+    metrics = {}
+    for bench, result in results.items():
+        rows = result if isinstance(result, list) else [result]
+        for row in rows:
+            if row.get("valid") is False:
+                continue
+            prefix = f"{bench}[{row['size']}]" if "size" in row and isinstance(result, list) else bench
+            for key, value in row.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key not in SETTINGS_KEYS:
+                    metrics[f"{prefix}.{key}"] = value
+    return metrics
+
+
+def compare(new: dict, old: dict) -> list:
+    rows = []
+    for key, value in new.items():
+        before = old.get(key)
+        if before is None or not before:
+            continue
+        change = (value - before) / before * 100
+        better = change <= 0 if key.endswith(LOWER_IS_BETTER) else change >= 0
+        rows.append({"metric": key, "old": before, "new": value, "change_pct": round(change, 1), "better": better})
+    return rows
+
+
+def run(args: argparse.Namespace) -> dict:
+    standins = StandIns(args.body, args.origin_latency)
+    tmp = tempfile.mkdtemp(prefix="onions_suite_")
+    fake_tor.install(os.path.join(tmp, "bin"), standins.originAddr, args.bootstrap, args.circuit, args.latency,
+                     args.control, args.seed)
+    # Onions start `tor` from PATH
+    os.environ["PATH"] = os.path.join(tmp, "bin") + os.pathsep + os.environ.get("PATH", "")
+
+    results = {"construct": [construct(size, None, args.repeat) for size in args.sizes]}
+    bridge = "async" if args.engine == "async" else "random"
+    os.makedirs(os.path.join(tmp, "onions"))
+    farmer = OnionsFarmer(os.path.join(tmp, "onions"))
+    bag = farmer.makeOnionsBag(args.onions, local_sock_port_num_start=args.port, http_bridge_ip=bridge)
+    carousel = None
+    try:
+        results["bootstrap"] = benchBootstrap(bag, args.timeout)
+        results["isTorConn"] = benchIsTorConn(bag, args.calls)
+        onion = bag.openBag()[0]
+        results["bridge"] = benchBridge(boundPort(onion.httpBridge), args)
+        carousel = CarouselProxyHttp(bag)
+        carousel.start()
+        results["carousel"] = benchBridge(carousel.port, args)
+    finally:
+        if carousel:
+            carousel.stop()
+        bag.stop()
+        # let Tor stand-ins get their SIGTERM before the directories go away
+        time.sleep(1)
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--onions", type=int, default=4, help="Onions in the bag for bootstrap, bridge and carousel")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100], help="bag sizes for the construct benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engine", choices=["async", "thread"], default="thread")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--body", type=int, default=1024)
+    parser.add_argument("--keep-alive", action="store_true")
+    parser.add_argument("--calls", type=int, default=100000, help="isTorConn calls")
+    parser.add_argument("--bootstrap", type=float, default=0.5, help="fake Tor seconds to 100%%")
+    parser.add_argument("--circuit", type=float, default=0.05, help="fake Tor seconds per circuit")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Tor seconds added to every SOCKS connect")
+    parser.add_argument("--control", type=float, default=0.0, help="fake Tor seconds added to every control reply")
+    parser.add_argument("--origin-latency", type=float, default=0.0, help="origin think time in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=30000, help="first SOCKS port of the bag")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--out", default=None, help="write the JSON document here as well")
+    parser.add_argument("--compare", default=None, help="earlier JSON document to compare with")
+    parser.add_argument("--verbose", action="store_true", help="keep the OnionsFarmer console output")
+    args = parser.parse_args()
+
+    started = time.time()
+    if args.verbose:
+        results = run(args)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run(args)
+    document = {
+        "version": 1,
+        "started": round(started, 3),
+        "commit": gitCommit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "verbose")},
+        "results": results,
+        "metrics": flatten(results),
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            document["comparison"] = compare(document["metrics"], json.load(f).get("metrics", {}))
+    text = json.dumps(document, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    sys.stdout.flush()
+    invalid = [name for name, result in results.items() if isinstance(result, dict) and result.get("valid") is False]
+    if invalid:
+        print(f"invalid benchmarks: {', '.join(invalid)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
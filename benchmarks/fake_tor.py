@@ -0,0 +1,407 @@
+"""
+Stand-in for the `tor` executable, so OnionsFarmer can be benchmarked without the Tor network. It reads the
+torrc written by TorConstructor and:
+
+  * answers `tor --version` like Tor does (TorConstructor checks it once per process),
+  * writes bootstrap progress to the notice log and as STATUS_CLIENT events,
+  * speaks the control protocol on the ControlSocket: AUTHENTICATE, SETEVENTS, GETINFO (bootstrap phase,
+    circuit status, ns/id, ip-to-country), SIGNAL NEWNYM, EXTENDCIRCUIT, CLOSECIRCUIT, ATTACHSTREAM and
+    SETCONF __LeaveStreamsUnattached, with CIRC and STREAM events,
+  * serves SOCKS5 on every SocksPort, routing all streams to one local origin (or to the requested
+    destination when no origin is set).
+
+Timings are injected through the environment, relays and circuit paths come from a seeded generator, so two
+runs with the same settings behave the same:
+
+    FAKE_TOR_ORIGIN      host:port every SOCKS stream is sent to
+    FAKE_TOR_BOOTSTRAP   seconds from start to 100% bootstrap (default 0.5)
+    FAKE_TOR_CIRCUIT     seconds to build a circuit (default 0.05)
+    FAKE_TOR_LATENCY     seconds added to every SOCKS connect (default 0)
+    FAKE_TOR_CONTROL     seconds added to every control reply (default 0)
+    FAKE_TOR_SEED        seed of the relay list and circuit paths (default 0)
+
+install() writes a `tor` wrapper with these settings into a directory; put that directory first on PATH.
+Only the standard library is used: the wrapper runs this file directly.
+"""
+import asyncio
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import time
+
+
+BOOTSTRAP_PHASES = (
+    (0, "starting", "Starting"),
+    (5, "conn", "Connecting to a relay"),
+    (10, "conn_done", "Connected to a relay"),
+    (14, "handshake", "Handshaking with a relay"),
+    (15, "handshake_done", "Handshake with a relay done"),
+    (25, "requesting_status", "Asking for networkstatus consensus"),
+    (45, "requesting_descriptors", "Asking for relay descriptors"),
+    (50, "loading_descriptors", "Loading relay descriptors"),
+    (75, "enough_dirinfo", "Loaded enough directory info to build circuits"),
+    (90, "ap_handshake_done", "Handshake finished with a relay to build circuits"),
+    (95, "circuit_create", "Establishing a Tor circuit"),
+    (100, "done", "Done"),
+)
+COUNTRIES = ("de", "nl", "fr", "us", "se", "ch", "ro", "fi", "ca", "at")
+RELAYS = 64
+VERSION = "0.4.8.10"
+
+
+def install(directory: str, origin: tuple = None, bootstrap: float = 0.5, circuit: float = 0.05, latency: float = 0.0,
+            control: float = 0.0, seed: int = 0) -> str:
+    """
+    Writes an executable `tor` wrapper running this stand-in with the given settings.
+
+    :param directory: Where to put the wrapper, prepend it to PATH.
+    :param origin: (host, port) every SOCKS stream is routed to, None to connect to the requested destination.
+    :return: The directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    env = {
+        "FAKE_TOR_BOOTSTRAP": bootstrap,
+        "FAKE_TOR_CIRCUIT": circuit,
+        "FAKE_TOR_LATENCY": latency,
+        "FAKE_TOR_CONTROL": control,
+        "FAKE_TOR_SEED": seed,
+    }
+    if origin:
+        env["FAKE_TOR_ORIGIN"] = f"{origin[0]}:{origin[1]}"
+    lines = ["#!/bin/sh"] + [f"export {key}='{value}'" for key, value in env.items()]
+    lines.append(f"exec '{sys.executable}' '{os.path.abspath(__file__)}' \"$@\"")
+    path = os.path.join(directory, "tor")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.chmod(path, 0o755)
+    return directory
+
+
+def readTorrc(path: str) -> dict:
+    conf = {"ControlSocket": None, "SocksPort": [], "Log": None, "DataDirectory": None}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            match parts[0]:
+                case "ControlSocket":
+                    conf["ControlSocket"] = parts[1]
+                case "SocksPort":
+                    host, _, port = parts[1].rpartition(":")
+                    conf["SocksPort"].append((host or "127.0.0.1", int(port)))
+                case "Log" if len(parts) > 3 and parts[1] == "notice" and parts[2] == "file":
+                    conf["Log"] = parts[3]
+                case "DataDirectory":
+                    conf["DataDirectory"] = parts[1]
+    return conf
+
+
+class FakeTor:
+    def __init__(self, conf: dict, env: dict):
+        self.conf = conf
+        self.bootstrapTime = float(env.get("FAKE_TOR_BOOTSTRAP", 0.5))
+        self.circuitTime = float(env.get("FAKE_TOR_CIRCUIT", 0.05))
+        self.latency = float(env.get("FAKE_TOR_LATENCY", 0))
+        self.controlDelay = float(env.get("FAKE_TOR_CONTROL", 0))
+        origin = env.get("FAKE_TOR_ORIGIN")
+        self.origin = (origin.rpartition(":")[0], int(origin.rpartition(":")[2])) if origin else None
+        # same seed and same instance: same relays and same circuit paths
+        self.random = random.Random(f"{env.get('FAKE_TOR_SEED', 0)}:{conf['ControlSocket']}")
+        self.relays = self._makeRelays()
+        self.progress = BOOTSTRAP_PHASES[0]
+        self.controllers = {}
+        self.circuits = {}
+        self.current = None
+        self.nextCircuit = 1
+        self.nextStream = 1
+        self.leaveUnattached = False
+        self.attach = {}
+        self.bootstrapped = None
+        self.stopped = None
+        self._tasks = set()
+        self.log = open(conf["Log"], "a") if conf["Log"] else None
+
+    def _makeRelays(self) -> list:
+        shared = random.Random(0)
+        relays = []
+        for i in range(RELAYS):
+            fingerprint = "".join(shared.choice("0123456789ABCDEF") for _ in range(40))
+            relays.append({"fp": fingerprint, "nick": f"fake{i}", "ip": f"10.{i // 250}.{i % 250}.{shared.randint(1, 254)}",
+                           "country": COUNTRIES[i % len(COUNTRIES)]})
+        return relays
+
+    def logLine(self, text: str) -> None:
+        if not self.log:
+            return
+        stamp = time.strftime("%b %d %H:%M:%S") + f".{int(time.time() * 1000) % 1000:03d}"
+        self.log.write(f"{stamp} [notice] {text}\n")
+        self.log.flush()
+
+    def spawn(self, coro: object) -> None:
+        # keep a reference, the loop only holds weak ones
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def emit(self, event: str, line: str) -> None:
+        for writer, events in list(self.controllers.items()):
+            if event in events:
+                writer.write(f"650 {line}\r\n".encode())
+
+    async def run(self) -> None:
+        self.bootstrapped = asyncio.Event()
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stopped.set)
+        self.logLine(f"Tor {VERSION} (fake) opening log file.")
+        servers = []
+        path = self.conf["ControlSocket"]
+        if path:
+            if os.path.exists(path):
+                os.remove(path)
+            servers.append(await asyncio.start_unix_server(self.handleControl, path))
+        for host, port in self.conf["SocksPort"]:
+            servers.append(await asyncio.start_server(self.handleSocks, host, port, reuse_address=True))
+            self.logLine(f"Opened Socks listener connection (ready) on {host}:{port}")
+        self.spawn(self.bootstrap())
+        await self.stopped.wait()
+        self.logLine("Interrupt: exiting cleanly.")
+        for server in servers:
+            server.close()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    async def bootstrap(self) -> None:
+        step = self.bootstrapTime / (len(BOOTSTRAP_PHASES) - 1)
+        for phase in BOOTSTRAP_PHASES:
+            if phase[0]:
+                await asyncio.sleep(step)
+            self.progress = phase
+            self.logLine(f"Bootstrapped {phase[0]}% ({phase[1]}): {phase[2]}")
+            self.emit("STATUS_CLIENT", f'STATUS_CLIENT NOTICE BOOTSTRAP PROGRESS={phase[0]} TAG={phase[1]} SUMMARY="{phase[2]}"')
+        self.current = await self.buildCircuit()
+        self.bootstrapped.set()
+        self.emit("STATUS_CLIENT", "STATUS_CLIENT NOTICE CIRCUIT_ESTABLISHED")
+
+    def _path(self, circ_id: str) -> str:
+        hops = self.circuits[circ_id]["path"]
+        return ",".join(f"${r['fp']}~{r['nick']}" for r in hops)
+
+    def launchCircuit(self) -> str:
+        circ_id = str(self.nextCircuit)
+        self.nextCircuit += 1
+        self.circuits[circ_id] = {"status": "LAUNCHED", "path": self.random.sample(self.relays, 3)}
+        self.emit("CIRC", f"CIRC {circ_id} LAUNCHED BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL")
+        return circ_id
+
+    async def buildCircuit(self, circ_id: str = None) -> str:
+        circ_id = circ_id or self.launchCircuit()
+        await asyncio.sleep(self.circuitTime)
+        if circ_id in self.circuits:
+            self.circuits[circ_id]["status"] = "BUILT"
+            self.emit("CIRC", f"CIRC {circ_id} BUILT {self._path(circ_id)} BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL")
+        return circ_id
+
+    async def newnym(self) -> None:
+        circ_id = await self.buildCircuit()
+        self.current = circ_id
+
+    def closeCircuit(self, circ_id: str) -> bool:
+        if self.circuits.pop(circ_id, None) is None:
+            return False
+        if self.current == circ_id:
+            self.current = next((c for c, v in self.circuits.items() if v["status"] == "BUILT"), None)
+        self.emit("CIRC", f"CIRC {circ_id} CLOSED REASON=REQUESTED")
+        return True
+
+    def getinfo(self, key: str) -> str:
+        match key.split("/", 1):
+            case ["version"]:
+                return VERSION
+            case ["status", "bootstrap-phase"]:
+                progress, tag, summary = self.progress
+                return f'NOTICE BOOTSTRAP PROGRESS={progress} TAG={tag} SUMMARY="{summary}"'
+            case ["status", "circuit-established"]:
+                return "1" if self.bootstrapped.is_set() else "0"
+            case ["circuit-status"]:
+                return "\r\n".join(f"{c} {v['status']} {self._path(c)} BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL"
+                                   for c, v in self.circuits.items())
+            case ["ns", rest] if rest.startswith("id/"):
+                fingerprint = rest[3:].lstrip("$")
+                relay = next((r for r in self.relays if r["fp"] == fingerprint), None)
+                if relay:
+                    return f"r {relay['nick']} AAAA BBBB 2026-01-01 00:00:00 {relay['ip']} 9001 0\r\ns Exit Fast Running Valid"
+            case ["ip-to-country", ip]:
+                relay = next((r for r in self.relays if r["ip"] == ip), None)
+                return relay["country"] if relay else "??"
+        return None
+
+    def reply(self, command: str) -> str:
+        parts = command.split(" ")
+        match parts[0].upper():
+            case "AUTHENTICATE" | "RESETCONF" | "TAKEOWNERSHIP":
+                return "250 OK\r\n"
+            case "GETINFO":
+                out = []
+                for key in parts[1:]:
+                    value = self.getinfo(key)
+                    if value is None:
+                        return f'552 Unrecognized key "{key}"\r\n'
+                    if "\r\n" in value or not value:
+                        out.append(f"250+{key}=\r\n{value}\r\n.\r\n")
+                    else:
+                        out.append(f"250-{key}={value}\r\n")
+                return "".join(out) + "250 OK\r\n"
+            case "SIGNAL":
+                match parts[1:2]:
+                    case ["NEWNYM"]:
+                        self.spawn(self.newnym())
+                    case ["SHUTDOWN"] | ["HALT"] | ["TERM"]:
+                        self.stopped.set()
+                return "250 OK\r\n"
+            case "SETCONF":
+                for arg in parts[1:]:
+                    key, _, value = arg.partition("=")
+                    if key == "__LeaveStreamsUnattached":
+                        self.leaveUnattached = value == "1"
+                return "250 OK\r\n"
+            case "EXTENDCIRCUIT":
+                circ_id = self.launchCircuit()
+                self.spawn(self.buildCircuit(circ_id))
+                return f"250 EXTENDED {circ_id}\r\n"
+            case "CLOSECIRCUIT":
+                return "250 OK\r\n" if len(parts) > 1 and self.closeCircuit(parts[1]) else "552 Unknown circuit\r\n"
+            case "ATTACHSTREAM":
+                future = self.attach.get(parts[1]) if len(parts) > 2 else None
+                if future is None or future.done():
+                    return "552 Unknown stream\r\n"
+                target = parts[2] if parts[2] != "0" else self.current
+                if target not in self.circuits:
+                    return "552 Unknown circuit\r\n"
+                future.set_result(target)
+                return "250 OK\r\n"
+            case "QUIT":
+                return "250 closing connection\r\n"
+        return f'510 Unrecognized command "{parts[0]}"\r\n'
+
+    async def handleControl(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.controllers[writer] = set()
+        try:
+            while line := await reader.readline():
+                command = line.decode().strip()
+                if not command:
+                    continue
+                if self.controlDelay:
+                    await asyncio.sleep(self.controlDelay)
+                if command.upper().startswith("SETEVENTS"):
+                    self.controllers[writer] = set(command.split(" ")[1:])
+                    writer.write(b"250 OK\r\n")
+                else:
+                    writer.write(self.reply(command).encode())
+                await writer.drain()
+                if command.upper() == "QUIT":
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # cancelled on shutdown: end quietly like Tor closing its control connections
+            pass
+        finally:
+            self.controllers.pop(writer, None)
+            writer.close()
+
+    async def openStream(self, target: str, source: tuple) -> tuple:
+        stream_id = str(self.nextStream)
+        self.nextStream += 1
+        self.emit("STREAM", f"STREAM {stream_id} NEW 0 {target} SOURCE_ADDR={source[0]}:{source[1]} PURPOSE=USER")
+        if self.leaveUnattached:
+            future = asyncio.get_running_loop().create_future()
+            self.attach[stream_id] = future
+            try:
+                circ_id = await asyncio.wait_for(future, 120)
+            except asyncio.TimeoutError:
+                circ_id = None
+            finally:
+                self.attach.pop(stream_id, None)
+        else:
+            circ_id = self.current
+        if circ_id is None:
+            self.emit("STREAM", f"STREAM {stream_id} FAILED 0 {target} REASON=TIMEOUT")
+            return stream_id, None
+        self.emit("STREAM", f"STREAM {stream_id} SENTCONNECT {circ_id} {target}")
+        return stream_id, circ_id
+
+    async def handleSocks(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await self._socks(reader, writer)
+        except asyncio.CancelledError:
+            writer.close()
+
+    async def _socks(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readexactly(2)
+            await reader.readexactly(head[1])
+            writer.write(b"\x05\x00")
+            req = await reader.readexactly(4)
+            match req[3]:
+                case 1:
+                    host = socket.inet_ntoa(await reader.readexactly(4))
+                case 4:
+                    host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+                case _:
+                    size = await reader.readexactly(1)
+                    host = (await reader.readexactly(size[0])).decode()
+            port = struct.unpack(">H", await reader.readexactly(2))[0]
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        # like Tor, streams wait until a circuit is there
+        await self.bootstrapped.wait()
+        target = f"{host}:{port}"
+        stream_id, circ_id = await self.openStream(target, writer.get_extra_info("peername")[:2])
+        upstream = None
+        if circ_id is not None:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            try:
+                upstream = await asyncio.open_connection(*(self.origin or (host, port)))
+            except OSError:
+                self.emit("STREAM", f"STREAM {stream_id} FAILED {circ_id} {target} REASON=CONNECTREFUSED")
+        if upstream is None:
+            writer.write(b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00")
+            writer.close()
+            return
+        self.emit("STREAM", f"STREAM {stream_id} SUCCEEDED {circ_id} {target}")
+        writer.write(b"\x05\x00\x00\x01\x7f\x00\x00\x01\x00\x00")
+        up_reader, up_writer = upstream
+        await asyncio.gather(self._pipe(reader, up_writer), self._pipe(up_reader, writer))
+        self.emit("STREAM", f"STREAM {stream_id} CLOSED {circ_id} {target} REASON=DONE")
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def main(argv: list) -> int:
+    if "--version" in argv:
+        print(f"Tor version {VERSION}.")
+        return 0
+    if "-f" not in argv or argv.index("-f") + 1 >= len(argv):
+        print("[!!] usage: tor -f <torrc> [!!]", file=sys.stderr)
+        return 1
+    conf = readTorrc(argv[argv.index("-f") + 1])
+    asyncio.run(FakeTor(conf, os.environ).run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
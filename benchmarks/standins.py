@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+from threading import Thread
+
+
+class StandIns:
+    """
+    Local stand-ins for the network around an Onion: a plain HTTP origin and a SOCKS5 server that
+    connects to whatever the client asks for (in practice: the origin). Both run on a private event
+    loop in a daemon thread, so benchmarks can drive bridges without a live Tor.
+    """
+    def __init__(self, body_size: int = 1024, latency: float = 0.0):
+        self.body = b"x" * body_size
+        self.latency = latency
+        self.loop = asyncio.new_event_loop()
+        self.originAddr = None
+        self.socksAddr = None
+        self._ready = threading.Event()
+        Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._startServers())
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _startServers(self) -> None:
+        origin = await asyncio.start_server(self.handleOrigin, "127.0.0.1", 0)
+        socks = await asyncio.start_server(self.handleSocks, "127.0.0.1", 0)
+        self.originAddr = origin.sockets[0].getsockname()[:2]
+        self.socksAddr = socks.sockets[0].getsockname()[:2]
+
+    async def handleOrigin(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(self.body) + self.body)
+                await writer.drain()
+                if b"connection: close" in head.lower():
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handleSocks(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readexactly(2)
+            await reader.readexactly(head[1])
+            writer.write(b"\x05\x00")
+            req = await reader.readexactly(4)
+            match req[3]:
+                case 1:
+                    await reader.readexactly(4)
+                case 4:
+                    await reader.readexactly(16)
+                case 3:
+                    size = await reader.readexactly(1)
+                    await reader.readexactly(size[0])
+            await reader.readexactly(2)
+            # every destination is routed to the local origin
+            up_reader, up_writer = await asyncio.open_connection(*self.originAddr)
+            writer.write(b"\x05\x00\x00\x01\x7f\x00\x00\x01\x00\x00")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        await asyncio.gather(self._pipe(reader, up_writer), self._pipe(up_reader, writer))
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,318 @@
+import threading
+
+from math import ceil
+from threading import Thread
+from time import monotonic
+
+from .metrics import quantile, BRIDGE_TOTAL_SECONDS
+
+
+class BagAutoscaler:
+    """
+    Grows and shrinks a running OnionsBag with the load on its bridges. Every `check` seconds the in-flight
+    requests (carousel backends plus each Onion's own HTTPBridge), the waiting client connections and the p95
+    request latency of the last interval are sampled. When the in-flight requests per Onion exceed
+    `target_inflight`, the waiting connections exceed `max_queue` per Onion or the p95 exceeds `max_p95`, new
+    Onions are planted, started, and added to the bag and, once bootstrapped, to the carousel. When the load would
+    still fit comfortably in one Onion less for `idle_after` seconds, the least busy Onion is drained: it gets no
+    new requests, its requests in flight run to their end (at most `drain_timeout` seconds), then it is removed
+    and stopped. The bag stays between `min_onions` and `max_onions`; after growing nothing changes for
+    `up_cooldown` seconds, after any change no Onion is removed for `down_cooldown` seconds.
+    """
+    def __init__(self, farmer: object, bag: object, carousel: object = None, min_onions: int = 1, max_onions: int = 10,
+                 target_inflight: float = 8, max_queue: float = None, max_p95: float = None, step: int = 2,
+                 up_cooldown: float = 30, down_cooldown: float = 120, idle_after: float = 60, low_ratio: float = 0.5,
+                 check: float = 5, drain_timeout: float = 60, bootstrap_timeout: float = 300, name: str = "scaled"):
+        """
+        Prepares the autoscaler. Nothing happens until start().
+
+        :param farmer: The OnionsFarmer that plants the new Onions.
+        :param bag: The OnionsBag to scale.
+        :param carousel: Optional CarouselProxyHttp serving the bag; new Onions join it once bootstrapped.
+        :param min_onions: Smallest bag size.
+        :param max_onions: Largest bag size, Onions still starting included.
+        :param target_inflight: In-flight requests per Onion above which the bag grows.
+        :param max_queue: Client connections waiting per Onion above which the bag grows. None disables it.
+        :param max_p95: p95 request latency in seconds above which the bag grows. None disables it.
+        :param step: Most Onions planted at once.
+        :param up_cooldown: Seconds after growing before the bag grows again.
+        :param down_cooldown: Seconds after any change before an Onion is removed.
+        :param idle_after: Seconds the load must stay low before an Onion is removed.
+        :param low_ratio: The load is low when it stays under this share of `target_inflight` with one Onion less.
+        :param check: Seconds between two samples.
+        :param drain_timeout: Seconds a draining Onion may take to finish its requests.
+        :param bootstrap_timeout: Seconds a new Onion may take to bootstrap before it is removed again.
+        :param name: Name prefix of the planted Onions.
+        """
+        self.farmer = farmer
+        self.bag = bag
+        self.carousel = carousel
+        self.minOnions = max(1, min_onions)
+        self.maxOnions = max(self.minOnions, max_onions)
+        self.targetInflight = target_inflight
+        self.maxQueue = max_queue
+        self.maxP95 = max_p95
+        self.step = max(1, step)
+        self.upCooldown = up_cooldown
+        self.downCooldown = down_cooldown
+        self.idleAfter = idle_after
+        self.lowRatio = low_ratio
+        self.check = check
+        self.drainTimeout = drain_timeout
+        self.bootstrapTimeout = bootstrap_timeout
+        self.name = name
+        self.stopEvent = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.starting = set()
+        self.draining = set()
+        self.planted = []
+        self._lastUp = None
+        self._lastChange = None
+        self._lowSince = None
+        self._lastCounts = {}
+        self.last = None
+        self.added = 0
+        self.removed = 0
+        first = bag.openBag()[0] if bag.len else None
+        # new Onions get a bridge like the bag's first one, on a free port
+        bridge = first._config.get("HttpBridge") if first else None
+        self.httpBridge = None if not bridge else ("async" if bridge.startswith("async") else "random")
+
+    def start(self) -> None:
+        """
+        Starts sampling the load and scaling the bag in a background thread.
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.stopEvent.clear()
+            self._thread = Thread(target=self._loop, name="BagAutoscaler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops scaling. Onions starting or draining finish on their own.
+        """
+        self.stopEvent.set()
+
+    def _sources(self, serving: list) -> list:
+        sources = [self.carousel.metrics] if self.carousel else []
+        for onion in serving:
+            bridge = getattr(onion, "httpBridge", None)
+            if bridge is not None and getattr(bridge, "metrics", None) is not None:
+                sources.append(bridge.metrics)
+        return sources
+
+    def _p95(self, sources: list) -> float:
+        # p95 of the requests finished since the previous sample: difference of the cumulative histograms
+        window = [0] * (len(BRIDGE_TOTAL_SECONDS.buckets) + 1)
+        counts = {}
+        for metrics in sources:
+            now = list(metrics.total.counts)
+            before = self._lastCounts.get(metrics.name, [0] * len(now))
+            counts[metrics.name] = now
+            for i, (a, b) in enumerate(zip(now, before)):
+                window[i] += max(0, a - b)
+        self._lastCounts = counts
+        return quantile(0.95, BRIDGE_TOTAL_SECONDS.buckets, window)
+
+    def sample(self) -> dict:
+        """
+        Measures the current load of the bag.
+
+        :return: Dictionary with "Serving", "Starting", "Draining", "InFlight", "Queue", "PerOnion" and "P95"
+                 (seconds, None without finished requests).
+        """
+        with self._lock:
+            busy = self.starting | self.draining
+        serving = [o for o in self.bag.openBag() if o.name not in busy and not o.stopEvent.is_set()]
+        sources = self._sources(serving)
+        connections = sum(m.active.value for m in sources)
+        outstanding = self.carousel.balancer.inFlight() if self.carousel else 0
+        inflight = outstanding
+        for onion in serving:
+            bridge = getattr(onion, "httpBridge", None)
+            if bridge is not None and getattr(bridge, "metrics", None) is not None:
+                inflight += bridge.metrics.active.value
+        carousel_waiting = self.carousel.metrics.active.value - outstanding if self.carousel else 0
+        return {
+            "Serving": len(serving),
+            "Starting": len(self.starting),
+            "Draining": len(self.draining),
+            "InFlight": inflight,
+            "Queue": max(0, carousel_waiting),
+            "PerOnion": inflight / len(serving) if serving else float(inflight),
+            "P95": self._p95(sources),
+            "Connections": connections
+        }
+
+    def decide(self, load: dict, now: float) -> int:
+        """
+        Number of Onions to add (positive) or remove (negative) for a load sample.
+        """
+        serving = load["Serving"]
+        size = serving + load["Starting"]
+        if size < self.minOnions:
+            return self.minOnions - size
+        over = load["PerOnion"] > self.targetInflight
+        if self.maxQueue is not None and serving and load["Queue"] > self.maxQueue * serving:
+            over = True
+        if self.maxP95 is not None and load["P95"] is not None and load["P95"] > self.maxP95:
+            over = True
+        if over:
+            self._lowSince = None
+            if size >= self.maxOnions or (self._lastUp is not None and now - self._lastUp < self.upCooldown):
+                return 0
+            need = ceil(load["InFlight"] / self.targetInflight) - size if self.targetInflight else 1
+            return min(self.step, self.maxOnions - size, max(1, need))
+        low = serving > self.minOnions and load["InFlight"] <= self.lowRatio * self.targetInflight * (serving - 1)
+        if not low or load["Starting"] or load["Draining"]:
+            self._lowSince = None
+            return 0
+        if self._lowSince is None:
+            self._lowSince = now
+        if now - self._lowSince < self.idleAfter:
+            return 0
+        if self._lastChange is not None and now - self._lastChange < self.downCooldown:
+            return 0
+        return -1
+
+    def tick(self) -> dict:
+        """
+        Samples the load once and scales the bag if needed.
+
+        :return: The load sample, with the decision under "Change".
+        """
+        now = monotonic()
+        load = self.sample()
+        change = self.decide(load, now)
+        load["Change"] = change
+        self.last = load
+        if change > 0:
+            self._lastUp = self._lastChange = now
+            for _ in range(change):
+                self.grow()
+        elif change < 0:
+            self._lastChange = now
+            self._lowSince = None
+            self.shrink()
+        return load
+
+    def _nextName(self) -> str:
+        taken = self.farmer.getOnion()
+        i = len(self.planted) + 1
+        while f"{self.name}{i}" in taken:
+            i += 1
+        return f"{self.name}{i}"
+
+    def grow(self) -> bool:
+        """
+        Plants and starts one more Onion; it joins the carousel once bootstrapped.
+
+        :return: True if the Onion was planted.
+        """
+        onion = self.farmer.plantOnion(name=self._nextName(), http_bridge=self.httpBridge)
+        if not onion:
+            print(f"[Autoscaler] [!!] ERROR: Can not plant a new Onion [!!]")
+            return False
+        with self._lock:
+            self.starting.add(onion.name)
+            self.planted.append(onion.name)
+        self.bag.addOnion(onion)
+        self.added += 1
+        print(f"[Autoscaler] Bag grows: {onion.name} starting")
+        Thread(target=self._join, args=(onion, ), daemon=True).start()
+        return True
+
+    def _join(self, onion: object) -> None:
+        ready = onion.state.waitReady(self.bootstrapTimeout)
+        with self._lock:
+            self.starting.discard(onion.name)
+        if not ready or onion.stopEvent.is_set():
+            print(f"[Autoscaler] [!!] ERROR: {onion.name} did not bootstrap in {self.bootstrapTimeout}s, removing it [!!]")
+            self._remove(onion)
+            return
+        if self.carousel:
+            self.carousel.addOnion(onion)
+        print(f"[Autoscaler] {onion.name} serving")
+
+    def _candidate(self) -> object:
+        # the least busy serving Onion, the ones this autoscaler planted (newest first) before the original ones
+        with self._lock:
+            busy = self.starting | self.draining
+            planted = list(self.planted)
+        serving = [o for o in self.bag.openBag() if o.name not in busy and not o.stopEvent.is_set()]
+        if len(serving) <= self.minOnions:
+            return None
+
+        def load(onion: object) -> tuple:
+            age = planted.index(onion.name) if onion.name in planted else -1
+            return (self._inFlight(onion), -age)
+
+        return min(serving, key=load)
+
+    def shrink(self) -> bool:
+        """
+        Drains and removes the least busy Onion, unless the bag is at its minimum size.
+
+        :return: True if an Onion is being drained.
+        """
+        onion = self._candidate()
+        if onion is None:
+            return False
+        with self._lock:
+            self.draining.add(onion.name)
+        onion.draining = True
+        print(f"[Autoscaler] Bag shrinks: draining {onion.name}")
+        Thread(target=self._drain, args=(onion, ), daemon=True).start()
+        return True
+
+    def _inFlight(self, onion: object) -> float:
+        count = 0
+        if self.carousel:
+            count += self.carousel.balancer.inFlight(self.carousel.backendAddr(onion))
+        bridge = getattr(onion, "httpBridge", None)
+        if bridge is not None and getattr(bridge, "metrics", None) is not None:
+            count += bridge.metrics.active.value
+        return count
+
+    def _drain(self, onion: object) -> None:
+        deadline = monotonic() + self.drainTimeout
+        while self._inFlight(onion) > 0 and monotonic() < deadline:
+            if onion.stopEvent.wait(0.2):
+                break
+        if self._inFlight(onion) > 0:
+            print(f"[Autoscaler] [!!] {onion.name} still busy after {self.drainTimeout}s, removing it anyway [!!]")
+        self._remove(onion)
+        with self._lock:
+            self.draining.discard(onion.name)
+
+    def _remove(self, onion: object) -> None:
+        if self.carousel:
+            self.carousel.removeOnion(onion)
+        self.bag.removeOnion(onion)
+        self.farmer.removeOnion(onion.name)
+        with self._lock:
+            if onion.name in self.planted:
+                self.planted.remove(onion.name)
+        self.removed += 1
+        print(f"[Autoscaler] {onion.name} removed")
+
+    def _loop(self) -> None:
+        while not self.stopEvent.wait(self.check):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[Autoscaler] [!!] ERROR: {e} [!!]")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "Size": self.bag.len,
+                "Starting": sorted(self.starting),
+                "Draining": sorted(self.draining),
+                "Added": self.added,
+                "Removed": self.removed,
+                "Last": dict(self.last) if self.last else None
+            }
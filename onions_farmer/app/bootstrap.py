@@ -0,0 +1,169 @@
+import threading
+
+from concurrent.futures import Future
+from threading import Thread
+from time import monotonic
+from typing import Union
+
+from .tools.token_bucket import TokenBucket
+
+
+class BootstrapScheduler:
+    """
+    Starts the Onions of a bag in a controlled way instead of all at once. At most `concurrency` Tor processes
+    are bootstrapping at the same time, new processes are paced by a token bucket (`rate` starts per second),
+    and Onions are started in priority order. A slot is held from the moment an Onion is started until it is
+    fully bootstrapped (or gives up after `timeout` seconds), so a slow instance never delays the others more
+    than necessary.
+
+    `ready` is a Future resolved with the list of ready Onions as soon as the first `first` of them reach 100%,
+    so traffic can start flowing before the slowest instance finishes. `done` resolves once every Onion has
+    either bootstrapped or failed.
+    """
+    def __init__(self, onions: list, concurrency: int = 8, rate: float = 2, burst: int = None, priority: object = None,
+                 first: int = None, progress: object = None, timeout: float = 300):
+        """
+        Prepares the scheduler. Nothing is started until start().
+
+        :param onions: The Onion objects to start.
+        :param concurrency: Maximum number of Onions bootstrapping at the same time. 0 or None means no limit.
+        :param rate: Maximum Tor process starts per second. 0 or None disables pacing.
+        :param burst: Number of starts allowed at once before pacing applies. Defaults to `concurrency`.
+        :param priority: Optional callable returning a sort key for an Onion; lower keys start first. Without it
+                         the bag order is kept.
+        :param first: Number of ready Onions that resolves the `ready` future. Defaults to all of them.
+        :param progress: Optional callable `progress(onion, ready, total)` called each time an Onion reaches 100%.
+        :param timeout: Seconds an Onion may take to bootstrap before its slot is given to the next one.
+        """
+        self.onions = sorted(onions, key=priority) if priority else list(onions)
+        self.total = len(self.onions)
+        self.concurrency = concurrency or self.total or 1
+        self.bucket = TokenBucket(rate, burst or self.concurrency)
+        self.first = min(first or self.total, self.total)
+        self.progressCallback = progress
+        self.timeout = timeout
+        self.stopEvent = threading.Event()
+        self.ready = Future()
+        self.done = Future()
+        self.readyOnions = []
+        self.failedOnions = []
+        self.startTimes = {}
+        self._slots = threading.Semaphore(self.concurrency)
+        self._lock = threading.RLock()
+        self._finished = 0
+        self._dispatcher = None
+
+    def start(self) -> Future:
+        """
+        Starts the dispatcher thread that launches the Onions.
+
+        :return: The `ready` future.
+        """
+        if not self.total:
+            self.ready.set_result([])
+            self.done.set_result([])
+            return self.ready
+        self._dispatcher = Thread(target=self._dispatch, name="BootstrapScheduler", daemon=True)
+        self._dispatcher.start()
+        return self.ready
+
+    def stop(self) -> None:
+        """
+        Stops launching Onions that are still waiting for a slot. Onions already started are not touched.
+        """
+        self.stopEvent.set()
+
+    def pending(self) -> int:
+        """
+        Returns the number of Onions that have not finished bootstrapping yet.
+        """
+        with self._lock:
+            return self.total - self._finished
+
+    def _dispatch(self) -> None:
+        for onion in self.onions:
+            while not self._slots.acquire(timeout=0.5):
+                if self.stopEvent.is_set():
+                    break
+            if self.stopEvent.is_set() or not self.bucket.take(stop=self.stopEvent):
+                break
+            if not onion.is_alive():
+                try:
+                    onion.start()
+                except RuntimeError as e:
+                    print(f"[!!] ERROR: Can not start {onion.name}: {e} [!!]")
+                    self.startTimes[onion.name] = monotonic()
+                    self._slots.release()
+                    self._finish(onion, False)
+                    continue
+            self.startTimes[onion.name] = monotonic()
+            Thread(target=self._watch, args=(onion, ), daemon=True).start()
+        if self.stopEvent.is_set():
+            self._resolve(final=True)
+
+    def _watch(self, onion: object) -> None:
+        deadline = monotonic() + self.timeout if self.timeout else None
+        ok = False
+        while not self.stopEvent.is_set() and not onion.stopEvent.is_set() and onion.is_alive():
+            left = deadline - monotonic() if deadline else 1
+            if left <= 0:
+                break
+            if onion.state.waitReady(min(1, left)):
+                ok = True
+                break
+        self._slots.release()
+        self._finish(onion, ok)
+
+    def _finish(self, onion: object, ok: bool) -> None:
+        with self._lock:
+            self._finished += 1
+            if ok:
+                self.readyOnions.append(onion)
+                count = len(self.readyOnions)
+            else:
+                self.failedOnions.append(onion)
+        if ok:
+            elapsed = monotonic() - self.startTimes[onion.name]
+            print(f"[{onion.name}] Bootstrapped in {elapsed:.1f}s ({count}/{self.total})")
+            if self.progressCallback:
+                try:
+                    self.progressCallback(onion, count, self.total)
+                except Exception as e:
+                    print(f"[!!] ERROR: bootstrap progress callback: {e} [!!]")
+        elif not self.stopEvent.is_set():
+            print(f"[!!] ERROR: {onion.name} did not bootstrap [!!]")
+        self._resolve()
+
+    def _resolve(self, final: bool = False) -> None:
+        with self._lock:
+            ready = list(self.readyOnions)
+            final = final or self._finished >= self.total
+            if not self.ready.done() and (len(ready) >= self.first or final):
+                self.ready.set_result(ready)
+            if final and not self.done.done():
+                self.done.set_result(ready)
+
+    def stats(self) -> dict:
+        """
+        Returns a summary of the bootstrap progress.
+        """
+        with self._lock:
+            return {
+                "Total": self.total,
+                "Started": len(self.startTimes),
+                "Ready": len(self.readyOnions),
+                "Failed": len(self.failedOnions),
+                "Pending": self.total - self._finished
+            }
+
+    def wait(self, timeout: float = None) -> Union[list, bool]:
+        """
+        Blocks until the first `first` Onions are ready.
+
+        :param timeout: Seconds to wait, None waits forever.
+        :return: The list of ready Onions, or None on timeout.
+        """
+        try:
+            return self.ready.result(timeout)
+        except Exception:
+            return None
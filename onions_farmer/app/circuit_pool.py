@@ -0,0 +1,200 @@
+import threading
+
+from time import monotonic
+from typing import Union
+
+
+class CircuitPool:
+    """
+    Keeps a standby set of pre-built circuits for one Onion and attaches new streams itself, so a new identity
+    is a switch to an already built circuit instead of a NEWNYM followed by a wait for Tor to build one.
+
+    With the pool running Tor is told to leave new streams unattached (__LeaveStreamsUnattached) and every
+    STREAM NEW event is answered with ATTACHSTREAM to the active circuit. Standby circuits are built with
+    EXTENDCIRCUIT 0 (path chosen by Tor) and tracked through CIRC events; whenever one is used or lost another
+    one is built in the background. Circuits retired by a switch keep serving the streams already on them and
+    are closed once those streams end, as after a NEWNYM.
+    """
+    def __init__(self, farmer: object, size: int = 2):
+        """
+        Prepares the pool. Nothing is sent to Tor until start().
+
+        :param farmer: The Farmer of the Onion, used for control port commands and events.
+        :param size: Number of standby circuits to keep ready.
+        """
+        self.farmer = farmer
+        self.name = farmer.name
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self.active = None
+        self.standby = []
+        self.building = set()
+        self.retired = set()
+        self.switches = 0
+        self.running = False
+        self._listening = False
+
+    def start(self) -> bool:
+        """
+        Takes over stream attachment and starts building the standby circuits.
+
+        :return: True if Tor accepted the configuration, False otherwise.
+        """
+        reply = self.farmer.request("SETCONF __LeaveStreamsUnattached=1")
+        if not reply or not reply.ok:
+            print(f"[{self.name}] [!!] ERROR: Circuit pool: Tor refused __LeaveStreamsUnattached [!!]")
+            return False
+        self.running = True
+        if not self._listening:
+            self.farmer.addEventListener(self.handleEvent)
+            self._listening = True
+        self.fill()
+        print(f"[{self.name}] Circuit pool started: {self.size} standby circuits")
+        return True
+
+    def stop(self) -> None:
+        """
+        Gives stream attachment back to Tor.
+        """
+        self.running = False
+        self.farmer.sendMsg("SETCONF __LeaveStreamsUnattached=0")
+
+    def reset(self) -> None:
+        """
+        Forgets every circuit without telling Tor, after the Tor process is gone. start() builds a new pool.
+        """
+        with self._lock:
+            self.running = False
+            self.active = None
+            self.standby.clear()
+            self.building.clear()
+            self.retired.clear()
+
+    @property
+    def ready(self) -> int:
+        with self._lock:
+            return len(self.standby)
+
+    def fill(self) -> None:
+        """
+        Requests as many new circuits as needed to get back to `size` standby circuits. Non-blocking: the circuit
+        ids arrive in the EXTENDCIRCUIT replies and the circuits join the standby set on their CIRC BUILT events.
+        """
+        if not self.running:
+            return
+        with self._lock:
+            missing = self.size - len(self.standby) - len(self.building) + (0 if self.active else 1)
+        for _ in range(max(0, missing)):
+            future = self.farmer.sendMsg("EXTENDCIRCUIT 0 purpose=general")
+            future.add_done_callback(self._extended)
+
+    def _extended(self, future: object) -> None:
+        # runs on the control reader thread: record the id only, never wait for another reply here
+        try:
+            reply = future.result()
+        except Exception:
+            return
+        if not reply.ok or not reply.lines[0].startswith("EXTENDED "):
+            print(f"[{self.name}] [!!] ERROR: Circuit pool: EXTENDCIRCUIT failed: {reply.raw.strip()} [!!]")
+            return
+        circ_id = reply.lines[0].split(" ")[1]
+        with self._lock:
+            built = self.farmer.state.circuits.get(circ_id, {}).get("status") == "BUILT"
+            if built:
+                self._addReady(circ_id)
+            else:
+                self.building.add(circ_id)
+
+    def _addReady(self, circ_id: str) -> None:
+        if not self.active:
+            self.active = circ_id
+        elif circ_id != self.active and circ_id not in self.standby:
+            self.standby.append(circ_id)
+
+    def handleEvent(self, reply: object) -> None:
+        """
+        Control event listener: keeps the pool in sync with CIRC events and attaches new streams.
+        """
+        if not self.running:
+            return
+        match reply.event:
+            case "CIRC":
+                self._circ(reply.lines[0].split(" "))
+            case "STREAM":
+                self._stream(reply.lines[0].split(" "))
+
+    def _circ(self, parts: list) -> None:
+        if len(parts) < 3:
+            return
+        circ_id, status = parts[1], parts[2]
+        refill = False
+        with self._lock:
+            if status == "BUILT" and circ_id in self.building:
+                self.building.discard(circ_id)
+                self._addReady(circ_id)
+            elif status in ("FAILED", "CLOSED"):
+                if circ_id in self.building or circ_id in self.standby or circ_id == self.active:
+                    refill = True
+                self.building.discard(circ_id)
+                self.retired.discard(circ_id)
+                if circ_id in self.standby:
+                    self.standby.remove(circ_id)
+                if circ_id == self.active:
+                    self.active = self.standby.pop(0) if self.standby else None
+        if refill:
+            self.fill()
+
+    def _stream(self, parts: list) -> None:
+        # STREAM <id> <status> <circ id> <target> ...
+        if len(parts) < 4:
+            return
+        stream_id, status, circ_id = parts[1], parts[2], parts[3]
+        if status in ("NEW", "NEWRESOLVE", "DETACHED"):
+            with self._lock:
+                target = self.active or "0"
+            # on DETACHED the active circuit could not carry the stream (exit policy): let Tor choose
+            if status == "DETACHED" and circ_id == target:
+                target = "0"
+            self.farmer.sendMsg(f"ATTACHSTREAM {stream_id} {target}")
+        elif status in ("CLOSED", "FAILED"):
+            self._closeRetired(circ_id)
+
+    def _closeRetired(self, circ_id: str) -> None:
+        with self._lock:
+            if circ_id not in self.retired:
+                return
+            busy = any(s["circuit"] == circ_id for s in list(self.farmer.state.streams.values()))
+            if busy:
+                return
+            self.retired.discard(circ_id)
+        self.farmer.sendMsg(f"CLOSECIRCUIT {circ_id} IfUnused")
+
+    def switch(self) -> Union[float, bool]:
+        """
+        Moves new streams to a standby circuit at once and builds a replacement in the background.
+
+        :return: Milliseconds the switch took, or None if no standby circuit was ready.
+        """
+        start = monotonic()
+        with self._lock:
+            if not self.running or not self.standby:
+                return None
+            old = self.active
+            self.active = self.standby.pop(0)
+            if old:
+                self.retired.add(old)
+            self.switches += 1
+        if old:
+            self._closeRetired(old)
+        self.fill()
+        return (monotonic() - start) * 1000
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "Active": self.active,
+                "Standby": list(self.standby),
+                "Building": len(self.building),
+                "Retired": len(self.retired),
+                "Switches": self.switches
+            }
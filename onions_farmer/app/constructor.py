@@ -1,10 +1,13 @@
 import os
 import sys
+import stat
 import subprocess
 
 from pathlib import Path
 from typing import Union
 
+from .dir_cache import DirCache
+
 
 class TorConstructor:
     """
@@ -14,6 +17,7 @@ class TorConstructor:
     component for managing Tor instances in a scalable and organized manner. Requires Tor to be installed
     and Python version 3.11 or newer.
     """
+    torVersion = None
 
     def __init__(self, onions_dir_path: str = None):
         """
@@ -35,7 +39,9 @@ class TorConstructor:
         self.dirLogs = os.path.join(self.dirMainOnions, "logs")
         self.dirTorrc = os.path.join(self.dirMainOnions, "config")
         self.dirTorLib = os.path.join(self.dirMainOnions, "lib")
+        self.dirCache = os.path.join(self.dirMainOnions, "cache")
         self.firstStage()
+        self.DirCache = DirCache(self.dirCache)
 
     
     def setOnionsDir(self, onions_dir: Union[bool, str]) -> str:
@@ -67,36 +73,30 @@ class TorConstructor:
         :return: True if all directories were successfully created and false otherwise.
         """
         dirs = [self.dirMainOnions, self.dirCtrlSocket, self.dirLogs, self.dirTorrc, self.dirTorLib]
-        for d in dirs:
-            if not os.path.exists(d):
-                try:
-                    os.mkdir(d)
-                except OSError as e:
-                    print(f"[!!] TOR Construtor ERROR: make {d} dirs : {e} [!!]")
-                    return False
-        
-        # Set permissions for control socket directory
         try:
-            out = subprocess.run(["chmod", "750", self.dirCtrlSocket], capture_output=True, check=True, text=True)
-            if out.returncode == 0:
-                print("Prepare Dir Successfull")
-            else:
-                print(f"[!!] ERROR: {out.stderr} [!!]")
-                return False
-        except Exception as e:
-            print(f"[!!] ERROR: {e} [!!]")
+            for d in dirs:
+                os.makedirs(d, exist_ok=True)
+            # Set permissions for control socket directory
+            os.chmod(self.dirCtrlSocket, 0o750)
+        except OSError as e:
+            print(f"[!!] TOR Construtor ERROR: prepare dirs : {e} [!!]")
             return False
+        print("Prepare Dir Successfull")
         return True
     
     def isTorInstalled(self) -> bool:
         """
         Verifies if Tor is installed by attempting to run the 'tor --version' command. It provides a clear indication
-        if Tor is correctly installed on the system and accessible from the command line.
+        if Tor is correctly installed on the system and accessible from the command line. The detected version is
+        cached for the whole process, so further TorConstructor objects do not spawn Tor again.
 
         :return: True if Tor is installed, False otherwise.
         """
+        if TorConstructor.torVersion:
+            return True
         try:
             out = subprocess.run(["tor", "--version"], capture_output=True, check=True, text=True)
+            TorConstructor.torVersion = out.stdout.strip()
             print("Good. Tor is installed")
             print(out.stdout)
             return True
@@ -202,20 +202,26 @@ class TorConstructor:
                 case "OutSocks":
                     if i:
                         buff += f"\n## Outside Proxy addr: {i}\nSocksPort {i}\n"
+                case "ControlPort":
+                    if i:
+                        buff += f"\n## Control Port addr: 127.0.0.1:{i}\nControlPort 127.0.0.1:{i}\n"
                 case "DebugLog":
                     if i:
                         buff += f"\n## Send every possible message\nLog debug file {i}\n"
         return buff
 
         
-    def makeConfig(self, conf: dict) -> Union[dict, bool]:
+    def makeConfig(self, conf: dict, templates: dict = None) -> Union[dict, bool]:
         """
         Generates the complete Tor configuration file based on the provided 'config' dictionary and writes it
-        to the filesystem. It also handles directory creation and permission setting for Tor's data directory.
+        to the filesystem. It also handles directory creation and permission setting for Tor's data directory,
+        and seeds a new data directory from the shared directory cache unless 'DirCache' is set to False.
         Returns a dictionary with paths and configuration details necessary to start Tor if successful, or None
         if an error occurs during the process.
 
         :param conf: A dictionary containing the configuration details for a Tor instance.
+        :param templates: Optional. A dictionary caching loaded torrc templates by path, shared by makeConfigs() so
+                          every template is read only once per batch.
         :return: A dictionary with configuration details and paths if successful, None otherwise.
         """
 
@@ -230,26 +236,38 @@ class TorConstructor:
         if conf.get("DebugLog"):
             conf["DebugLog"] = os.path.join(self.dirLogs, f"{name}_debug.txt")
         conf["DirLib"] = os.path.join(self.dirTorLib, name)
-        if not os.path.exists(conf["DirLib"]):
-            try:
-                os.mkdir(conf["DirLib"])
-            except OSError as e:
-                print(f"[!!] TOR Constructor ERROR: make Tor lib directory: {e} [!!]")
-                return None
         try:
-            check = subprocess.run(["chmod", "g+s,g-x", conf["DirLib"]], capture_output=True, check=True, text=True)
-            if check.returncode != 0:
-                print(f"[!!] TOR Constructor ERROR: chmod Lib Dir: {check.stderr} [!!]")
-                return None
-        except Exception as e:
-            print(f"[!!] TOR Construtcor ERROR: {e} [!!]")
+            os.makedirs(conf["DirLib"], exist_ok=True)
+            # chmod g+s,g-x
+            mode = stat.S_IMODE(os.stat(conf["DirLib"]).st_mode)
+            os.chmod(conf["DirLib"], (mode | stat.S_ISGID) & ~stat.S_IXGRP)
+        except OSError as e:
+            print(f"[!!] TOR Constructor ERROR: prepare Tor lib directory: {e} [!!]")
             return None
+        if conf.get("DirCache", True):
+            conf["DirCache"] = self.dirCache
+            if self.DirCache.seed(conf["DirLib"]):
+                print(f"[{name}] Tor data directory seeded from directory cache")
 
-        temp = self.choseTorrc(conf)
-        tor_conf = temp + self.prepareConf(conf)
+        if templates is None:
+            templates = {}
+        key = conf.get("Torrc")
+        if key not in templates:
+            templates[key] = self.choseTorrc(conf)
+        tor_conf = templates[key] + self.prepareConf(conf)
         conf["Torrc"] = os.path.join(self.dirTorrc, name)
         if self.makeFile(conf["Torrc"], tor_conf):
             return conf
         else:
             return None
+    
+    def makeConfigs(self, confs: list) -> list:
+        """
+        Batched version of makeConfig() for creating many Onions at once. All torrc files are written in one pass,
+        each torrc template is loaded only once, and no external process is spawned.
 
+        :param confs: A list of configuration dictionaries, one per Tor instance.
+        :return: A list of the same length with the prepared configuration dictionaries, None for failed entries.
+        """
+        templates = {}
+        return [self.makeConfig(conf, templates) for conf in confs]
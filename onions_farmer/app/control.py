@@ -0,0 +1,221 @@
+import socket
+import threading
+
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread
+from typing import Union
+
+
+class ControlReply:
+    """
+    A complete reply (or asynchronous event) read from the Tor control port. Tor replies consist of one or
+    more lines sharing a three-digit status code: "250-" mid lines, "250+" lines followed by a data block
+    terminated with a single ".", and one final "250 " end line. Asynchronous events use the same framing
+    with a 6xx status code.
+    """
+    def __init__(self):
+        self.status = None
+        self.lines = []
+        self.data = {}
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 250
+
+    @property
+    def isEvent(self) -> bool:
+        return self.status is not None and 600 <= self.status < 700
+
+    @property
+    def event(self) -> Union[str, bool]:
+        """
+        The event keyword (e.g. "CIRC", "STATUS_CLIENT") of an asynchronous event, None for plain replies.
+        """
+        if not self.isEvent or not self.lines:
+            return None
+        return self.lines[0].split(" ", 1)[0]
+
+    @property
+    def raw(self) -> str:
+        """
+        The reply rebuilt in wire format, as returned by Farmer.sendCMD().
+        """
+        out = []
+        for i, line in enumerate(self.lines):
+            if line in self.data:
+                out.append(f"{self.status}+{line}\r\n{self.data[line]}\r\n.\r\n")
+            else:
+                sep = " " if i == len(self.lines) - 1 else "-"
+                out.append(f"{self.status}{sep}{line}\r\n")
+        return "".join(out)
+
+    def __str__(self) -> str:
+        return self.raw
+
+
+class ControlConnection:
+    """
+    A multiplexed connection to a Tor control socket. One reader thread parses every reply and event.
+    Commands are written under a lock together with a Future queued in the same order, and Tor answers
+    commands strictly in order, so each reply resolves the Future of the command that caused it. Any number
+    of callers may have commands in flight at once. Asynchronous 6xx events go to the registered listeners.
+    """
+    def __init__(self, path: str, name: str = "Control", encoding: str = "utf-8", raw_len: int = 4096):
+        """
+        Prepares a control connection for the UNIX socket at `path`. Nothing is opened until connect().
+
+        :param path: Path to the Tor ControlSocket.
+        :param name: Name used in console messages, usually the Onion name.
+        :param encoding: Text encoding of the control protocol.
+        :param raw_len: Size of a single socket read.
+        """
+        self.path = path
+        self.name = name
+        self.encoding = encoding
+        self.raw_len = raw_len
+        self.sock = None
+        self.connected = False
+        self._pending = deque()
+        self._writeLock = threading.Lock()
+        self._listeners = []
+        self._reader = None
+
+    def connect(self, timeout: float = 2) -> bool:
+        """
+        Opens the control socket and starts the reader thread.
+
+        :param timeout: Seconds to wait for the socket connection.
+        :return: True if connected, False otherwise.
+        """
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(self.path)
+            sock.settimeout(None)
+        except OSError:
+            return False
+        self.sock = sock
+        self.connected = True
+        self._reader = Thread(target=self._readLoop, name=f"CTRL_{self.name}", daemon=True)
+        self._reader.start()
+        return True
+
+    def addListener(self, callback: object) -> None:
+        """
+        Registers `callback(reply: ControlReply)` for asynchronous events. Callbacks run on the reader
+        thread and must not block; they must never wait for a command reply themselves.
+        """
+        self._listeners.append(callback)
+
+    def removeListener(self, callback: object) -> None:
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def send(self, command: str) -> Future:
+        """
+        Writes a command and returns a Future resolved with its ControlReply. If the connection is closed
+        the Future fails with ConnectionError.
+
+        :param command: Control command, with or without the trailing CRLF.
+        """
+        future = Future()
+        if not command.endswith("\r\n"):
+            command += "\r\n"
+        with self._writeLock:
+            if not self.connected:
+                future.set_exception(ConnectionError("control connection closed"))
+                return future
+            self._pending.append(future)
+            try:
+                self.sock.sendall(command.encode(self.encoding))
+            except OSError as e:
+                self._pending.remove(future)
+                future.set_exception(ConnectionError(f"control send failed: {e}"))
+        return future
+
+    def request(self, command: str, timeout: float = 10) -> Union[ControlReply, bool]:
+        """
+        Sends a command and waits for its reply.
+
+        :param command: Control command.
+        :param timeout: Seconds to wait for the reply.
+        :return: The ControlReply, or None on timeout or closed connection.
+        """
+        try:
+            return self.send(command).result(timeout)
+        except Exception:
+            return None
+
+    def close(self) -> None:
+        """
+        Closes the socket; the reader thread then fails every command still waiting for a reply.
+        """
+        self.connected = False
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+    def _dispatch(self, reply: ControlReply) -> None:
+        if reply.isEvent:
+            for callback in list(self._listeners):
+                try:
+                    callback(reply)
+                except Exception as e:
+                    print(f"[{self.name}] [!!] ERROR: control event listener: {e} [!!]")
+            return
+        with self._writeLock:
+            future = self._pending.popleft() if self._pending else None
+        if future and not future.done():
+            future.set_result(reply)
+
+    def _lines(self) -> object:
+        buff = bytearray()
+        while True:
+            end = buff.find(b"\r\n")
+            if end >= 0:
+                line = bytes(buff[:end]).decode(self.encoding, "replace")
+                del buff[:end + 2]
+                yield line
+                continue
+            try:
+                recv = self.sock.recv(self.raw_len)
+            except OSError:
+                return
+            if not recv:
+                return
+            buff += recv
+
+    def _readLoop(self) -> None:
+        lines = self._lines()
+        reply = ControlReply()
+        try:
+            for line in lines:
+                if len(line) < 4:
+                    continue
+                reply.status = int(line[:3])
+                sep, text = line[3], line[4:]
+                reply.lines.append(text)
+                if sep == "+":
+                    block = []
+                    for data in lines:
+                        if data == ".":
+                            break
+                        block.append(data[1:] if data.startswith("..") else data)
+                    reply.data[text] = "\r\n".join(block)
+                elif sep == " ":
+                    self._dispatch(reply)
+                    reply = ControlReply()
+        except ValueError as e:
+            print(f"[{self.name}] [!!] ERROR: malformed control reply: {e} [!!]")
+        finally:
+            self.connected = False
+            with self._writeLock:
+                pending = list(self._pending)
+                self._pending.clear()
+            for future in pending:
+                if not future.done():
+                    future.set_exception(ConnectionError("control connection closed"))
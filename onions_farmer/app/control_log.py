@@ -0,0 +1,262 @@
+import os
+import json
+import atexit
+import threading
+
+from queue import Queue, Empty, Full
+from datetime import datetime
+from threading import Thread
+from time import time
+
+from .metrics import CONTROL_LOG_DROPPED
+
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+QUEUE_SIZE = 10000
+BATCH = 512
+
+
+class LogWriter:
+    """
+    One background thread writing the control logs of every Onion. Records are put on a bounded queue and the
+    caller returns at once; a full queue drops the record instead of blocking the control path. Each log file
+    keeps one open handle, lines are written in batches and flushed when the queue runs empty, and a file
+    growing past its size limit is rotated (name.1, name.2, ...). The thread ends by itself once no file is
+    open and nothing is queued.
+    """
+    _lock = threading.Lock()
+    _shared = None
+
+    @classmethod
+    def shared(cls) -> object:
+        with cls._lock:
+            if cls._shared is None:
+                cls._shared = cls()
+                atexit.register(cls._shared.flush)
+            return cls._shared
+
+    def __init__(self, queue_size: int = QUEUE_SIZE, idle: float = 1):
+        self.idle = idle
+        self._queue = Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._files = {}
+        self._failed = set()
+        self._closing = set()
+        self.written = 0
+        self.dropped = 0
+
+    def put(self, record: tuple) -> bool:
+        """
+        Queues a record without waiting.
+
+        :param record: (ControlLog, time, level, text, fields).
+        :return: False if the queue is full and the record was dropped.
+        """
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            return False
+        self._start()
+        return True
+
+    def _start(self) -> None:
+        # under the lock: the thread may be deciding to end right now
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="ControlLog", daemon=True)
+                self._thread.start()
+
+    def close(self, log: object) -> None:
+        """
+        Flushes and closes the handle of `log` once the records queued before are written. Never waits: with a
+        full queue the handle is closed as soon as the queue runs empty.
+        """
+        try:
+            self._queue.put_nowait(("close", log))
+        except Full:
+            with self._lock:
+                self._closing.add(log.path)
+        self._start()
+
+    def flush(self, timeout: float = 5) -> bool:
+        """
+        Waits until every record queued so far is on disk.
+
+        :return: False if the writer did not get there within `timeout` seconds.
+        """
+        if self._thread is None and self._queue.empty():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(("flush", done), timeout=timeout)
+        except Full:
+            return False
+        self._start()
+        return done.wait(timeout)
+
+    def _open(self, log: object) -> object:
+        handle = self._files.get(log.path)
+        if handle:
+            return handle
+        try:
+            f = open(log.path, "a", encoding="utf-8")
+        except OSError as e:
+            if log.path not in self._failed:
+                print(f"[{log.name}] [!!] ERROR Control Log: {e} [!!]")
+                self._failed.add(log.path)
+            return None
+        self._failed.discard(log.path)
+        handle = {"file": f, "size": os.fstat(f.fileno()).st_size}
+        self._files[log.path] = handle
+        return handle
+
+    def _closeFile(self, path: str) -> None:
+        handle = self._files.pop(path, None)
+        if handle:
+            try:
+                handle["file"].close()
+            except OSError:
+                pass
+
+    def _rotate(self, log: object, handle: dict, length: int) -> object:
+        # the Onion truncates its log on start, so trust the file before rotating
+        handle["file"].flush()
+        handle["size"] = os.fstat(handle["file"].fileno()).st_size
+        if handle["size"] + length <= log.maxBytes or not handle["size"]:
+            return handle
+        self._closeFile(log.path)
+        try:
+            if log.backups:
+                for i in range(log.backups - 1, 0, -1):
+                    if os.path.exists(f"{log.path}.{i}"):
+                        os.replace(f"{log.path}.{i}", f"{log.path}.{i + 1}")
+                os.replace(log.path, f"{log.path}.1")
+            else:
+                os.truncate(log.path, 0)
+        except OSError as e:
+            print(f"[{log.name}] [!!] ERROR Control Log rotation: {e} [!!]")
+        return self._open(log)
+
+    def _write(self, batch: list) -> None:
+        for record in batch:
+            match record:
+                case ("close", log):
+                    self._closeFile(log.path)
+                    continue
+                case ("flush", done):
+                    self._flushAll()
+                    done.set()
+                    continue
+            log = record[0]
+            handle = self._open(log)
+            if handle is None:
+                continue
+            line = log.format(*record[1:])
+            if log.maxBytes and handle["size"] + len(line) > log.maxBytes:
+                handle = self._rotate(log, handle, len(line))
+                if handle is None:
+                    continue
+            try:
+                handle["file"].write(line)
+            except OSError as e:
+                print(f"[{log.name}] [!!] ERROR Control Log: {e} [!!]")
+                self._closeFile(log.path)
+                continue
+            handle["size"] += len(line)
+            self.written += 1
+
+    def _flushAll(self) -> None:
+        for path, handle in list(self._files.items()):
+            try:
+                handle["file"].flush()
+            except OSError as e:
+                print(f"[!!] ERROR Control Log {path}: {e} [!!]")
+                self._closeFile(path)
+
+    def _closeDeferred(self) -> None:
+        # closes asked for while the queue was full, once the records queued before them are written
+        with self._lock:
+            paths, self._closing = self._closing, set()
+        for path in paths:
+            self._closeFile(path)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.idle)]
+            except Empty:
+                self._closeDeferred()
+                with self._lock:
+                    if not self._files and self._queue.empty() and not self._closing:
+                        self._thread = None
+                        return
+                continue
+            while len(batch) < BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"[!!] ERROR Control Log: {e} [!!]")
+            if self._queue.empty():
+                self._flushAll()
+                self._closeDeferred()
+
+
+class ControlLog:
+    """
+    Control port log of one Onion. log() only checks the level and queues the record; formatting and disk
+    writes happen on the shared LogWriter thread.
+    """
+    def __init__(self, path: str, name: str, level: str = "debug", fmt: str = "text", max_bytes: int = 10 * 1024 * 1024,
+                 backups: int = 3, writer: object = None):
+        """
+        Prepares the log. The file is opened by the writer with the first record.
+
+        :param path: The log file.
+        :param name: The Onion name, put in JSON records.
+        :param level: Lowest level written: "debug", "info", "warning" or "error".
+        :param fmt: "text" for the classic "date -- message" lines, "json" for one JSON object per line.
+        :param max_bytes: Size that rotates the file, 0 never rotates.
+        :param backups: Rotated files kept next to the log.
+        :param writer: The LogWriter, the shared one by default.
+        """
+        self.path = path
+        self.name = name
+        self.level = LEVELS.get(str(level).lower(), LEVELS["debug"])
+        self.json = str(fmt).lower() == "json"
+        self.maxBytes = max_bytes or 0
+        self.backups = max(0, backups)
+        self.writer = writer or LogWriter.shared()
+        self._dropped = CONTROL_LOG_DROPPED.labels(name)
+
+    def enabled(self, level: str) -> bool:
+        return LEVELS.get(level, LEVELS["info"]) >= self.level
+
+    def log(self, text: str, level: str = "info", **fields) -> None:
+        """
+        Queues a record, dropping it if the level is filtered out or the writer is behind.
+
+        :param text: The message.
+        :param level: "debug", "info", "warning" or "error".
+        :param fields: Extra keys put in JSON records.
+        """
+        if LEVELS.get(level, LEVELS["info"]) < self.level:
+            return
+        if not self.writer.put((self, time(), level, text, fields)):
+            self._dropped.inc()
+
+    def format(self, created: float, level: str, text: str, fields: dict) -> str:
+        stamp = datetime.fromtimestamp(created)
+        if not self.json:
+            return f"{stamp.strftime('%d:%m:%Y  %H:%M')} -- {text}\n"
+        record = {"time": stamp.isoformat(timespec="milliseconds"), "onion": self.name, "level": level, "message": text.strip()}
+        record.update(fields)
+        return json.dumps(record, default=str) + "\n"
+
+    def close(self) -> None:
+        self.writer.close(self)
@@ -0,0 +1,153 @@
+import os
+import re
+import shutil
+import threading
+
+from datetime import datetime, timezone
+from typing import Union
+
+
+class DirCache:
+    """
+    Shared, read-only cache of the Tor directory documents (microdescriptor consensus, microdescriptors and
+    authority certificates) kept in the "cache" directory next to the Onions data directories. A new Onion
+    data directory is seeded from it before Tor starts, so the instance only has to fetch what changed
+    instead of downloading the whole consensus and every microdescriptor again. The cache is refreshed from
+    any bootstrapped Onion whose consensus is newer, file by file through a temporary file and os.replace(),
+    so readers never see a half written document.
+    """
+    # Tor replaces these files with rename(), never writes them in place: safe to share one inode
+    LINK_FILES = ("cached-microdesc-consensus", "cached-microdescs", "cached-certs")
+    # Tor appends to the microdescriptor journal: every data directory needs its own copy
+    COPY_FILES = ("cached-microdescs.new", )
+    CONSENSUS = "cached-microdesc-consensus"
+    HEADER_LEN = 4096
+
+    def __init__(self, cache_dir: str):
+        """
+        Initializes the cache in `cache_dir`, creating the directory if needed.
+
+        :param cache_dir: Directory holding the shared directory documents.
+        """
+        self.dirCache = cache_dir
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(self.dirCache, exist_ok=True)
+        except OSError as e:
+            print(f"[!!] ERROR: make directory cache {self.dirCache}: {e} [!!]")
+
+    @classmethod
+    def consensusTimes(cls, data_dir: str) -> Union[dict, bool]:
+        """
+        Reads the validity times from the header of the consensus stored in `data_dir`.
+
+        :param data_dir: A Tor data directory or the cache directory.
+        :return: Dictionary with "valid-after", "fresh-until" and "valid-until" datetimes, or None if there is no
+                 readable consensus.
+        """
+        path = os.path.join(data_dir, cls.CONSENSUS)
+        try:
+            with open(path, "r", errors="replace") as f:
+                head = f.read(cls.HEADER_LEN)
+        except OSError:
+            return None
+        times = {}
+        for key, stamp in re.findall(r"^(valid-after|fresh-until|valid-until) (\S+ \S+)$", head, re.M):
+            try:
+                times[key] = datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+            except ValueError:
+                return None
+        if len(times) != 3:
+            return None
+        return times
+
+    @property
+    def isFresh(self) -> bool:
+        """
+        True if the cached consensus is still valid, i.e. worth seeding new data directories with.
+        """
+        times = self.consensusTimes(self.dirCache)
+        return bool(times and times["valid-until"] > datetime.now(timezone.utc))
+
+    def _newer(self, src: str, dst: str) -> bool:
+        src_times = self.consensusTimes(src)
+        if not src_times:
+            return False
+        dst_times = self.consensusTimes(dst)
+        return not dst_times or src_times["valid-after"] > dst_times["valid-after"]
+
+    def _link(self, src: str, dst: str) -> None:
+        # hardlink when possible (same filesystem), full copy otherwise
+        tmp = f"{dst}.seed"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+    def _copy(self, src: str, dst: str, mode: int = None) -> None:
+        tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(src, tmp)
+            if mode is not None:
+                os.chmod(tmp, mode)
+            os.replace(tmp, dst)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def seed(self, data_dir: str) -> bool:
+        """
+        Seeds a Tor data directory with the cached documents, unless the cache is stale or the data directory
+        already holds the same or a newer consensus.
+
+        :param data_dir: The Tor data directory (DirLib) of an Onion that has not been started yet.
+        :return: True if the data directory was seeded, False otherwise.
+        """
+        if not self.isFresh or not self._newer(self.dirCache, data_dir):
+            return False
+        try:
+            with self._lock:
+                for name in self.LINK_FILES:
+                    src = os.path.join(self.dirCache, name)
+                    if os.path.exists(src):
+                        self._link(src, os.path.join(data_dir, name))
+                for name in self.COPY_FILES:
+                    src = os.path.join(self.dirCache, name)
+                    dst = os.path.join(data_dir, name)
+                    if os.path.exists(src):
+                        self._copy(src, dst, 0o600)
+                    elif os.path.exists(dst):
+                        os.remove(dst)
+        except OSError as e:
+            print(f"[!!] ERROR: seed {data_dir} from directory cache: {e} [!!]")
+            return False
+        return True
+
+    def harvest(self, data_dir: str) -> bool:
+        """
+        Refreshes the cache from a bootstrapped Onion if its consensus is newer than the cached one. Each file is
+        copied to a temporary file in the cache directory, made read-only and moved into place with os.replace().
+
+        :param data_dir: The Tor data directory (DirLib) of a bootstrapped Onion.
+        :return: True if the cache was refreshed, False otherwise.
+        """
+        try:
+            with self._lock:
+                if not self._newer(data_dir, self.dirCache):
+                    return False
+                # consensus last: a cache with a new consensus always has the documents that go with it
+                names = [n for n in self.LINK_FILES + self.COPY_FILES if n != self.CONSENSUS] + [self.CONSENSUS]
+                for name in names:
+                    src = os.path.join(data_dir, name)
+                    dst = os.path.join(self.dirCache, name)
+                    if os.path.exists(src):
+                        self._copy(src, dst, 0o444)
+                    elif os.path.exists(dst):
+                        os.remove(dst)
+        except OSError as e:
+            print(f"[!!] ERROR: refresh directory cache from {data_dir}: {e} [!!]")
+            return False
+        return True
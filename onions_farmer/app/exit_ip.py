@@ -0,0 +1,269 @@
+import threading
+
+from collections import deque
+from math import ceil
+from threading import Thread
+from time import monotonic
+from typing import Union
+
+
+# longest Tor delays a NEWNYM (rate limit) before building the new circuit
+NEWNYM_WAIT = 30
+
+
+class ExitResolver:
+    """
+    Finds the exit IP of an Onion from its own Tor process instead of asking a web service over Tor. The
+    circuit new streams leave through is known from the control port events (or the active circuit of the
+    circuit pool), its last hop is the exit relay and the relay's address comes from the consensus entry
+    (GETINFO ns/id/<fingerprint>). Results are cached per circuit id and dropped on the circuit's CIRC
+    CLOSED/FAILED event, so a repeated lookup on the same circuit is a dictionary read.
+    """
+    def __init__(self, farmer: object, relay_ttl: float = 3600):
+        """
+        Prepares the resolver. Register handleEvent() as a control event listener.
+
+        :param farmer: The Farmer of the Onion, used for its state and control port requests.
+        :param relay_ttl: Seconds a relay address read from the consensus is trusted.
+        """
+        self.farmer = farmer
+        self.name = farmer.name
+        self.relayTTL = relay_ttl
+        self._lock = threading.Lock()
+        self._byCircuit = {}
+        self._relays = {}
+        self._countries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._byCircuit.clear()
+            self._relays.clear()
+            self._countries.clear()
+
+    def handleEvent(self, reply: object) -> None:
+        """
+        Control event listener: forgets the exit of every circuit Tor closes.
+        """
+        if reply.event != "CIRC":
+            return
+        parts = reply.lines[0].split(" ")
+        if len(parts) > 2 and parts[2] in ("CLOSED", "FAILED"):
+            with self._lock:
+                self._byCircuit.pop(parts[1], None)
+
+    def currentCircuit(self) -> Union[str, bool]:
+        pool = self.farmer.circuitPool
+        if pool and pool.running and pool.active:
+            return pool.active
+        return self.farmer.state.currentCircuit()
+
+    def _getinfo(self, key: str) -> Union[str, bool]:
+        reply = self.farmer.request(f"GETINFO {key}")
+        if not reply or not reply.ok:
+            return None
+        for line in reply.lines:
+            if line.startswith(f"{key}="):
+                return reply.data.get(line, line.partition("=")[2])
+        return None
+
+    def relayIP(self, fingerprint: str) -> Union[str, bool]:
+        """
+        Address of a relay from the consensus, cached for `relay_ttl` seconds.
+
+        :param fingerprint: The relay fingerprint, hex without "$".
+        :return: The relay's IPv4 address, or None if the consensus does not list it.
+        """
+        now = monotonic()
+        with self._lock:
+            cached = self._relays.get(fingerprint)
+        if cached and now - cached[1] < self.relayTTL:
+            return cached[0]
+        status = self._getinfo(f"ns/id/{fingerprint}")
+        if not status:
+            return None
+        for line in status.splitlines():
+            # r <nickname> <identity> <digest> <date> <time> <IP> <ORPort> <DirPort>
+            fields = line.split(" ")
+            if fields[0] == "r" and len(fields) > 6:
+                with self._lock:
+                    self._relays[fingerprint] = (fields[6], now)
+                return fields[6]
+        return None
+
+    def country(self, ip: str) -> Union[str, bool]:
+        """
+        Country code of an address from Tor's GeoIP database, cached.
+
+        :return: The lower case country code, or None if Tor has no GeoIP data for it.
+        """
+        with self._lock:
+            if ip in self._countries:
+                return self._countries[ip]
+        code = self._getinfo(f"ip-to-country/{ip}")
+        code = code if code and code != "??" else None
+        with self._lock:
+            self._countries[ip] = code
+        return code
+
+    def loadCircuits(self) -> bool:
+        # circuits built before SETEVENTS never produced an event
+        status = self._getinfo("circuit-status")
+        if status is None:
+            return False
+        self.farmer.state.loadCircuits(status.splitlines())
+        return True
+
+    def exitInfo(self) -> Union[dict, bool]:
+        """
+        Exit relay of the circuit new streams currently use.
+
+        :return: Dictionary with "IP", "Country", "Fingerprint" and "Circuit", or None if it can not be told from
+                 the control port.
+        """
+        circ_id = self.currentCircuit()
+        if circ_id is None:
+            if not self.loadCircuits():
+                return None
+            circ_id = self.currentCircuit()
+            if circ_id is None:
+                return None
+        with self._lock:
+            info = self._byCircuit.get(circ_id)
+        if info:
+            self.hits += 1
+            return info
+        self.misses += 1
+        circ = self.farmer.state.circuits.get(circ_id)
+        if not circ or not circ["path"]:
+            return None
+        fingerprint = circ["path"][-1]
+        ip = self.relayIP(fingerprint)
+        if not ip:
+            return None
+        info = {"IP": ip, "Country": self.country(ip), "Fingerprint": fingerprint, "Circuit": circ_id}
+        if circ_id in self.farmer.state.circuits:
+            with self._lock:
+                self._byCircuit[circ_id] = info
+        return info
+
+    def lookup(self) -> Union[str, bool]:
+        """
+        Exit IP of the circuit new streams currently use.
+
+        :return: The exit relay's IPv4 address, or None if it can not be told from the control port.
+        """
+        info = self.exitInfo()
+        return info["IP"] if info else None
+
+
+def _runBounded(func: object, onions: list, concurrency: int, timeout: float) -> dict:
+    # runs func(onion) for every Onion, at most `concurrency` at a time, on daemon threads of its own. A call
+    # running longer than `timeout` is given up and its thread left behind, a new thread takes its place so the
+    # Onions queued behind it still start. The whole round ends after `timeout` times the number of waves.
+    queue = deque(onions)
+    running = {}
+    results = {}
+    cond = threading.Condition()
+
+    def worker() -> None:
+        while True:
+            with cond:
+                if not queue:
+                    return
+                onion = queue.popleft()
+                running[onion.name] = monotonic()
+                cond.notify_all()
+            try:
+                result = func(onion)
+            except Exception as e:
+                print(f"[{onion.name}] [!!] ERROR: {e} [!!]")
+                result = None
+            with cond:
+                if running.pop(onion.name, None) is None:
+                    # given up on and replaced
+                    return
+                results[onion.name] = result
+                cond.notify_all()
+
+    def spawn() -> None:
+        Thread(target=worker, name="ExitIP", daemon=True).start()
+
+    concurrency = max(1, min(concurrency, len(onions) or 1))
+    limit = timeout * ceil(len(onions) / concurrency)
+    deadline = monotonic() + limit
+    with cond:
+        for _ in range(concurrency):
+            spawn()
+        while len(results) < len(onions):
+            now = monotonic()
+            if now >= deadline:
+                break
+            for name, since in list(running.items()):
+                if now - since > timeout:
+                    print(f"[{name}] [!!] ERROR: no answer within {timeout}s [!!]")
+                    del running[name]
+                    results[name] = None
+                    spawn()
+            due = [since + timeout for since in running.values()]
+            cond.wait(max(0.01, min(due + [deadline]) - now))
+        # out of time: whatever is still running or queued fails
+        for name in list(running) + [onion.name for onion in queue]:
+            print(f"[{name}] [!!] ERROR: no answer within the round's {limit:.0f}s [!!]")
+            results[name] = None
+        running.clear()
+        queue.clear()
+    return {onion.name: results.get(onion.name) for onion in onions}
+
+
+def duplicateExits(exits: dict) -> dict:
+    """
+    Groups the Onions sharing an exit relay (by fingerprint, by IP when the fingerprint is unknown).
+
+    :param exits: Onion name -> exit description, as returned by collectExits().
+    :return: Exit key -> list of Onion names, only for exits used by more than one Onion.
+    """
+    groups = {}
+    for name, info in exits.items():
+        if info:
+            groups.setdefault(info["Fingerprint"] or info["IP"], []).append(name)
+    return {key: names for key, names in groups.items() if len(names) > 1}
+
+
+def collectExits(onions: list, concurrency: int = 16, timeout: float = 15, unique: bool = False, rounds: int = 3) -> tuple:
+    """
+    Reads the exit of every Onion with at most `concurrency` calls in flight, each given up after `timeout`
+    seconds; a round never takes longer than `timeout` times the number of waves (Onions / concurrency). With `unique` the Onions sharing an exit get a new circuit, all but one per exit, and are read
+    again, for up to `rounds` rounds, until every Onion leaves through a different relay.
+
+    :return: (exits, report): Onion name -> {"IP", "Country", "Fingerprint", "Circuit"} or None, and a report
+             with "Total", "Resolved", "Unique", "Duplicates", "Failed", "Renewed" and "Rounds".
+    """
+    onions = list(onions)
+    byName = {onion.name: onion for onion in onions}
+    renewed = 0
+    done_rounds = 0
+    exits = _runBounded(lambda onion: onion.exitInfo(), onions, concurrency, timeout)
+    while unique and done_rounds < rounds:
+        again = [byName[name] for names in duplicateExits(exits).values() for name in names[1:]]
+        if not again:
+            break
+        done_rounds += 1
+        print(f"[ExitIP] Round {done_rounds}: new circuit for {len(again)} Onions sharing an exit")
+        # NEWNYM may wait out Tor's rate limit before the circuit is built
+        _runBounded(lambda onion: onion.newCircuit(wait=True), again, concurrency, timeout + NEWNYM_WAIT)
+        renewed += len(again)
+        exits.update(_runBounded(lambda onion: onion.exitInfo(), again, concurrency, timeout))
+    duplicates = duplicateExits(exits)
+    resolved = [info for info in exits.values() if info]
+    report = {
+        "Total": len(onions),
+        "Resolved": len(resolved),
+        "Unique": len({info["Fingerprint"] or info["IP"] for info in resolved}),
+        "Duplicates": duplicates,
+        "Failed": sorted(name for name, info in exits.items() if not info),
+        "Renewed": renewed,
+        "Rounds": done_rounds
+    }
+    return exits, report
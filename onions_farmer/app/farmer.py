@@ -1,12 +1,18 @@
-import socket
 import os
-import re
 
-from time import sleep
-from datetime import datetime
+from time import monotonic
 from threading import Thread
 from typing import Union
 
+from .control import ControlConnection
+from .onion_state import OnionState
+from .circuit_pool import CircuitPool
+from .exit_ip import ExitResolver
+from .control_log import ControlLog
+from .metrics import CONTROL_SECONDS, CONTROL_ERRORS, NEW_CIRCUIT_SECONDS
+
+
+NEWNYM_INTERVAL = 10
 
 
 class Farmer:
@@ -31,78 +37,153 @@ class Farmer:
         self.name = self.conf["Name"]
         self.sockPath = self.conf["CtrlSocketPath"]
         self.logFile = self.conf["LogSocketFile"]
+        self.log = ControlLog(self.logFile, self.name, self.conf.get("LogLevel", "debug"), self.conf.get("LogFormat", "text"),
+                              self.conf.get("LogMaxBytes", 10 * 1024 * 1024), self.conf.get("LogBackups", 3))
         self.raw_len = self.conf.get("RawLen", 2048)
         self.format = self.conf.get("FormatCode", "utf-8")
         self._isCtrlConn = False
+        self.ctrl = None
+        self.ctrlTimeout = self.conf.get("CtrlTimeout", 10)
+        self._listeners = []
+        self.events = ["STATUS_CLIENT", "CIRC", "STREAM"]
+        self.state = OnionState(self.name)
+        self.circuitPool = CircuitPool(self, self.conf["CircuitPool"]) if self.conf.get("CircuitPool") else None
+        self._lastNewnym = None
+        self.exitIP = ExitResolver(self)
+        self.addEventListener(self.state.handleEvent)
+        self.addEventListener(self.exitIP.handleEvent)
         self.stopEvent = self.onion.stopEvent
         self._pauseLoop = self.conf.get("PauseLoop", 0.5)
     
-    def addLog(self, text: str) -> None:
+    def addLog(self, text: str, level: str = "info", **fields) -> None:
         """
-        Appends a new log entry to the specified log file. This method is used for tracking events, operations,
-        and interactions with the Tor control port over time.
+        Appends a new log entry to the control log file. This method is used for tracking events, operations,
+        and interactions with the Tor control port over time. The entry is only queued: a shared background
+        thread formats and writes it, so the control path never waits for the disk. The level threshold
+        ("LogLevel"), the format ("LogFormat": "text" or "json"), the rotation size ("LogMaxBytes") and the
+        number of rotated files ("LogBackups") come from the configuration.
 
         :param text: The log message to be recorded.
+        :param level: "debug", "info", "warning" or "error". Commands and replies are logged as "debug".
+        :param fields: Extra keys for JSON lines, e.g. the command name.
         """
-        with open(self.logFile, "a") as f:
-            _time = datetime.now()
-            f.write(f"{_time.strftime('%d:%m:%Y  %H:%M')} -- {text}\n")
+        self.log.log(text, level, **fields)
     
     def socketConnect(self) -> bool:
         """
         Attempts to establish a connection to the Tor control socket as specified in the configuration. It handles
-        the initial authentication process with the control port upon successful connection.
+        the initial authentication process with the control port upon successful connection. All later traffic on
+        the socket goes through a single ControlConnection, which matches replies to commands and hands
+        asynchronous events to the listeners registered with addEventListener().
 
         :return: True if successfully connected and authenticated with the Tor control socket, False otherwise.
         """
-        try:
-            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            self.socket.connect(self.sockPath)
-            self.socket.settimeout(2)
-            print(f"[{self.name}] Connect to Control Socket")
-            self.addLog("Connect to Control Socket")
-            self.sendMsg('AUTHENTICATE ""\r\n')
-            print(f"[{self.name}] Recive Authenticate: {self.reciveMsg()}")
-            return True
-        except:
+        ctrl = ControlConnection(self.sockPath, self.name, self.format, self.raw_len)
+        if not ctrl.connect():
             return False
-    
-    def sendMsg(self, msg: str) -> None:
+        for callback in self._listeners:
+            ctrl.addListener(callback)
+        self.ctrl = ctrl
+        print(f"[{self.name}] Connect to Control Socket")
+        self.addLog("Connect to Control Socket")
+        reply = self.request('AUTHENTICATE ""')
+        if not reply or not reply.ok:
+            ctrl.close()
+            return False
+        print(f"[{self.name}] Recive Authenticate: {reply.raw}")
+        return self.subscribe()
+
+    def subscribe(self) -> bool:
+        """
+        Subscribes to the control port events that drive the Onion state machine (bootstrap progress, circuit and
+        stream changes) and seeds the state with the current bootstrap phase, since Tor only reports changes. From
+        here on the connection status and circuit renewal are read from the state instead of polling Tor.
+
+        :return: True if Tor accepted the subscription, False otherwise.
+        """
+        self.state.reset()
+        self.exitIP.clear()
+        reply = self.request(f"SETEVENTS {' '.join(self.events)}")
+        if not reply or not reply.ok:
+            print(f"[{self.name}] [!!] ERROR: Tor refused SETEVENTS: {reply.raw if reply else 'no answer'} [!!]")
+            self.ctrl.close()
+            return False
+        self.refresh()
+        return True
+
+    def refresh(self) -> bool:
+        """
+        Reads the bootstrap phase and circuit status directly from Tor and stores them in the Onion state. The
+        state is normally kept current by events; this is for callers that need a value confirmed by Tor right now.
+
+        :return: True if the Tor network connection is fully established, False otherwise.
+        """
+        if not self.ctrl or not self.ctrl.connected:
+            return False
+        reply = self.request("GETINFO status/bootstrap-phase status/circuit-established")
+        if not reply or not reply.ok:
+            return False
+        for line in reply.lines:
+            key, _, value = line.partition("=")
+            if key == "status/bootstrap-phase":
+                args = self.state.keywords(value)
+                if args.get("PROGRESS", "").isdigit():
+                    self.state.setBootstrap(int(args["PROGRESS"]), args.get("TAG"), args.get("SUMMARY"))
+            elif key == "status/circuit-established":
+                self.state.setCircuitEstablished(value == "1")
+        return self.checkTorConn()
+
+    def addEventListener(self, callback: object) -> None:
+        """
+        Registers a callback for asynchronous control port events (6xx replies). The callback receives a
+        ControlReply and runs on the control reader thread, so it must return quickly and must not send
+        commands and wait for their replies itself. Listeners survive control socket reconnections.
+
+        :param callback: A callable taking one ControlReply argument.
         """
-        Sends a command message to the Tor control socket. This method is essential for issuing commands and
-        requests to the Tor process via the control port.
+        self._listeners.append(callback)
+        if self.ctrl:
+            self.ctrl.addListener(callback)
+
+    def sendMsg(self, msg: str) -> object:
+        """
+        Sends a command message to the Tor control socket without waiting for the answer. This method is
+        essential for issuing commands and requests to the Tor process via the control port.
 
         :param msg: The command message to be sent to the Tor control socket.
+        :return: A Future resolved with the ControlReply once Tor answers.
         """
-        if not msg.endswith("\r\n"):
-            msg += "\r\n"
-        self.socket.sendall(msg.encode(self.format))
-        self.addLog(f"Send Command: {msg}\n")
-    
-    def reciveMsg(self) -> str:
-        """
-        Receives and returns a message from the Tor control socket. This method is crucial for retrieving responses
-        and status updates from the Tor process in response to issued commands.
-
-        :return: The received message from the Tor control socket as a string.
-        """
-        msg = b""
-        while not self.stopEvent.is_set():
-            try:
-                recv = self.socket.recv(self.raw_len)
-            except TimeoutError:
-                return None
-            if recv:
-                if len(recv) < self.raw_len:
-                    msg += recv
-                    break
-                else:
-                    msg += recv
-            else:
-                return None
-        msg = msg.decode(self.format)
-        self.addLog(f"Recive: {msg}\n")
-        return msg
+        command = msg.split(" ", 1)[0].strip()
+        self.addLog(f"Send Command: {msg}\n", "debug", command=command)
+        future = self.ctrl.send(msg)
+        future.add_done_callback(self._timeCommand(command, monotonic()))
+        return future
+
+    def _timeCommand(self, command: str, start: float) -> object:
+        # runs on the control reader thread when the reply arrives
+        def done(future: object) -> None:
+            CONTROL_SECONDS.labels(self.name, command).observe(monotonic() - start)
+            if future.exception() or not future.result().ok:
+                CONTROL_ERRORS.labels(self.name, command).inc()
+        return done
+
+    def request(self, msg: str) -> Union[object, bool]:
+        """
+        Sends a command to the control socket and waits for its parsed reply. Safe to call from any number
+        of threads at once: each caller receives the reply to its own command.
+
+        :param msg: The command to be sent to the control socket.
+        :return: The ControlReply, or None if no reply arrived within the control timeout.
+        """
+        if not self.ctrl:
+            return None
+        try:
+            reply = self.sendMsg(msg).result(self.ctrlTimeout)
+        except Exception as e:
+            self.addLog(f"[!!] ERROR Recive: {e} [!!]", "error", command=msg.split(" ", 1)[0].strip())
+            return None
+        self.addLog(f"Recive: {reply.raw}\n", "debug" if reply.ok else "warning", status=reply.status)
+        return reply
     
     def sendCMD(self, msg: str, silence: bool = False) -> Union[str, bool]:
         """
@@ -111,39 +192,28 @@ class Farmer:
 
         :param msg: The command to be sent to the control socket.
         :param silence: If True, suppresses printing error messages to the console.
-        :return: The response from the Tor control socket as a string, or False if an error occurs.
+        :return: The response from the Tor control socket as a string, or None if there is no answer.
         """
         if not self._isCtrlConn:
             if not silence:
                 print("[!!] ERROR: Not connected to Socket Control [!!]")
             return None
-        try:
-            self.sendMsg(msg)
-            recv = self.reciveMsg()
-            return recv
-        except Exception as e:
-            self.addLog(f"[!!] ERROR Send Command: {e} [!!]")
-            return f"ERROR: {e}"
+        reply = self.request(msg)
+        if not reply:
+            return None
+        return reply.raw
     
     def checkTorConn(self) -> bool:
         """
-        Verifies the current connection status with the Tor network by querying the bootstrap phase from the
-        control socket. It determines whether the Tor process has successfully established a network connection.
+        Verifies the current connection status with the Tor network. The bootstrap phase is tracked from the
+        STATUS_CLIENT events Tor pushes on the control socket, so this is a plain read of the Onion state and
+        does not talk to Tor.
 
         :return: True if the Tor network connection is fully established, False otherwise.
         """
-        if not self._isCtrlConn:
-            return False
-        cmd = self.sendCMD("GETINFO status/bootstrap-phase\r\n", silence=True)
-        if not cmd:
-            return False
-        buff = re.search(r"PROGRESS=(\d+)", cmd)
-        if buff:
-            progress = buff.group(1)
-            if progress == "100":
-                return True
-        else:
+        if not self._isCtrlConn or not self.ctrl.connected:
             return False
+        return self.state.bootstrapped
     
     def _isTorConn(self) -> None:
         """
@@ -151,11 +221,12 @@ class Farmer:
         is designed to run in a loop, facilitating automatic reconnection attempts or confirmation of initial
         connection success.
         """
-        while True:
-            sleep(self._pauseLoop)
-            if self.checkTorConn():
-                print(f"\n[{self.name}] Connected to Tor")
-                break
+        while not self.state.waitReady(self._pauseLoop):
+            if self.stopEvent.is_set():
+                return
+        print(f"\n[{self.name}] Connected to Tor")
+        if self.circuitPool and not self.circuitPool.running:
+            self.circuitPool.start()
         
     def isTorConn(self) -> None:
         """
@@ -165,17 +236,52 @@ class Farmer:
         check = Thread(target=self._isTorConn, daemon=True)
         check.start()
     
+    def newnymDelay(self) -> float:
+        """
+        Returns the number of seconds until Tor accepts the next SIGNAL NEWNYM. Tor rate limits NEWNYM to one every
+        10 seconds and silently delays earlier requests.
+
+        :return: Seconds to wait, 0 if a NEWNYM would be served at once.
+        """
+        if self._lastNewnym is None:
+            return 0
+        return max(0, NEWNYM_INTERVAL - (monotonic() - self._lastNewnym))
+
     def _newCircuit(self, obtain_ip: bool = False) -> None:
         """
         Internally requests the creation of a new Tor circuit and optionally updates the cached IP address. This
-        method is called to renew the Tor connection for a new identity or IP address.
+        method is called to renew the Tor connection for a new identity or IP address. With a circuit pool
+        ("CircuitPool" in the configuration) new streams are switched to an already built standby circuit at once;
+        otherwise SIGNAL NEWNYM is sent, waiting first if Tor's NEWNYM rate limit applies.
 
         :param obtain_ip: If True, updates the cached exit node IP address after establishing a new circuit.
         """
+        took = self.circuitPool.switch() if self.circuitPool else None
+        if took is not None:
+            NEW_CIRCUIT_SECONDS.labels(self.name, "pool").observe(took / 1000)
+            self.onion._ip = None
+            print(f"\n[{self.name}] New Circuit complete in {took:.2f} ms (circuit pool).")
+            if obtain_ip:
+                print(f"\n[{self.name}] New IP Address: {self.onion.IP}")
+            return
+        if self.circuitPool:
+            print(f"\n[{self.name}] [!!] No standby circuit ready, falling back to NEWNYM [!!]")
+        delay = self.newnymDelay()
+        if delay:
+            print(f"\n[{self.name}] [!!] NEWNYM rate limit: Tor accepts one NEWNYM every {NEWNYM_INTERVAL}s, waiting {delay:.1f}s [!!]")
+            if self.stopEvent.wait(delay):
+                return
+        built = self.state.builtCount
+        self._lastNewnym = monotonic()
+        self.state.markNewnym()
         cmd = self.sendCMD("SIGNAL NEWNYM\r\n", silence=True)
         self.onion._ip = None
-        while not self.checkTorConn():
-            sleep(self._pauseLoop)
+        # Tor answers NEWNYM at once and builds the clean circuits afterwards: wait for the CIRC BUILT event
+        self.state.waitCircuit(built, self.ctrlTimeout)
+        while not self.state.waitReady(self._pauseLoop):
+            if self.stopEvent.is_set():
+                return
+        NEW_CIRCUIT_SECONDS.labels(self.name, "newnym").observe(monotonic() - self._lastNewnym)
         print(f"\n[{self.name}] New Circuit complete.")
         if obtain_ip:
             print(f"\n[{self.name}] New IP Address: {self.onion.IP}")
@@ -194,11 +300,35 @@ class Farmer:
         """
         A private method that attempts to establish and maintain a connection to the Tor control socket. It runs
         in a loop, continuously trying to connect until successful, and then enters a state of monitoring Tor connectivity.
+        The loop ends when the Onion is stopped, so a Tor process that never opens its control socket does not
+        keep it running forever.
         """
         while not self._isCtrlConn:
             self._isCtrlConn = self.socketConnect()
-            sleep(self._pauseLoop)
-        
+            if self._isCtrlConn or self.stopEvent.wait(self._pauseLoop):
+                return
+
+    def disconnect(self) -> None:
+        """
+        Drops the control connection and everything known about the Tor process, e.g. after Tor exited. Commands
+        still waiting for a reply fail at once.
+        """
+        self._isCtrlConn = False
+        if self.circuitPool:
+            self.circuitPool.reset()
+        if self.ctrl:
+            self.ctrl.close()
+        self.state.reset()
+        self.exitIP.clear()
+        self._lastNewnym = None
+
+    def reconnect(self) -> None:
+        """
+        Connects to the control socket of a new Tor process in the background, as work() does on start. Used by
+        the Onion after the ProcessSupervisor restarted Tor.
+        """
+        self.disconnect()
+        Thread(target=self.work, daemon=True).start()
     
     def work(self) -> None:
         """
@@ -210,5 +340,6 @@ class Farmer:
         work.start()
         self.addLog("Farmer Start")
         while not self._isCtrlConn:
-            sleep(self._pauseLoop)
+            if self.stopEvent.wait(self._pauseLoop):
+                return
         self.isTorConn()
\ No newline at end of file
@@ -0,0 +1,322 @@
+import threading
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Union
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTROL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+BOOTSTRAP_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+CIRCUIT_BUCKETS = (0.01, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30)
+
+
+class _Child:
+    """
+    One labelled series of a metric. Hot paths keep a reference to it so that recording a value is one lock
+    and an addition, without any label lookup.
+    """
+    __slots__ = ("_lock", "value", "counts", "sum", "count", "_buckets")
+
+    def __init__(self, lock: threading.Lock, buckets: tuple = None):
+        self._lock = lock
+        self.value = 0
+        self._buckets = buckets
+        if buckets is not None:
+            self.counts = [0] * (len(buckets) + 1)
+            self.sum = 0.0
+            self.count = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """
+    A named metric with optional label names. Kind is "counter", "gauge" or "histogram".
+    """
+    def __init__(self, kind: str, name: str, help_text: str, labels: tuple = (), buckets: tuple = None):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelNames = tuple(labels)
+        self.buckets = tuple(buckets) if kind == "histogram" else None
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values) -> _Child:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, _Child(self._lock, self.buckets))
+        return child
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def remove(self, *values) -> None:
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def dump(self) -> dict:
+        with self._lock:
+            if self.kind == "histogram":
+                values = {k: (list(c.counts), c.sum, c.count) for k, c in self._children.items()}
+            else:
+                values = {k: c.value for k, c in self._children.items()}
+        return {"kind": self.kind, "help": self.help, "labels": self.labelNames, "buckets": self.buckets, "values": values}
+
+
+def quantile(q: float, buckets: tuple, counts: list) -> Union[float, bool]:
+    # linear interpolation inside the bucket holding the q-th observation, as Prometheus' histogram_quantile()
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if seen + count >= rank and count:
+            if i == len(buckets):
+                return buckets[-1]
+            low = buckets[i - 1] if i else 0
+            return low + (buckets[i] - low) * (rank - seen) / count
+        seen += count
+    return buckets[-1]
+
+
+def mergeDumps(dumps: list) -> dict:
+    """
+    Adds up metric dumps from several registries (e.g. worker processes): counters, gauges and histogram buckets
+    of identical series are summed.
+    """
+    merged = {}
+    for dump in dumps:
+        for name, metric in dump.items():
+            into = merged.setdefault(name, dict(metric, values={}))
+            for key, value in metric["values"].items():
+                old = into["values"].get(key)
+                if old is None:
+                    into["values"][key] = value
+                elif metric["kind"] == "histogram":
+                    into["values"][key] = ([a + b for a, b in zip(old[0], value[0])], old[1] + value[1], old[2] + value[2])
+                else:
+                    into["values"][key] = old + value
+    return merged
+
+
+def _labelText(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def renderText(dump: dict) -> str:
+    """
+    Formats a metric dump in the Prometheus text exposition format.
+    """
+    out = []
+    for name, metric in sorted(dump.items()):
+        out.append(f"# HELP {name} {metric['help']}")
+        out.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric["values"].items()):
+            if metric["kind"] != "histogram":
+                out.append(f"{name}{_labelText(metric['labels'], key)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket in zip(list(metric["buckets"]) + ["+Inf"], counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                out.append(f"{name}_bucket{_labelText(metric['labels'], key, le)} {cumulative}")
+            out.append(f"{name}_sum{_labelText(metric['labels'], key)} {total}")
+            out.append(f"{name}_count{_labelText(metric['labels'], key)} {count}")
+    return "\n".join(out) + "\n"
+
+
+def snapshotOf(dump: dict) -> dict:
+    """
+    Turns a metric dump into plain Python values: numbers for counters and gauges, and count, sum, mean and
+    p50/p90/p99 estimates for histograms. Series are keyed by their label values joined with ",".
+    """
+    snap = {}
+    for name, metric in dump.items():
+        series = {}
+        for key, value in metric["values"].items():
+            label = ",".join(key)
+            if metric["kind"] != "histogram":
+                series[label] = value
+                continue
+            counts, total, count = value
+            series[label] = {
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else None,
+                "p50": quantile(0.5, metric["buckets"], counts),
+                "p90": quantile(0.9, metric["buckets"], counts),
+                "p99": quantile(0.99, metric["buckets"], counts)
+            }
+        snap[name] = series
+    return snap
+
+
+class MetricsRegistry:
+    """
+    The metrics of one process. Metrics are created once (get-or-create by name) and read through snapshot()
+    as Python values or render() in the Prometheus text format. Collectors added with addCollector() return
+    dumps of other registries, e.g. of worker processes, merged into every read.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+        self._server = None
+
+    def _get(self, kind: str, name: str, help_text: str, labels: tuple, buckets: tuple = None) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(kind, name, help_text, labels, buckets)
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Metric:
+        return self._get("counter", name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels: tuple = ()) -> Metric:
+        return self._get("gauge", name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Metric:
+        return self._get("histogram", name, help_text, labels, buckets)
+
+    def addCollector(self, collector: object) -> None:
+        self._collectors.append(collector)
+
+    def removeCollector(self, collector: object) -> None:
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def dump(self, local: bool = False) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        dumps = [{m.name: m.dump() for m in metrics}]
+        if not local:
+            for collector in self._collectors:
+                try:
+                    dumps.extend(collector())
+                except Exception as e:
+                    print(f"[!!] ERROR: metrics collector: {e} [!!]")
+        return mergeDumps(dumps)
+
+    def snapshot(self) -> dict:
+        return snapshotOf(self.dump())
+
+    def render(self) -> str:
+        return renderText(self.dump())
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9100) -> Union[tuple, bool]:
+        """
+        Serves render() at http://host:port/metrics from a daemon thread.
+
+        :return: The (host, port) the endpoint listens on, or None if it can not bind.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        if self._server:
+            return self._server.server_address
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"[!!] ERROR: metrics endpoint {host}:{port}: {e} [!!]")
+            return None
+        self._server.daemon_threads = True
+        Thread(target=self._server.serve_forever, name="MetricsHTTP", daemon=True).start()
+        print(f"Metrics endpoint: http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server.server_address
+
+    def stopServing(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+REGISTRY = MetricsRegistry()
+
+BOOTSTRAP_SECONDS = REGISTRY.histogram("onion_bootstrap_seconds", "Time from Tor start to 100% bootstrap.", ("onion", ), BOOTSTRAP_BUCKETS)
+TOR_RESTARTS = REGISTRY.counter("onion_restarts_total", "Tor processes restarted after an unexpected exit.", ("onion", ))
+CIRCUIT_BUILD_SECONDS = REGISTRY.histogram("onion_circuit_build_seconds", "Time from CIRC LAUNCHED to BUILT.", ("onion", ), CIRCUIT_BUCKETS)
+NEW_CIRCUIT_SECONDS = REGISTRY.histogram("onion_new_circuit_seconds", "Latency of newCircuit() by method (newnym or pool).", ("onion", "method"), CIRCUIT_BUCKETS)
+CONTROL_SECONDS = REGISTRY.histogram("control_command_seconds", "Control port command round trip.", ("onion", "command"), CONTROL_BUCKETS)
+CONTROL_ERRORS = REGISTRY.counter("control_errors_total", "Control port commands without a 250 reply.", ("onion", "command"))
+CONTROL_LOG_DROPPED = REGISTRY.counter("control_log_dropped_total", "Control log records dropped because the writer queue was full.", ("onion", ))
+BRIDGE_REQUESTS = REGISTRY.counter("bridge_requests_total", "Requests handled by HTTP bridges and carousels.", ("bridge", "kind"))
+BRIDGE_BYTES = REGISTRY.counter("bridge_bytes_total", "Bytes relayed by HTTP bridges and carousels.", ("bridge", "direction"))
+BRIDGE_CONNECT_SECONDS = REGISTRY.histogram("bridge_connect_seconds", "Time to open a new upstream connection through Tor.", ("bridge", ))
+BRIDGE_FIRST_BYTE_SECONDS = REGISTRY.histogram("bridge_first_byte_seconds", "Time from request sent upstream to first response byte.", ("bridge", ))
+BRIDGE_TOTAL_SECONDS = REGISTRY.histogram("bridge_request_seconds", "Total time of a relayed HTTP request.", ("bridge", ))
+BRIDGE_ACTIVE = REGISTRY.gauge("bridge_active_connections", "Client connections open on a bridge.", ("bridge", ))
+BRIDGE_ERRORS = REGISTRY.counter("bridge_errors_total", "Bridge errors by type (connect, upstream, relay, protocol).", ("bridge", "type"))
+
+
+class BridgeMetrics:
+    """
+    The series of one bridge, resolved once so the relay code records values without label lookups.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.http = BRIDGE_REQUESTS.labels(name, "http")
+        self.connect = BRIDGE_REQUESTS.labels(name, "connect")
+        self.bytesOut = BRIDGE_BYTES.labels(name, "out")
+        self.bytesIn = BRIDGE_BYTES.labels(name, "in")
+        self.connectTime = BRIDGE_CONNECT_SECONDS.labels(name)
+        self.firstByte = BRIDGE_FIRST_BYTE_SECONDS.labels(name)
+        self.total = BRIDGE_TOTAL_SECONDS.labels(name)
+        self.active = BRIDGE_ACTIVE.labels(name)
+        self._errors = {}
+
+    def error(self, kind: str) -> None:
+        child = self._errors.get(kind)
+        if child is None:
+            child = self._errors[kind] = BRIDGE_ERRORS.labels(self.name, kind)
+        child.inc()
@@ -4,13 +4,20 @@ import subprocess
 import threading
 
 from threading import Thread
-from time import sleep
+from time import sleep, monotonic
 from datetime import datetime
 from typing import Union
 
 from .farmer import Farmer
 from .tools.ip_check import IP_Checker
 from .tools.bridge_http import BridgeHTTP
+from .tools.bridge_async import AsyncBridgeHTTP
+from .tools.socks_pool import SocksPool
+from .tools.traffic import TrafficCounter
+from .tools.log_tailer import LogTailer
+from .metrics import BOOTSTRAP_SECONDS
+from .dir_cache import DirCache
+from .supervisor import ProcessSupervisor
 
 
 class Onion(Thread):
@@ -49,6 +56,17 @@ class Onion(Thread):
         self._httpBridge = None
         self._httpBridgeFLAG = False
         self.httpBridge = None
+        self.socksPool = SocksPool(config.get("PoolSize", 32), config.get("PoolIdle", 30), config.get("PoolPerHost", 8))
+        self.dirCache = DirCache(config["DirCache"]) if config.get("DirCache") else None
+        self.traffic = TrafficCounter()
+        self.exitLookup = config.get("ExitIPLookup", "control")
+        self._logListeners = []
+        self.rotating = False
+        self.restarting = False
+        self.draining = False
+        self.restarts = 0
+        self.supervise = config.get("Supervise", True)
+        self._procLock = threading.Lock()
         self.Farmer = Farmer(self._config, self)
         self.preapreTools()
           
@@ -70,15 +88,23 @@ class Onion(Thread):
             "PrintLog" :self.prints,
             "Status" : self.status(),
             "IsTorConn" : self.isTorConn,
+            "Bootstrap" : self.state.progress,
+            "StateAge" : self.state.age,
             "ExitNodeIP" : self._ip,
+            "Restarts" : self.restarts,
             "HttpBridge" : self._httpBridge
         }
         return conf
     
     @property
     def isTorConn(self) -> bool:
+        # cached state kept current by control port events, use refresh() to ask Tor directly
         return self.Farmer.checkTorConn()
     
+    @property
+    def state(self) -> object:
+        return self.Farmer.state
+    
     @property
     def IP(self) -> Union[str, bool]:
         return self._getIP()
@@ -95,12 +121,18 @@ class Onion(Thread):
             self._ipChecker = IP_Checker(self.outSocks)
         else:
             self._ipChecker = IP_Checker(self.localAddr)
-        if self._config.get("HttpBridge"):
+        bridge = self._config.get("HttpBridge")
+        if bridge:
             self._httpBridgeFLAG = True
-            if self._config.get("HttpBridge") == "random":
-                self.httpBridge = BridgeHTTP(self)
+            engine = BridgeHTTP
+            if bridge.startswith("async"):
+                # "async", "async:5000" or "async:192.168.0.22:5000" -> shared event loop bridge
+                engine = AsyncBridgeHTTP
+                bridge = bridge[6:] or "random"
+            if bridge == "random":
+                self.httpBridge = engine(self)
             else:
-                self.httpBridge = BridgeHTTP(self, self._config["HttpBridge"])
+                self.httpBridge = engine(self, bridge)
             self._httpBridge = f"{self.httpBridge.ip}:{self.httpBridge.port}"
 
     
@@ -115,33 +147,40 @@ class Onion(Thread):
             _time = datetime.now()
             f.write(f"{_time.strftime('%d:%m:%Y  %H:%M')} - Make Log Files\n")
 
-    def _printLog(self) -> None:
+    def _printLine(self, event: dict) -> None:
+        print(event["Line"])
+
+    def addLogListener(self, callback: object) -> None:
         """
-        A private method that continuously monitors and prints the Tor log file's contents to the console.
-        This function facilitates real-time monitoring of Tor's operational status and debugging.
+        Registers `callback(event)` for every line Tor writes to the Onion's log file. Events are dictionaries with
+        "Onion", "Time", "Level", "Message", "Bootstrap" (percent or None), "Warning" and the raw "Line". All Onions
+        share one LogTailer thread; callbacks run on it and must not block.
+
+        :param callback: The function receiving the events.
         """
-        try:
-            with open(self.logFile, "r") as f:
-                # move index to end file
-                f.seek(0, 2)
-                while True:
-                    line = f.readline()
-                    if not line:
-                        sleep(0.1)
-                        continue
-                    else:
-                        print(line, end="")
-        except Exception as e:
-            print(f"[!!] ERROR Reading Log File: {e} [!!]")
-            return
-    
+        self._logListeners.append(callback)
+        if self.logFile in LogTailer.shared().watched:
+            LogTailer.shared().subscribe(callback, self.logFile)
+
     def printLog(self) -> None:
         """
-        Initiates a daemon thread to continuously read and print the Tor process's log output, enabling
-        real-time monitoring and logging of Tor activities to the console.
+        Prints the Tor process's log output to the console as it is written, through the shared LogTailer.
+        """
+        self.addLogListener(self._printLine)
+
+    def _tailLog(self) -> None:
+        """
+        A private method that starts tailing the log file if anything listens to it. The file is dropped from the
+        shared LogTailer when the Tor process terminates.
         """
-        pl = Thread(target=self._printLog, daemon=True)
-        pl.start()
+        if self.prints and self._printLine not in self._logListeners:
+            self._logListeners.append(self._printLine)
+        if not self._logListeners:
+            return
+        tailer = LogTailer.shared()
+        if tailer.watch(self.logFile, self.name):
+            for callback in self._logListeners:
+                tailer.subscribe(callback, self.logFile)
     
     def onionStart(self) -> None:
         """
@@ -150,15 +189,15 @@ class Onion(Thread):
         HTTPBridge if configured. It ensures the Tor process runs as intended and monitors for a stop signal.
         """
         self.stopEvent.clear()
-        command = ["tor", "-f", self.torrc]
         self._start = True
         try:
-            self.procTOR = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
-            self.procPID = self.procTOR.pid
+            started = monotonic()
+            self._spawnTor()
             print(f"Tor Starting from: {self.name} config file. Check log files: {self.logFile}")
+            self._supervise()
             self.Farmer.work()
-            if self.prints:
-                self.printLog()
+            Thread(target=self._afterBootstrap, args=(started, ), daemon=True).start()
+            self._tailLog()
             if self._httpBridgeFLAG:
                 self.httpBridge.start()
             while not self.stopEvent.is_set():
@@ -169,18 +208,104 @@ class Onion(Thread):
         finally:
             self.terminateTorProcess()
     
+    def _spawnTor(self) -> None:
+        # stdout is not read: Tor logs to the log file, keep its console output from filling a pipe
+        self.procTOR = subprocess.Popen(["tor", "-f", self.torrc], stdout=subprocess.DEVNULL)
+        self.procPID = self.procTOR.pid
+
+    def _supervise(self, failures: int = 0) -> None:
+        """
+        A private method that hands the Tor process to the shared ProcessSupervisor, which reaps it and restarts
+        it if it exits on its own. "Supervise" set to False in the configuration disables this; "RestartBackoff",
+        "RestartMaxBackoff", "RestartResetAfter" and "RestartMax" tune the restart policy.
+
+        :param failures: Crashes in a row so far.
+        """
+        if not self.supervise:
+            return
+        ProcessSupervisor.shared().watch(
+            self,
+            backoff=self._config.get("RestartBackoff", 1),
+            max_backoff=self._config.get("RestartMaxBackoff", 60),
+            reset_after=self._config.get("RestartResetAfter", 300),
+            max_restarts=self._config.get("RestartMax"),
+            failures=failures
+        )
+
+    def restartTor(self) -> bool:
+        """
+        Starts a new Tor process after the previous one exited, with the same torrc and data directory so the
+        directory documents already downloaded are reused. The Farmer drops its dead control connection and
+        reconnects in the background; the Onion is flagged `restarting` until Tor is bootstrapped again, and
+        a carousel routes around it meanwhile. Called by the ProcessSupervisor.
+
+        :return: True if the new Tor process was started, False if the Onion is stopping or Tor could not start.
+        """
+        with self._procLock:
+            if self.stopEvent.is_set():
+                return False
+            self.restarting = True
+            self.Farmer.disconnect()
+            self.clearPools()
+            self._ip = None
+            try:
+                started = monotonic()
+                self._spawnTor()
+            except Exception as e:
+                print(f"[{self.name}] [!!] ERROR Restart Tor: {e} [!!]")
+                return False
+            self.restarts += 1
+        print(f"[{self.name}] Tor restarted (PID {self.procPID}, restart {self.restarts})")
+        self.Farmer.reconnect()
+        Thread(target=self._afterBootstrap, args=(started, ), daemon=True).start()
+        return True
+
     def terminateTorProcess(self) -> None:
         """
         Attempts to gracefully terminate the Tor process. If unsuccessful, it forcefully kills the process.
         This method ensures that the Tor instance is correctly shut down, preventing any potential leaks or
-        hanging processes.
+        hanging processes. The process is waited for, so no zombie is left behind.
         """
-        try:
-            self.procTOR.terminate()
-            print(f"\n[!!] Terminate Process: {self.name} [!!]")
-        except Exception as e:
-            print(f"[!!] ERROR Terminate Process: {e} .... Try kill Process[!!]")
-            self.procTOR.kill()
+        ProcessSupervisor.shared().unwatch(self)
+        self.clearPools()
+        LogTailer.shared().unwatch(self.logFile)
+        self.Farmer.log.close()
+        with self._procLock:
+            if self.procTOR is None:
+                return
+            try:
+                self.procTOR.terminate()
+                self.procTOR.wait(self._config.get("TerminateTimeout", 10))
+                print(f"\n[!!] Terminate Process: {self.name} [!!]")
+            except Exception as e:
+                print(f"[!!] ERROR Terminate Process: {e} .... Try kill Process[!!]")
+                self.procTOR.kill()
+                self.procTOR.wait()
+    
+    def _afterBootstrap(self, started: float) -> None:
+        """
+        A private method that waits for Tor to bootstrap, records the bootstrap time in the metrics and then offers
+        the fresh directory documents to the shared directory cache, so Onions created later start from the
+        newest consensus.
+
+        :param started: monotonic() time the Tor process was started.
+        """
+        while not self.state.waitReady(self.procPAUSE):
+            if self.stopEvent.is_set():
+                return
+        BOOTSTRAP_SECONDS.labels(self.name).observe(monotonic() - started)
+        self.restarting = False
+        if self.dirCache and self.dirCache.harvest(self._config["DirLib"]):
+            print(f"[{self.name}] Directory cache refreshed")
+    
+    def clearPools(self) -> None:
+        """
+        Closes every idle upstream connection kept for reuse, both in the Onion's SOCKS pool and in the
+        HTTPBridge if it keeps its own. Streams opened before a circuit change must not be reused after it.
+        """
+        self.socksPool.clear()
+        if self.httpBridge and self.httpBridge.pool is not self.socksPool:
+            self.httpBridge.pool.clear()
     
     def sendCMD(self, command: str) -> Union[str, bool]:
         """
@@ -193,14 +318,32 @@ class Onion(Thread):
         """
         return self.Farmer.sendCMD(command)
     
-    def newCircuit(self, obtain_ip: bool = False) -> None:
+    def newCircuit(self, obtain_ip: bool = False, wait: bool = False) -> None:
         """
         Requests the creation of a new Tor circuit, optionally checking for a new exit node IP. This method
         can be used to refresh the Tor connection, potentially improving anonymity or bypassing network restrictions.
+        The traffic counters used by rotation policies start again from zero.
 
         :param obtain_ip: If True, checks and updates the exit node IP after establishing the new circuit.
+        :param wait: If True, returns only once the new circuit is built instead of working in the background.
         """
-        self.Farmer.newCircuit(obtain_ip)
+        # pooled upstream streams are bound to the old circuit
+        self.clearPools()
+        self.traffic.reset()
+        if wait:
+            self.Farmer._newCircuit(obtain_ip)
+        else:
+            self.Farmer.newCircuit(obtain_ip)
+    
+    def refresh(self) -> bool:
+        """
+        Asks Tor for its current bootstrap phase and circuit status and updates the cached state that
+        isTorConn, conf and info() read. Those reads never touch the control port; this is the explicit
+        round trip for callers that need a value confirmed by Tor.
+
+        :return: True if the Tor network connection is fully established, False otherwise.
+        """
+        return self.Farmer.refresh()
     
     def status(self) -> str:
         """
@@ -209,6 +352,8 @@ class Onion(Thread):
         """
         if not self.is_alive() and not self._start:
             return "ready to start"
+        elif self.is_alive() and self.restarting:
+            return "restarting"
         elif self.is_alive():
             return "working"
         else:
@@ -233,17 +378,37 @@ class Onion(Thread):
     def _getIP(self) -> Union[str, bool]:
         """
         Retrieves the current exit node IP address if the Tor connection is established and operational.
-        This method is crucial for verifying the anonymity and operational status of the Tor instance.
+        The address of the exit relay of the current circuit is read through the control port and cached per
+        circuit, so repeated calls cost no Tor round trip. An HTTP check over Tor is only made when the control
+        port can not tell (no known circuit, relay missing from the consensus) or when the configuration sets
+        "ExitIPLookup" to "http", e.g. for exits whose outgoing address differs from the one they advertise.
 
         :return: The current exit node IP address or False if not connected or an error occurs.
         """
+        info = self.exitInfo()
+        return info["IP"] if info else None
+
+    def exitInfo(self) -> Union[dict, bool]:
+        """
+        Describes the exit of the current circuit, from the control port when possible (see _getIP()). Country and
+        fingerprint are only known from the control port, they are None after an HTTP check.
+
+        :return: Dictionary with "IP", "Country", "Fingerprint" and "Circuit", or None if not connected or the
+                 address could not be obtained.
+        """
         if not self.isTorConn:
             self._ip = None
             return None
+        if self.exitLookup != "http":
+            info = self.Farmer.exitIP.exitInfo()
+            if info:
+                self._ip = info["IP"]
+                return dict(info)
         if not self._ip:
             self._ip = self._ipChecker.getIP()
-            return self._ip
-        return self._ip
+        if not self._ip:
+            return None
+        return {"IP": self._ip, "Country": None, "Fingerprint": None, "Circuit": None}
     
     def stop(self) -> None:
         """
@@ -0,0 +1,272 @@
+import re
+import threading
+
+from time import monotonic
+
+from .metrics import CIRCUIT_BUILD_SECONDS
+
+
+class OnionState:
+    """
+    In-memory state machine of a single Tor instance, kept current by the asynchronous control port events
+    the Farmer subscribes to (STATUS_CLIENT, CIRC and STREAM). Readers get the bootstrap progress, the set of
+    live circuits and the open streams without a control port round trip, and threads that need to wait for a
+    state change (bootstrap done, a new circuit built) are woken by the event itself instead of polling.
+    """
+    KEYWORD = re.compile(r'([A-Za-z_]+)=("(?:[^"\\]|\\.)*"|\S+)')
+
+    def __init__(self, name: str):
+        """
+        Initializes an empty state: nothing bootstrapped, no circuits and no streams.
+
+        :param name: Name of the Onion the state belongs to, used in console messages.
+        """
+        self.name = name
+        self._cond = threading.Condition()
+        self.ready = threading.Event()
+        self.progress = 0
+        self.tag = None
+        self.summary = None
+        self.circuitEstablished = False
+        self.circuits = {}
+        self.streams = {}
+        self.builtCount = 0
+        self.lastStreamCircuit = None
+        self.newnymAt = None
+        self.updated = None
+
+    @classmethod
+    def keywords(cls, text: str) -> dict:
+        """
+        Parses the KEY=value and KEY="quoted value" arguments of a control port event line.
+
+        :param text: The event line.
+        :return: A dictionary of the keyword arguments, with quotes removed.
+        """
+        return {k: v[1:-1] if v.startswith('"') else v for k, v in cls.KEYWORD.findall(text)}
+
+    @property
+    def bootstrapped(self) -> bool:
+        return self.ready.is_set()
+
+    def reset(self) -> None:
+        """
+        Forgets everything known about the Tor process, e.g. after the control connection was lost.
+        """
+        with self._cond:
+            self.ready.clear()
+            self.progress = 0
+            self.tag = None
+            self.summary = None
+            self.circuitEstablished = False
+            self.circuits.clear()
+            self.streams.clear()
+            self.lastStreamCircuit = None
+            self.updated = monotonic()
+            self._cond.notify_all()
+
+    def setBootstrap(self, progress: int, tag: str = None, summary: str = None) -> None:
+        """
+        Records a bootstrap phase, either from a STATUS_CLIENT event or from a GETINFO status/bootstrap-phase
+        reply, and wakes every thread waiting for the Onion to become ready.
+
+        :param progress: Bootstrap progress in percent.
+        :param tag: Bootstrap phase tag reported by Tor.
+        :param summary: Human readable phase summary reported by Tor.
+        """
+        with self._cond:
+            self.progress = progress
+            self.tag = tag
+            self.summary = summary
+            if progress >= 100:
+                self.circuitEstablished = True
+                self.ready.set()
+            self.updated = monotonic()
+            self._cond.notify_all()
+
+    def setCircuitEstablished(self, established: bool) -> None:
+        """
+        Records whether Tor currently has working circuits. Losing them (network down) makes the Onion not ready
+        until Tor reports them established again.
+
+        :param established: True if Tor has working circuits.
+        """
+        with self._cond:
+            self.circuitEstablished = established
+            if established and self.progress >= 100:
+                self.ready.set()
+            elif not established:
+                self.ready.clear()
+            self.updated = monotonic()
+            self._cond.notify_all()
+
+    @property
+    def age(self) -> float:
+        """
+        Seconds since the state last changed or was refreshed, None if it was never set.
+        """
+        if self.updated is None:
+            return None
+        return monotonic() - self.updated
+
+    def handleEvent(self, reply: object) -> None:
+        """
+        Control event listener registered by the Farmer. Runs on the control reader thread.
+
+        :param reply: ControlReply holding a 650 event.
+        """
+        match reply.event:
+            case "STATUS_CLIENT":
+                self._statusClient(reply.lines[0])
+            case "CIRC":
+                self._circ(reply.lines[0])
+            case "STREAM":
+                self._stream(reply.lines[0])
+
+    def _statusClient(self, line: str) -> None:
+        # STATUS_CLIENT NOTICE BOOTSTRAP PROGRESS=100 TAG=done SUMMARY="Done"
+        parts = line.split(" ", 3)
+        if len(parts) < 3:
+            return
+        action = parts[2]
+        args = self.keywords(parts[3]) if len(parts) > 3 else {}
+        match action:
+            case "BOOTSTRAP":
+                try:
+                    progress = int(args.get("PROGRESS", 0))
+                except ValueError:
+                    return
+                self.setBootstrap(progress, args.get("TAG"), args.get("SUMMARY"))
+            case "CIRCUIT_ESTABLISHED":
+                self.setCircuitEstablished(True)
+            case "CIRCUIT_NOT_ESTABLISHED":
+                self.setCircuitEstablished(False)
+                print(f"[{self.name}] [!!] Tor lost its circuits: {args.get('REASON', 'unknown')} [!!]")
+
+    def _circ(self, line: str) -> None:
+        # CIRC 12 BUILT $FP~nick,$FP~nick BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL ...
+        parts = line.split(" ")
+        if len(parts) < 3:
+            return
+        circ_id, status = parts[1], parts[2]
+        path = []
+        if len(parts) > 3 and parts[3].startswith("$"):
+            path = [hop.lstrip("$").split("~")[0].split("=")[0] for hop in parts[3].split(",")]
+        args = self.keywords(line)
+        flags = args.get("BUILD_FLAGS", "").split(",")
+        with self._cond:
+            if status in ("FAILED", "CLOSED"):
+                self.circuits.pop(circ_id, None)
+            else:
+                old = self.circuits.get(circ_id, {})
+                launched = old.get("launched") or (monotonic() if status == "LAUNCHED" else None)
+                built = old.get("built")
+                if status == "BUILT" and built is None:
+                    built = monotonic()
+                    if launched:
+                        CIRCUIT_BUILD_SECONDS.labels(self.name).observe(built - launched)
+                self.circuits[circ_id] = {"status": status, "path": path, "purpose": args.get("PURPOSE"),
+                                          "exit": "IS_INTERNAL" not in flags and "ONEHOP_TUNNEL" not in flags,
+                                          "launched": launched, "built": built}
+                if status == "BUILT":
+                    self.builtCount += 1
+            self.updated = monotonic()
+            self._cond.notify_all()
+
+    def _stream(self, line: str) -> None:
+        # STREAM 34 SUCCEEDED 12 93.184.216.34:443
+        parts = line.split(" ")
+        if len(parts) < 5:
+            return
+        stream_id, status, circ_id, target = parts[1:5]
+        with self._cond:
+            if status in ("CLOSED", "FAILED"):
+                self.streams.pop(stream_id, None)
+            else:
+                self.streams[stream_id] = {"status": status, "circuit": circ_id, "target": target}
+                if status == "SUCCEEDED":
+                    self.lastStreamCircuit = circ_id
+            self.updated = monotonic()
+
+    def loadCircuits(self, lines: list) -> None:
+        """
+        Seeds the circuit table from a GETINFO circuit-status reply, for circuits built before the subscription.
+
+        :param lines: The "<id> <status> <path> ..." lines of the reply.
+        """
+        with self._cond:
+            # not new circuits: must not wake waitCircuit()
+            count = self.builtCount
+            for line in lines:
+                if line and line[0].isdigit():
+                    self._circ(f"CIRC {line}")
+            self.builtCount = count
+
+    def markNewnym(self) -> None:
+        """
+        Records a SIGNAL NEWNYM: circuits built before it no longer get new streams.
+        """
+        with self._cond:
+            self.newnymAt = monotonic()
+            self.lastStreamCircuit = None
+
+    def currentCircuit(self) -> str:
+        """
+        Best guess of the circuit new streams leave through, without asking Tor: the circuit of the last stream
+        that succeeded, otherwise the most recently built exit circuit. Circuits made dirty by NEWNYM are skipped.
+
+        :return: The circuit id, or None if no usable circuit is known.
+        """
+        with self._cond:
+            def usable(circ: dict) -> bool:
+                return bool(circ and circ["status"] == "BUILT" and circ["exit"] and circ["path"]
+                            and circ["purpose"] in (None, "GENERAL")
+                            and (self.newnymAt is None or (circ["built"] or 0) >= self.newnymAt))
+            if usable(self.circuits.get(self.lastStreamCircuit)):
+                return self.lastStreamCircuit
+            best = None
+            for circ_id, circ in self.circuits.items():
+                if usable(circ) and (best is None or circ["built"] >= self.circuits[best]["built"]):
+                    best = circ_id
+            return best
+
+    def waitReady(self, timeout: float = None) -> bool:
+        """
+        Blocks until the Onion is bootstrapped and has working circuits.
+
+        :param timeout: Seconds to wait, None waits forever.
+        :return: True if ready, False on timeout.
+        """
+        return self.ready.wait(timeout)
+
+    def waitCircuit(self, after: int, timeout: float = None) -> bool:
+        """
+        Blocks until a circuit is built after the moment `builtCount` was `after`. Used to wait for the fresh
+        circuits Tor builds after SIGNAL NEWNYM.
+
+        :param after: Value of builtCount read before the action that should produce a new circuit.
+        :param timeout: Seconds to wait, None waits forever.
+        :return: True if a new circuit was built, False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.builtCount > after, timeout)
+
+    def builtCircuits(self) -> dict:
+        with self._cond:
+            return {cid: dict(c) for cid, c in self.circuits.items() if c["status"] == "BUILT"}
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of the current state.
+        """
+        with self._cond:
+            return {
+                "Bootstrap": self.progress,
+                "Tag": self.tag,
+                "Summary": self.summary,
+                "Ready": self.ready.is_set(),
+                "Circuits": len(self.circuits),
+                "BuiltCircuits": sum(1 for c in self.circuits.values() if c["status"] == "BUILT"),
+                "Streams": len(self.streams),
+                "Updated": self.updated
+            }
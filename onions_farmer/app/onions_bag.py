@@ -1,6 +1,9 @@
 
 from threading import Thread
-from time import sleep
+
+from .bootstrap import BootstrapScheduler
+from .rotation import RotationScheduler
+from .exit_ip import collectExits
 
 
 class OnionsBag:
@@ -9,17 +12,22 @@ class OnionsBag:
     such as starting Tor processes, stopping them, and obtaining IP addresses. It can automatically 
     handle IP retrieval for each Onion upon start if specified.
     """
-    def __init__(self, onions: list, get_ip: bool = True):
+    def __init__(self, onions: list, get_ip: bool = True, quiet: bool = False):
         """
         Initializes the OnionsBag with a list of Onion objects.
 
         :param onions: A list of Onion objects to be managed.
         :param get_ip: A boolean indicating whether to automatically retrieve IP addresses for each Onion. Defaults to True.
+        :param quiet: If True, the bag is not printed on creation.
         """
         self._onions = onions
         self._get_ip = get_ip
-        print("\n** Make Onions Bag Successfull **")
-        print(self.__str__())
+        self.scheduler = None
+        self.rotation = None
+        self.exitReport = None
+        if not quiet:
+            print("\n** Make Onions Bag Successfull **")
+            print(self.__str__())
     
     @property
     def len(self) -> int:
@@ -33,17 +41,46 @@ class OnionsBag:
     @property
     def isTorConn(self) -> bool:
         """
-        Checks if all Onion instances are connected to the Tor network.
+        Checks if all Onion instances are connected to the Tor network. Reads the cached state of each Onion,
+        call refresh() first to confirm it with every Tor process.
 
         :return: True if all Onion instances are connected; False otherwise.
         """
-        for onion in self._onions:
-            if onion.isTorConn:
-                continue
-            else:
-                return False
-        return True
+        return all(onion.isTorConn for onion in self._onions)
     
+    def addOnion(self, onion: object, start: bool = True) -> None:
+        """
+        Adds an Onion to the bag, e.g. to grow a running bag under load. A carousel built on the bag sees the
+        Onion in its list but routes to it only after CarouselProxyHttp.addOnion().
+
+        :param onion: The Onion to add, usually from OnionsFarmer.plantOnion().
+        :param start: If True, the Onion's Tor process is started unless it already runs.
+        """
+        if any(o is onion for o in self._onions):
+            return
+        self._onions.append(onion)
+        if self.rotation:
+            self.rotation.addOnion(onion)
+        if start and onion.status() == "ready to start":
+            onion.start()
+
+    def removeOnion(self, onion: object, stop: bool = True) -> None:
+        """
+        Removes an Onion from the bag. Take it out of a carousel first so no new request is routed to it.
+
+        :param onion: The Onion to remove.
+        :param stop: If True, the Onion is stopped.
+        """
+        if self.rotation:
+            self.rotation.removeOnion(onion)
+        # in place: a carousel shares this list
+        for i, o in enumerate(self._onions):
+            if o is onion:
+                del self._onions[i]
+                break
+        if stop:
+            onion.stop()
+
     def openBag(self) -> list:
         """
         Provides access to the list of Onion objects.
@@ -52,44 +89,73 @@ class OnionsBag:
         """
         return self._onions
     
-    def start(self) -> None:
-        """
-        Starts all Onion instances within the bag. Optionally initiates IP retrieval if set during initialization.
+    def start(self, concurrency: int = 8, rate: float = 2, priority: object = None, first: int = None,
+              progress: object = None, timeout: float = 300) -> object:
         """
-        for onion in self._onions:
-            onion.start()
+        Starts all Onion instances within the bag through a BootstrapScheduler: at most `concurrency` Tor processes
+        bootstrap at the same time and new ones are started at no more than `rate` per second, so a large bag does
+        not hammer the directory authorities and the local CPU. Optionally initiates IP retrieval if set during
+        initialization, once every Onion is ready.
+
+        :param concurrency: Maximum number of Onions bootstrapping at the same time. 0 or None means no limit.
+        :param rate: Maximum Tor process starts per second. 0 or None disables pacing.
+        :param priority: Optional callable returning a sort key for an Onion; lower keys start first.
+        :param first: Number of ready Onions that resolves the returned future. Defaults to all of them.
+        :param progress: Optional callable `progress(onion, ready, total)` called as each Onion reaches 100%.
+        :param timeout: Seconds an Onion may take to bootstrap before its slot is given to the next one.
+        :return: A Future resolved with the list of ready Onions once the first `first` of them are bootstrapped.
+        """
+        self.scheduler = BootstrapScheduler(self._onions, concurrency, rate, priority=priority, first=first,
+                                            progress=progress, timeout=timeout)
+        ready = self.scheduler.start()
         if self._get_ip:
             getip = Thread(target=self._autoGetIP)
             getip.start()
+        return ready
     
     def stop(self) -> None:
         """
         Stops all Onion instances within the bag.
         """
+        if self.scheduler:
+            self.scheduler.stop()
+        self.stopRotation()
         for onion in self._onions:
             onion.stop()
     
     def _autoGetIP(self) -> None:
         """
-        A private method that waits for all Onion instances to connect before initiating the IP retrieval process.
+        A private method that waits for all Onion instances to bootstrap before initiating the IP retrieval process.
         """
-        while not self.isTorConn:
-            sleep(0.3)
+        self.scheduler.done.result()
+        if self.scheduler.stopEvent.is_set():
+            return
         self.getIP()
 
     
     def _getIP(self) -> None:
         """
-        A private method that starts threads for each Onion to retrieve their exit node IP addresses concurrently.
+        A private method that retrieves the exit node IP addresses of all Onions concurrently through collectIPs().
         """
-        th = []
-        for onion in self._onions:
-            t = Thread(target=onion._getIP, daemon=True)
-            th.append(t)
-            t.start()
-        for t in th:
-            t.join()
-        print("All IP address is obtained")
+        self.collectIPs()
+        print(f"All IP address is obtained: {self.exitReport['Unique']} unique exits for {self.exitReport['Total']} Onions")
+
+    def collectIPs(self, concurrency: int = 16, timeout: float = 15, unique: bool = False, rounds: int = 3) -> dict:
+        """
+        Reads the exit of every Onion with at most `concurrency` lookups in flight; a lookup taking longer than
+        `timeout` seconds is given up and reported as None instead of blocking the call. Exits shared by several
+        Onions are listed in the uniqueness report kept in `exitReport`. With `unique` the Onions sharing an exit
+        get new circuits (all but one per exit) until every Onion has its own exit or `rounds` rounds are done.
+
+        :param concurrency: Maximum number of lookups running at the same time.
+        :param timeout: Seconds a single lookup may take.
+        :param unique: If True, renews circuits on duplicate exits.
+        :param rounds: Maximum number of renewal rounds.
+        :return: Dictionary Onion name -> {"IP", "Country", "Fingerprint", "Circuit"}, None for Onions whose exit
+                 could not be obtained.
+        """
+        exits, self.exitReport = collectExits(self._onions, concurrency, timeout, unique, rounds)
+        return exits
 
     def getIP(self) -> None:
         """
@@ -100,12 +166,63 @@ class OnionsBag:
         print("Start obtain IP address")
     
     
-    def newCircuit(self) -> None:
+    def refresh(self) -> bool:
         """
-        Initiates the creation of a new circuit for all Onion instances within the bag.
+        Refreshes the cached state of every Onion from its Tor process concurrently.
+
+        :return: True if all Onion instances are connected; False otherwise.
         """
+        th = []
         for onion in self._onions:
-            onion.newCircuit()
+            t = Thread(target=onion.refresh, daemon=True)
+            th.append(t)
+            t.start()
+        for t in th:
+            t.join()
+        return self.isTorConn
+
+    def newCircuit(self, max_share: float = None) -> None:
+        """
+        Initiates the creation of a new circuit for all Onion instances within the bag.
+
+        :param max_share: If set, the circuits are renewed in a staggered way, never more than this fraction of the
+                          bag at the same time, so the bag keeps serving during the renewal. By default every Onion
+                          sends NEWNYM at once.
+        """
+        if max_share is None:
+            for onion in self._onions:
+                onion.newCircuit()
+            return
+        if self.rotation and not self.rotation.stopEvent.is_set():
+            self.rotation.rotateAll()
+            return
+        RotationScheduler(self._onions, max_share=max_share).rotateAll()
+
+    def startRotation(self, interval: float = None, max_requests: int = None, max_bytes: int = None,
+                      on_block: int = None, max_share: float = 0.1, check: float = 1) -> None:
+        """
+        Starts rotating the circuits of the bag by policy through a RotationScheduler, available as `rotation`.
+        Each Onion gets a new circuit every `interval` seconds, after `max_requests` requests or `max_bytes` bytes
+        through its HTTPBridge (or a carousel), or after `on_block` consecutive 403/429/503 answers, whichever
+        comes first. No more than `max_share` of the bag rebuilds at the same time.
+
+        :param interval: Seconds between two rotations of the same Onion. None disables the policy.
+        :param max_requests: Requests per circuit. None disables the policy.
+        :param max_bytes: Bytes per circuit, both directions. None disables the policy.
+        :param on_block: Consecutive block-like responses before a rotation. None disables the policy.
+        :param max_share: Largest fraction of the bag rotating at the same time; at least one Onion always may.
+        :param check: Seconds between two policy checks.
+        """
+        self.stopRotation()
+        self.rotation = RotationScheduler(self._onions, interval, max_requests, max_bytes, on_block, max_share, check)
+        self.rotation.start()
+
+    def stopRotation(self) -> None:
+        """
+        Stops the policy-driven rotation started with startRotation().
+        """
+        if self.rotation:
+            self.rotation.stop()
 
 
     def showOnions(self) -> str:
@@ -0,0 +1,180 @@
+import threading
+
+from math import floor
+from random import random
+from threading import Thread
+from time import monotonic
+
+
+class RotationScheduler:
+    """
+    Rotates the circuits of a bag of Onions by policy instead of all at once. An Onion is due for a new circuit
+    when its last rotation is `interval` seconds old, when its bridges carried `max_requests` requests or
+    `max_bytes` bytes since then, or when `on_block` block-like answers (403, 429, 503) came back in a row.
+    Due Onions are queued and rotated one by one, never more than `max_share` of the bag at the same time, so
+    the rest of the bag keeps serving while a few rebuild. Onions being rotated are flagged `rotating` and a
+    carousel routes new requests around them.
+    """
+    def __init__(self, onions: list, interval: float = None, max_requests: int = None, max_bytes: int = None,
+                 on_block: int = None, max_share: float = 0.1, check: float = 1):
+        """
+        Prepares the scheduler. Nothing is rotated until start() or rotateAll().
+
+        :param onions: The Onion objects to rotate.
+        :param interval: Seconds between two rotations of the same Onion. None disables the policy.
+        :param max_requests: Requests through the Onion's bridges that trigger a rotation. None disables the policy.
+        :param max_bytes: Bytes (both directions) through the Onion's bridges that trigger a rotation. None disables the policy.
+        :param on_block: Consecutive block-like responses that trigger a rotation. None disables the policy.
+        :param max_share: Largest fraction of the bag rotating at the same time; at least one Onion always may.
+        :param check: Seconds between two policy checks.
+        """
+        self.onions = list(onions)
+        self.interval = interval
+        self.maxRequests = max_requests
+        self.maxBytes = max_bytes
+        self.onBlock = on_block
+        self.maxShare = max_share
+        self.check = check
+        self.capacity = max(1, floor(len(self.onions) * max_share))
+        self.stopEvent = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.queue = []
+        self.rotating = set()
+        self.rotations = 0
+        self.reasons = {}
+        now = monotonic()
+        # spread the first interval rotations, the Onions of a bag usually start together
+        self.lastRotation = {o.name: now - random() * interval if interval else now for o in self.onions}
+
+    @property
+    def policies(self) -> bool:
+        return any(p is not None for p in (self.interval, self.maxRequests, self.maxBytes, self.onBlock))
+
+    def start(self) -> None:
+        """
+        Starts the background thread checking the policies and running the queued rotations.
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.stopEvent.clear()
+            self._thread = Thread(target=self._loop, name="RotationScheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops checking the policies and drops the queue. Rotations already running finish on their own.
+        """
+        self.stopEvent.set()
+        self._wake.set()
+        with self._lock:
+            self.queue.clear()
+
+    def rotateAll(self) -> None:
+        """
+        Queues every Onion for a new circuit now, still no more than `max_share` of the bag at a time. Without
+        any policy set the scheduler stops by itself once the queue is done.
+        """
+        with self._lock:
+            for onion in self.onions:
+                self._enqueue(onion, "manual")
+        self.start()
+        self._wake.set()
+
+    def addOnion(self, onion: object) -> None:
+        """
+        Adds an Onion joining the bag. Its interval starts now.
+        """
+        with self._lock:
+            if any(o is onion for o in self.onions):
+                return
+            self.onions.append(onion)
+            self.lastRotation[onion.name] = monotonic()
+            self.capacity = max(1, floor(len(self.onions) * self.maxShare))
+
+    def removeOnion(self, onion: object) -> None:
+        """
+        Forgets an Onion leaving the bag. A rotation already running for it finishes on its own.
+        """
+        with self._lock:
+            self.onions = [o for o in self.onions if o is not onion]
+            self.queue = [(o, r) for o, r in self.queue if o is not onion]
+            self.lastRotation.pop(onion.name, None)
+            self.capacity = max(1, floor(len(self.onions) * self.maxShare))
+
+    def _enqueue(self, onion: object, reason: str) -> None:
+        if onion.name in self.rotating or any(o is onion for o, _ in self.queue):
+            return
+        self.queue.append((onion, reason))
+
+    def _due(self, onion: object, now: float) -> str:
+        if self.interval is not None and now - self.lastRotation.get(onion.name, now) >= self.interval:
+            return "interval"
+        traffic = getattr(onion, "traffic", None)
+        if traffic is None:
+            return None
+        if self.onBlock is not None and traffic.blocks >= self.onBlock:
+            return "block"
+        if self.maxRequests is not None and traffic.requests >= self.maxRequests:
+            return "requests"
+        if self.maxBytes is not None and traffic.bytes >= self.maxBytes:
+            return "bytes"
+        return None
+
+    def tick(self) -> None:
+        """
+        Queues the Onions whose policies are due and starts as many queued rotations as the share allows.
+        """
+        now = monotonic()
+        with self._lock:
+            if self.policies:
+                for onion in self.onions:
+                    if onion.stopEvent.is_set() or not onion.isTorConn:
+                        continue
+                    reason = self._due(onion, now)
+                    if reason:
+                        self._enqueue(onion, reason)
+            while self.queue and len(self.rotating) < self.capacity:
+                onion, reason = self.queue.pop(0)
+                if onion.stopEvent.is_set():
+                    continue
+                self.rotating.add(onion.name)
+                Thread(target=self._rotate, args=(onion, reason), daemon=True).start()
+
+    def _rotate(self, onion: object, reason: str) -> None:
+        onion.rotating = True
+        try:
+            onion.newCircuit(wait=True)
+        except Exception as e:
+            print(f"[{onion.name}] [!!] ERROR: Rotation ({reason}): {e} [!!]")
+        finally:
+            onion.rotating = False
+            with self._lock:
+                self.rotating.discard(onion.name)
+                self.lastRotation[onion.name] = monotonic()
+                self.rotations += 1
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+            # a slot is free: start the next queued rotation without waiting for the next check
+            self._wake.set()
+
+    def _loop(self) -> None:
+        while not self.stopEvent.is_set():
+            self._wake.clear()
+            self.tick()
+            with self._lock:
+                if not self.queue and not self.rotating and not self.policies:
+                    self._thread = None
+                    return
+            self._wake.wait(self.check)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "Rotating": sorted(self.rotating),
+                "Queued": [o.name for o, _ in self.queue],
+                "Capacity": self.capacity,
+                "Rotations": self.rotations,
+                "Reasons": dict(self.reasons)
+            }
@@ -0,0 +1,528 @@
+import threading
+import multiprocessing
+import pickle
+
+from concurrent.futures import Future
+from itertools import count
+from math import ceil
+from threading import Thread
+from time import monotonic
+from typing import Union
+
+from .onion import Onion
+from .onions_bag import OnionsBag
+from .exit_ip import collectExits
+from .metrics import REGISTRY
+from .tools.socks_pool import SocksPool
+
+
+def serveShard(conn: object, index: int) -> None:
+    """
+    Entry point of a shard worker process: owns the Onions (Tor processes, Farmers and HTTP bridges) assigned to
+    it and serves the requests of the parent ShardPool until told to shut down or the pipe closes.
+
+    :param conn: Worker end of the multiprocessing Pipe.
+    :param index: Number of the worker, used in console messages.
+    """
+    Shard(conn, index).serve()
+
+
+class Shard:
+    """
+    Worker side of the sharding protocol. Every request runs on its own thread, so a slow call (a control port
+    round trip, an IP check) never holds up the others; replies and events share the pipe under a lock.
+
+    Parent -> worker: (call_id, op, payload)
+    Worker -> parent: ("reply", call_id, ok, result) or ("event", kind, data)
+    """
+    def __init__(self, conn: object, index: int):
+        self.conn = conn
+        self.index = index
+        self.name = f"Shard{index}"
+        self.onions = {}
+        self.bags = {}
+        self._sendLock = threading.Lock()
+
+    def send(self, msg: tuple) -> None:
+        with self._sendLock:
+            self.conn.send(msg)
+
+    def serve(self) -> None:
+        while True:
+            try:
+                call_id, op, payload = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if op == "shutdown":
+                self.stopAll(*payload)
+                self.send(("reply", call_id, True, None))
+                return
+            Thread(target=self.handle, args=(call_id, op, payload), daemon=True).start()
+        self.stopAll()
+
+    def handle(self, call_id: int, op: str, payload: tuple) -> None:
+        try:
+            match op:
+                case "plant":
+                    result = self.plant(*payload)
+                case "onion":
+                    result = self.onionCall(*payload)
+                case "bag":
+                    result = self.makeBag(*payload)
+                case "bagop":
+                    result = self.bagCall(*payload)
+                case "metrics":
+                    result = REGISTRY.dump(local=True)
+                case _:
+                    raise ValueError(f"unknown shard operation: {op}")
+            pickle.dumps(result)
+        except Exception as e:
+            self.send(("reply", call_id, False, f"{type(e).__name__}: {e}"))
+            return
+        self.send(("reply", call_id, True, result))
+
+    def plant(self, cfg: dict) -> str:
+        onion = Onion(cfg, threading.Event())
+        self.onions[onion.name] = onion
+        return onion.name
+
+    def onionCall(self, name: str, attr: str, args: tuple = (), kwargs: dict = None) -> object:
+        onion = self.onions[name]
+        match attr:
+            case "stopEvent.set":
+                return onion.stopEvent.set()
+            case "stopEvent.is_set":
+                return onion.stopEvent.is_set()
+        value = getattr(onion, attr)
+        if callable(value):
+            value = value(*args, **(kwargs or {}))
+        return value
+
+    def makeBag(self, bag_id: int, names: list, get_ip: bool) -> int:
+        self.bags[bag_id] = OnionsBag([self.onions[n] for n in names], get_ip, quiet=True)
+        return len(names)
+
+    def bagCall(self, bag_id: int, method: str, args: tuple = (), kwargs: dict = None) -> object:
+        bag = self.bags[bag_id]
+        kwargs = dict(kwargs or {})
+        if method == "start":
+            kwargs["progress"] = lambda onion, ready, total: self.send(("event", "ready", (bag_id, onion.name)))
+            bag.start(*args, **kwargs)
+            bag.scheduler.done.add_done_callback(lambda f: self.send(("event", "done", (bag_id, self.index))))
+            return None
+        if method == "rows":
+            return [onion.info() for onion in bag.openBag()]
+        value = getattr(bag, method)
+        return value(*args, **kwargs) if callable(value) else value
+
+    def stopAll(self, timeout: float = 10) -> None:
+        # the Tor processes are children of this worker: let every Onion terminate its own before exiting
+        for onion in self.onions.values():
+            onion.stop()
+        deadline = monotonic() + timeout
+        for onion in self.onions.values():
+            if onion.is_alive():
+                onion.join(max(0, deadline - monotonic()))
+
+
+class ShardClient:
+    """
+    Parent side of one shard worker process: sends requests over the pipe and resolves a Future per call id
+    from a reader thread. Asynchronous events from the worker go to `onEvent(kind, data)`.
+    """
+    def __init__(self, index: int, context: object, on_event: object = None):
+        self.index = index
+        self.onEvent = on_event
+        self.onions = 0
+        self._ids = count()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=serveShard, args=(child, index), name=f"OnionsShard{index}", daemon=True)
+        self.process.start()
+        child.close()
+        self._reader = Thread(target=self._readLoop, name=f"SHARD_{index}", daemon=True)
+        self._reader.start()
+
+    def send(self, op: str, *payload) -> Future:
+        future = Future()
+        with self._lock:
+            call_id = next(self._ids)
+            self._futures[call_id] = future
+            try:
+                self.conn.send((call_id, op, payload))
+            except (OSError, ValueError) as e:
+                del self._futures[call_id]
+                future.set_exception(ConnectionError(f"shard {self.index} is gone: {e}"))
+        return future
+
+    def call(self, op: str, *payload, timeout: float = 30) -> object:
+        return self.send(op, *payload).result(timeout)
+
+    def _readLoop(self) -> None:
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "event":
+                if self.onEvent:
+                    try:
+                        self.onEvent(msg[1], msg[2])
+                    except Exception as e:
+                        print(f"[!!] ERROR: shard {self.index} event handler: {e} [!!]")
+                continue
+            _, call_id, ok, result = msg
+            with self._lock:
+                future = self._futures.pop(call_id, None)
+            if future:
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(result))
+        with self._lock:
+            pending = list(self._futures.values())
+            self._futures.clear()
+        for future in pending:
+            future.set_exception(ConnectionError(f"shard {self.index} is gone"))
+
+    def shutdown(self, timeout: float = 10) -> Future:
+        # asks the worker to stop its Onions; finish() waits for the process
+        return self.send("shutdown", timeout)
+
+    def finish(self, timeout: float = 5) -> None:
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ShardPool:
+    """
+    A pool of worker processes that run Onions on behalf of OnionsFarmer. Each worker owns its Tor processes,
+    Farmers and HTTP bridges, so relay work is spread over `workers` interpreters (and cores) instead of sharing
+    one GIL. New Onions go to the worker holding the fewest.
+    """
+    def __init__(self, workers: int, start_method: str = "spawn"):
+        """
+        Starts the worker processes. With the "spawn" (default) and "forkserver" start methods the calling script
+        must create the OnionsFarmer under an `if __name__ == "__main__":` guard.
+
+        :param workers: Number of worker processes.
+        :param start_method: multiprocessing start method.
+        """
+        context = multiprocessing.get_context(start_method)
+        self._bagIds = count(1)
+        self.bags = {}
+        self.workers = [ShardClient(i, context, self._onEvent) for i in range(workers)]
+        REGISTRY.addCollector(self.collectMetrics)
+
+    def collectMetrics(self, timeout: float = 5) -> list:
+        # metric dumps of every worker, merged by the registry of this process on every read
+        futures = [worker.send("metrics") for worker in self.workers if worker.process.is_alive()]
+        dumps = []
+        for future in futures:
+            try:
+                dumps.append(future.result(timeout))
+            except Exception as e:
+                print(f"[!!] ERROR: Shard metrics: {e} [!!]")
+        return dumps
+
+    def _onEvent(self, kind: str, data: tuple) -> None:
+        bag = self.bags.get(data[0])
+        if bag:
+            bag._onEvent(kind, data[1])
+
+    def pick(self) -> ShardClient:
+        return min(self.workers, key=lambda w: w.onions)
+
+    def plant(self, cfg: dict, worker: ShardClient = None) -> object:
+        worker = worker or self.pick()
+        name = worker.call("plant", cfg)
+        worker.onions += 1
+        return OnionProxy(name, worker, cfg)
+
+    def plantMany(self, cfgs: list) -> list:
+        """
+        Creates Onions from prepared configurations, spread evenly over the workers, with every worker creating its
+        share concurrently.
+        """
+        assigned = []
+        for cfg in cfgs:
+            worker = self.pick()
+            worker.onions += 1
+            assigned.append((worker, cfg, worker.send("plant", cfg)))
+        proxies = []
+        for worker, cfg, future in assigned:
+            try:
+                proxies.append(OnionProxy(future.result(30), worker, cfg))
+            except Exception as e:
+                worker.onions -= 1
+                print(f"[!!] ERROR: Shard {worker.index} can not create Onion {cfg['Name']}: {e} [!!]")
+        return proxies
+
+    def makeBag(self, proxies: list, get_ip: bool = True) -> object:
+        return ShardedBag(self, next(self._bagIds), proxies, get_ip)
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """
+        Stops every Onion in every worker (all workers at once) and ends the worker processes.
+
+        :param timeout: Seconds each worker may spend waiting for its Onions to terminate their Tor processes.
+        """
+        REGISTRY.removeCollector(self.collectMetrics)
+        futures = [worker.shutdown(timeout) for worker in self.workers]
+        for future in futures:
+            try:
+                future.result(timeout + 5)
+            except Exception:
+                pass
+        for worker in self.workers:
+            worker.finish()
+
+
+class RemoteEvent:
+    """
+    Stand-in for the stop event of an Onion living in a shard worker. is_set() is cached for `ttl` seconds so
+    components polling it in a loop (the carousel) do not turn into an IPC storm.
+    """
+    def __init__(self, proxy: object, ttl: float = 1):
+        self.proxy = proxy
+        self.ttl = ttl
+        self._value = False
+        self._stamp = 0
+
+    def set(self) -> None:
+        self._value = True
+        self.proxy._call("stopEvent.set")
+
+    def is_set(self) -> bool:
+        if self._value or monotonic() - self._stamp < self.ttl:
+            return self._value
+        try:
+            self._value = bool(self.proxy._call("stopEvent.is_set"))
+        except Exception:
+            self._value = True
+        self._stamp = monotonic()
+        return self._value
+
+
+class OnionProxy:
+    """
+    Parent-side handle of an Onion running in a shard worker. It offers the same API as Onion (start, stop,
+    newCircuit, sendCMD, refresh, isTorConn, IP, conf, info, status); every call is forwarded to the worker.
+    """
+    def __init__(self, name: str, worker: ShardClient, cfg: dict):
+        self.name = name
+        self.worker = worker
+        self._config = cfg
+        self.localSocks = cfg.get("LocalSocks")
+        self.localAddr = cfg.get("LocalAddr")
+        self.outSocks = cfg.get("OutSocks")
+        self._httpBridge = None
+        self.stopEvent = RemoteEvent(self)
+        # upstream connections opened from the parent process (e.g. by a carousel) are pooled here
+        self.socksPool = SocksPool(cfg.get("PoolSize", 32), cfg.get("PoolIdle", 30), cfg.get("PoolPerHost", 8))
+
+    def _call(self, attr: str, *args, **kwargs) -> object:
+        return self.worker.call("onion", self.name, attr, args, kwargs)
+
+    @property
+    def conf(self) -> dict:
+        return self._call("conf")
+
+    @property
+    def isTorConn(self) -> bool:
+        return self._call("isTorConn")
+
+    @property
+    def IP(self) -> Union[str, bool]:
+        return self._call("_getIP")
+
+    @property
+    def shard(self) -> int:
+        return self.worker.index
+
+    def start(self) -> None:
+        self._call("start")
+
+    def stop(self) -> None:
+        self.stopEvent.set()
+
+    def is_alive(self) -> bool:
+        return self._call("is_alive")
+
+    def newCircuit(self, obtain_ip: bool = False, wait: bool = False) -> None:
+        if wait:
+            # NEWNYM may first wait out Tor's rate limit, then for the new circuit
+            self.worker.call("onion", self.name, "newCircuit", (obtain_ip, True), {}, timeout=120)
+        else:
+            self._call("newCircuit", obtain_ip)
+
+    def sendCMD(self, command: str) -> Union[str, bool]:
+        return self._call("sendCMD", command)
+
+    def exitInfo(self) -> Union[dict, bool]:
+        return self._call("exitInfo")
+
+    def refresh(self) -> bool:
+        return self._call("refresh")
+
+    def status(self) -> str:
+        return self._call("status")
+
+    def info(self) -> str:
+        return self._call("info")
+
+    def infoConf(self) -> None:
+        for k, i in self.conf.items():
+            print(f"{str(k):<20}{str(i):<40}")
+
+
+class ShardedBag:
+    """
+    OnionsBag counterpart for Onions spread over shard workers. Every worker keeps a regular OnionsBag with its
+    share of the Onions; bag operations are fanned out to all workers at once and the results combined.
+    """
+    def __init__(self, pool: ShardPool, bag_id: int, proxies: list, get_ip: bool = True):
+        self.pool = pool
+        self.bagId = bag_id
+        self._onions = proxies
+        self._get_ip = get_ip
+        self._byName = {p.name: p for p in proxies}
+        self._lock = threading.Lock()
+        self.ready = None
+        self.exitReport = None
+        self.done = None
+        self._first = 0
+        self._readyOnions = []
+        self._doneShards = set()
+        self._progress = None
+        pool.bags[bag_id] = self
+        self._fanOut("bag", lambda w, names: (self.bagId, names, get_ip))
+        print("\n** Make Onions Bag Successfull **")
+        print(self.__str__())
+
+    @property
+    def shards(self) -> dict:
+        shards = {}
+        for proxy in self._onions:
+            shards.setdefault(proxy.worker, []).append(proxy.name)
+        return shards
+
+    def _fanOut(self, op: str, payload: object) -> list:
+        futures = [w.send(op, *payload(w, names)) for w, names in self.shards.items()]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(60))
+            except Exception as e:
+                print(f"[!!] ERROR: Shard bag operation {op}: {e} [!!]")
+                results.append(None)
+        return results
+
+    def _bagCall(self, method: str, *args, **kwargs) -> list:
+        return self._fanOut("bagop", lambda w, names: (self.bagId, method, args, kwargs))
+
+    @property
+    def len(self) -> int:
+        return len(self._onions)
+
+    @property
+    def isTorConn(self) -> bool:
+        return all(self._bagCall("isTorConn"))
+
+    def openBag(self) -> list:
+        return self._onions
+
+    def start(self, concurrency: int = 8, rate: float = 2, priority: object = None, first: int = None,
+              progress: object = None, timeout: float = 300) -> Future:
+        """
+        Starts the bag on every worker. Concurrency and rate limits are split between the workers in proportion
+        to the Onions they hold, so the whole bag respects them. `priority` must be picklable (a module level
+        function) as it runs in the workers; `progress(onion_proxy, ready, total)` runs in this process.
+
+        :return: A Future resolved with the ready OnionProxy objects once the first `first` of them bootstrapped.
+        """
+        total = len(self._onions)
+        self.ready = Future()
+        self.done = Future()
+        self._first = min(first or total, total)
+        self._readyOnions = []
+        self._doneShards = set()
+        self._progress = progress
+        if not total:
+            self.ready.set_result([])
+            self.done.set_result([])
+            return self.ready
+        for worker, names in self.shards.items():
+            share = len(names) / total
+            kwargs = {
+                "concurrency": max(1, ceil(concurrency * share)) if concurrency else concurrency,
+                "rate": rate * share if rate else rate,
+                "priority": priority,
+                "timeout": timeout,
+            }
+            worker.send("bagop", self.bagId, "start", (), kwargs)
+        return self.ready
+
+    def _onEvent(self, kind: str, data: object) -> None:
+        with self._lock:
+            if kind == "ready":
+                proxy = self._byName.get(data)
+                if not proxy:
+                    return
+                self._readyOnions.append(proxy)
+                count_ready = len(self._readyOnions)
+            elif kind == "done":
+                self._doneShards.add(data)
+            ready = list(self._readyOnions)
+            final = len(self._doneShards) >= len(self.shards)
+            if self.ready and not self.ready.done() and (len(ready) >= self._first or final):
+                self.ready.set_result(ready)
+            if self.done and final and not self.done.done():
+                self.done.set_result(ready)
+        if kind == "ready" and self._progress:
+            try:
+                self._progress(proxy, count_ready, len(self._onions))
+            except Exception as e:
+                print(f"[!!] ERROR: bootstrap progress callback: {e} [!!]")
+
+    def stop(self) -> None:
+        self._bagCall("stop")
+
+    def getIP(self) -> None:
+        self._bagCall("getIP")
+
+    def collectIPs(self, concurrency: int = 16, timeout: float = 15, unique: bool = False, rounds: int = 3) -> dict:
+        """
+        OnionsBag.collectIPs() across every worker: duplicates are found over the whole bag, not per worker.
+        """
+        exits, self.exitReport = collectExits(self._onions, concurrency, timeout, unique, rounds)
+        return exits
+
+    def newCircuit(self, max_share: float = None) -> None:
+        self._bagCall("newCircuit", max_share)
+
+    def startRotation(self, interval: float = None, max_requests: int = None, max_bytes: int = None,
+                      on_block: int = None, max_share: float = 0.1, check: float = 1) -> None:
+        """
+        Starts a RotationScheduler in every worker over the Onions it holds; `max_share` applies per worker.
+        """
+        self._bagCall("startRotation", interval, max_requests, max_bytes, on_block, max_share, check)
+
+    def stopRotation(self) -> None:
+        self._bagCall("stopRotation")
+
+    def refresh(self) -> bool:
+        return all(self._bagCall("refresh"))
+
+    def showOnions(self) -> str:
+        info = f"\n{'Name:':<20}{'Local Proxy':<25}{'Out Proxy':<25}{'ExitNodeIP':<20}{'Status':<20}{'IsTorConn':<15}{'BridgeHTTP':<20}\n"
+        for rows in self._bagCall("rows"):
+            for row in rows or []:
+                info += row + "\n"
+        return info
+
+    def __str__(self) -> str:
+        return self.showOnions()
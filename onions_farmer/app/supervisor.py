@@ -0,0 +1,217 @@
+import os
+import errno
+import select
+import threading
+
+from random import random
+from threading import Thread
+from time import monotonic
+
+from .metrics import TOR_RESTARTS
+
+
+class ProcessSupervisor:
+    """
+    One thread watching the Tor processes of every Onion. Each process is watched through a pidfd (Linux 5.3+)
+    so its exit wakes the thread at once; where pidfds are not available every process is polled each `interval`
+    seconds with waitpid. Exited processes are reaped right away. A Tor process that exits while its Onion is
+    not stopping is restarted with the same torrc and data directory (warm DirLib) after an exponential backoff:
+    `backoff` seconds, doubled after every crash up to `max_backoff`. The backoff starts over once a process
+    ran `reset_after` seconds, and after `max_restarts` crashes in a row the Onion is stopped. The thread ends
+    by itself once nothing is watched or waiting for a restart.
+    """
+    _lock = threading.Lock()
+    _shared = None
+
+    @classmethod
+    def shared(cls) -> object:
+        with cls._lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __init__(self, interval: float = 1, use_pidfd: bool = True):
+        self.interval = interval
+        self.usePidfd = use_pidfd and hasattr(os, "pidfd_open")
+        self._lock = threading.RLock()
+        self._watched = {}
+        self._pending = {}
+        self._closing = []
+        self._thread = None
+        self._wakeRead, self._wakeWrite = os.pipe()
+        os.set_blocking(self._wakeRead, False)
+        os.set_blocking(self._wakeWrite, False)
+        self.restarts = 0
+
+    @property
+    def mode(self) -> str:
+        return "pidfd" if self.usePidfd else "polling"
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wakeWrite, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _pidfd(self, pid: int) -> int:
+        if not self.usePidfd:
+            return None
+        try:
+            return os.pidfd_open(pid)
+        except OSError as e:
+            # ESRCH: already gone, the next check reaps it; ENOSYS/EPERM: poll from now on
+            if e.errno != errno.ESRCH:
+                print(f"[!!] ERROR: pidfd unavailable ({e}), polling Tor processes [!!]")
+                self.usePidfd = False
+            return None
+
+    def watch(self, onion: object, backoff: float = 1, max_backoff: float = 60, reset_after: float = 300,
+              max_restarts: int = None, failures: int = 0) -> None:
+        """
+        Starts watching the current Tor process of `onion` (onion.procTOR).
+
+        :param onion: The Onion; it must provide procTOR, stopEvent and restartTor().
+        :param backoff: Seconds before the first restart.
+        :param max_backoff: Longest wait between two restarts.
+        :param reset_after: Seconds a process must run for its crash to count as the first one again.
+        :param max_restarts: Crashes in a row after which the Onion is stopped. None restarts forever.
+        :param failures: Crashes in a row so far, kept across restarts.
+        """
+        proc = onion.procTOR
+        if proc is None:
+            return
+        with self._lock:
+            old = self._watched.pop(onion.name, None)
+            if old and old["fd"] is not None:
+                self._closing.append(old["fd"])
+            self._pending.pop(onion.name, None)
+            self._watched[onion.name] = {
+                "onion": onion, "proc": proc, "fd": self._pidfd(proc.pid), "started": monotonic(),
+                "policy": {"backoff": backoff, "max_backoff": max_backoff, "reset_after": reset_after,
+                           "max_restarts": max_restarts},
+                "failures": failures
+            }
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="ProcessSupervisor", daemon=True)
+                self._thread.start()
+        self._wake()
+
+    def unwatch(self, onion: object) -> None:
+        """
+        Stops watching `onion` and cancels a restart waiting for it, e.g. before the Onion terminates Tor itself.
+        """
+        with self._lock:
+            entry = self._watched.pop(onion.name, None)
+            self._pending.pop(onion.name, None)
+            if entry and entry["fd"] is not None:
+                # closed by the supervisor thread, which may be polling it right now
+                self._closing.append(entry["fd"])
+        self._wake()
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = monotonic()
+            return {
+                "Mode": self.mode,
+                "Watched": sorted(self._watched),
+                "Restarting": {name: round(max(0, p["due"] - now), 2) for name, p in self._pending.items()},
+                "Restarts": self.restarts
+            }
+
+    def _exited(self, entry: dict, code: int) -> None:
+        onion = entry["onion"]
+        self._watched.pop(onion.name, None)
+        if entry["fd"] is not None:
+            self._closing.append(entry["fd"])
+        if onion.stopEvent.is_set():
+            return
+        policy = entry["policy"]
+        ran = monotonic() - entry["started"]
+        failures = 1 if ran >= policy["reset_after"] else entry["failures"] + 1
+        what = f"exited with code {code} after {ran:.0f}s" if code is not None else "could not be started"
+        if policy["max_restarts"] is not None and failures > policy["max_restarts"]:
+            print(f"[{onion.name}] [!!] ERROR: Tor {what}, {failures - 1} restarts failed, giving up [!!]")
+            onion.restarting = False
+            onion.stop()
+            return
+        # +-10% so Onions crashing together do not restart together
+        delay = min(policy["max_backoff"], policy["backoff"] * 2 ** (failures - 1)) * (0.9 + random() * 0.2)
+        print(f"[{onion.name}] [!!] Tor {what}, restarting in {delay:.1f}s [!!]")
+        onion.restarting = True
+        self._pending[onion.name] = {"onion": onion, "due": monotonic() + delay, "policy": policy, "failures": failures}
+
+    def _restart(self, pending: dict) -> None:
+        onion = pending["onion"]
+        if not onion.restartTor():
+            if onion.stopEvent.is_set():
+                return
+            # Tor could not even be started: count it as another crash
+            with self._lock:
+                self._exited({"onion": onion, "fd": None, "started": monotonic(), "policy": pending["policy"],
+                              "failures": pending["failures"]}, None)
+            return
+        self.restarts += 1
+        TOR_RESTARTS.labels(onion.name).inc()
+        self.watch(onion, failures=pending["failures"], **pending["policy"])
+
+    def _check(self, ready: set) -> list:
+        # reaps exited processes, returns the restarts that are due
+        with self._lock:
+            for fd in self._closing:
+                os.close(fd)
+            self._closing.clear()
+            for entry in list(self._watched.values()):
+                if self.usePidfd and entry["fd"] is not None and entry["fd"] not in ready:
+                    continue
+                code = entry["proc"].poll()
+                if code is not None:
+                    self._exited(entry, code)
+            now = monotonic()
+            due = [p for p in self._pending.values() if p["due"] <= now]
+            for p in due:
+                self._pending.pop(p["onion"].name, None)
+            return due
+
+    def _timeout(self) -> float:
+        with self._lock:
+            timeout = self.interval
+            polled = not self.usePidfd or any(e["fd"] is None for e in self._watched.values())
+            if not polled:
+                timeout = None
+            if self._pending:
+                until = max(0, min(p["due"] for p in self._pending.values()) - monotonic())
+                timeout = until if timeout is None else min(timeout, until)
+            return timeout
+
+    def _run(self) -> None:
+        poller = select.poll()
+        poller.register(self._wakeRead, select.POLLIN)
+        registered = set()
+        while True:
+            with self._lock:
+                if not self._watched and not self._pending:
+                    for fd in self._closing:
+                        os.close(fd)
+                    self._closing.clear()
+                    self._thread = None
+                    return
+                fds = {e["fd"] for e in self._watched.values() if e["fd"] is not None}
+            for fd in registered - fds:
+                poller.unregister(fd)
+            for fd in fds - registered:
+                poller.register(fd, select.POLLIN)
+            registered = fds
+            timeout = self._timeout()
+            events = poller.poll(None if timeout is None else timeout * 1000)
+            ready = set()
+            for fd, _ in events:
+                if fd == self._wakeRead:
+                    try:
+                        while os.read(self._wakeRead, 64):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    ready.add(fd)
+            for pending in self._check(ready):
+                self._restart(pending)
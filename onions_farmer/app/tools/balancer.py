@@ -0,0 +1,138 @@
+import threading
+
+from random import random, choice, sample
+from typing import Union
+
+
+class Balancer:
+    """
+    Base class for the carousel load-balancing strategies. It keeps the bookkeeping every strategy can use:
+    in-flight requests and an EWMA of latency per backend. Subclasses implement `pick()` over the list of
+    candidate backends.
+    """
+    name = "base"
+
+    def __init__(self, backends: list, alpha: float = 0.3, fail_penalty: float = 2.0):
+        self.alpha = alpha
+        self.failPenalty = fail_penalty
+        self._lock = threading.Lock()
+        self.backends = []
+        self.outstanding = {}
+        self.latency = {}
+        for backend in backends:
+            self.add(backend)
+
+    def add(self, backend: tuple) -> None:
+        with self._lock:
+            if backend not in self.outstanding:
+                self.backends.append(backend)
+                self.outstanding[backend] = 0
+                self.latency[backend] = 0.0
+
+    def remove(self, backend: tuple) -> None:
+        with self._lock:
+            if backend in self.outstanding:
+                self.backends.remove(backend)
+                del self.outstanding[backend]
+                del self.latency[backend]
+
+    def inFlight(self, backend: tuple = None) -> int:
+        # requests in flight on `backend`, or on every backend
+        with self._lock:
+            if backend is None:
+                return sum(self.outstanding.values())
+            return self.outstanding.get(backend, 0)
+
+    def pick(self, candidates: list) -> tuple:
+        raise NotImplementedError
+
+    def choose(self, candidates: list = None) -> Union[tuple, bool]:
+        with self._lock:
+            candidates = self.backends if candidates is None else [c for c in candidates if c in self.outstanding]
+            if not candidates:
+                return None
+            backend = candidates[0] if len(candidates) == 1 else self.pick(candidates)
+            self.outstanding[backend] += 1
+            return backend
+
+    def finish(self, backend: tuple, elapsed: float = None, ok: bool = True) -> None:
+        with self._lock:
+            if backend not in self.outstanding:
+                return
+            self.outstanding[backend] = max(0, self.outstanding[backend] - 1)
+            if elapsed is None:
+                return
+            old = self.latency[backend]
+            if not ok:
+                # failures count as slow so the strategy backs away from the backend
+                elapsed = max(elapsed, old) * self.failPenalty
+            self.latency[backend] = elapsed if not old else old + self.alpha * (elapsed - old)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {b: {"outstanding": self.outstanding[b], "ewma": self.latency[b]} for b in self.backends}
+
+
+class RoundRobin(Balancer):
+    name = "round_robin"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._next = 0
+
+    def pick(self, candidates: list) -> tuple:
+        backend = candidates[self._next % len(candidates)]
+        self._next += 1
+        return backend
+
+
+class LeastOutstanding(Balancer):
+    name = "least_outstanding"
+
+    def pick(self, candidates: list) -> tuple:
+        low = min(self.outstanding[c] for c in candidates)
+        return choice([c for c in candidates if self.outstanding[c] == low])
+
+
+class EwmaLatency(Balancer):
+    name = "ewma"
+
+    def cost(self, backend: tuple) -> float:
+        return self.latency[backend] * (self.outstanding[backend] + 1)
+
+    def pick(self, candidates: list) -> tuple:
+        fresh = [c for c in candidates if not self.latency[c]]
+        if fresh:
+            return choice(fresh)
+        # weighted random on 1 / cost: fast exits get most traffic, slow ones still get probed
+        weights = [1.0 / self.cost(c) for c in candidates]
+        point = random() * sum(weights)
+        for backend, weight in zip(candidates, weights):
+            point -= weight
+            if point <= 0:
+                return backend
+        return candidates[-1]
+
+
+class PowerOfTwo(EwmaLatency):
+    name = "p2c"
+
+    def pick(self, candidates: list) -> tuple:
+        first, second = sample(candidates, 2)
+        key = lambda b: (self.outstanding[b], self.cost(b))
+        return first if key(first) <= key(second) else second
+
+
+STRATEGIES = {cls.name: cls for cls in (RoundRobin, LeastOutstanding, EwmaLatency, PowerOfTwo)}
+
+
+def makeBalancer(strategy: Union[str, Balancer], backends: list) -> Union[Balancer, bool]:
+    if isinstance(strategy, Balancer):
+        for backend in backends:
+            strategy.add(backend)
+        return strategy
+    cls = STRATEGIES.get(strategy)
+    if not cls:
+        print(f"[!!] ERROR: Unknown balancing strategy: {strategy}. Available: {', '.join(STRATEGIES)} [!!]")
+        return None
+    return cls(backends)
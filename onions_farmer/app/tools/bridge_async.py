@@ -0,0 +1,339 @@
+import asyncio
+import threading
+
+from threading import Thread
+from time import monotonic
+from typing import Union
+
+from .port_allocator import freePort
+from .relay import parseRequest, CONNECT_OK, CONTINUE, BAD_GATEWAY
+from .http_parser import HttpParser
+from .socks_pool import SocksPool
+from ..metrics import BridgeMetrics
+
+
+class EventLoopEngine:
+    """
+    One asyncio event loop per process, running in a single daemon thread. Every AsyncBridgeHTTP
+    registers its server on this loop, so the number of OS threads does not grow with the number
+    of bridges or client connections.
+    """
+    _lock = threading.Lock()
+    _loop = None
+    _thread = None
+
+    @classmethod
+    def getLoop(cls) -> asyncio.AbstractEventLoop:
+        with cls._lock:
+            if cls._loop is None or cls._loop.is_closed():
+                cls._loop = asyncio.new_event_loop()
+                cls._thread = Thread(target=cls._run, args=(cls._loop, ), name="OnionsEventLoop", daemon=True)
+                cls._thread.start()
+            return cls._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    @classmethod
+    def submit(cls, coro: object) -> object:
+        return asyncio.run_coroutine_threadsafe(coro, cls.getLoop())
+
+
+async def socks5Connect(socks_ip: str, socks_port: int, host: str, port: int, timeout: float = 30) -> Union[tuple, bool]:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(socks_ip, socks_port), timeout)
+    try:
+        writer.write(b"\x05\x01\x00")
+        await writer.drain()
+        greet = await asyncio.wait_for(reader.readexactly(2), timeout)
+        if greet != b"\x05\x00":
+            raise ConnectionError(f"SOCKS5 auth method rejected: {greet!r}")
+        target = host.encode("idna")
+        writer.write(b"\x05\x01\x00\x03" + bytes([len(target)]) + target + int(port).to_bytes(2, "big"))
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readexactly(4), timeout)
+        if head[1] != 0:
+            raise ConnectionError(f"SOCKS5 connect failed, reply code: {head[1]}")
+        match head[3]:
+            case 1:
+                await reader.readexactly(4 + 2)
+            case 4:
+                await reader.readexactly(16 + 2)
+            case 3:
+                size = await reader.readexactly(1)
+                await reader.readexactly(size[0] + 2)
+        return reader, writer
+    except BaseException:
+        writer.close()
+        raise
+
+
+class AsyncUpstream:
+    """
+    An open SOCKS stream kept in a SocksPool. `close()` is safe to call from any thread.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+
+    def alive(self) -> bool:
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self) -> None:
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class AsyncBridgeHTTP:
+    """
+    HTTP -> SOCKS_TOR bridge served from the shared EventLoopEngine. Drop-in replacement for BridgeHTTP:
+    same address handling, same `start()` entry point, but no thread per client.
+    """
+    def __init__(self, onion: object, proxy_ip_port: str = None):
+        self.cfg = onion.conf
+        self.name = f"AHTTP_{self.cfg['Name']}"
+        self.metrics = BridgeMetrics(self.name)
+        self.stopEvent = onion.stopEvent
+        self.pool = SocksPool(onion.socksPool.maxSize, onion.socksPool.idleTimeout, onion.socksPool.maxPerHost, check=AsyncUpstream.alive)
+        self.traffic = getattr(onion, "traffic", None)
+        self._proxy = proxy_ip_port
+        self.raw_len = self.cfg.get("RawLen", 1024 * 16)
+        self.maxHead = self.cfg.get("MaxHeadLen", 1024 * 64)
+        self.timeout = self.cfg.get("BridgeTimeout", 30)
+        self.pause_conn = 1
+        self.ip = None
+        self.port = None
+        self.socksIP = None
+        self.socksPORT = None
+        self._future = None
+        self.specifyIP()
+        self.specifySocks()
+
+    def specifyIP(self) -> None:
+        if not self._proxy:
+            self.ip = "127.0.0.1"
+            self.port = freePort(30000, 40000)
+        else:
+            if ":" in self._proxy:
+                addr = self._proxy.split(":")
+                self.ip = addr[0]
+                try:
+                    self.port = int(addr[1])
+                except (ValueError, TypeError):
+                    print(f"[{self.name}] [!!] ERROR: BridgeHTTP proxy port error: {addr[1]} ... use random port number [!!]")
+                    self.port = freePort(30000, 40000)
+            else:
+                self.ip = "127.0.0.1"
+                self.port = int(self._proxy)
+
+    def specifySocks(self) -> None:
+        if self.cfg.get("LocalSocks"):
+            self.socksPORT = int(self.cfg.get("LocalSocks"))
+            self.socksIP = "127.0.0.1"
+        elif self.cfg.get("OutSocks"):
+            addr = self.cfg["OutSocks"].split(":")
+            self.socksIP = addr[0]
+            self.socksPORT = int(addr[1])
+
+    async def pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> int:
+        size = 0
+        try:
+            while True:
+                data = await reader.read(self.raw_len)
+                if not data:
+                    break
+                writer.write(data)
+                size += len(data)
+                await writer.drain()
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass
+        finally:
+            if writer.can_write_eof():
+                try:
+                    writer.write_eof()
+                except OSError:
+                    pass
+        return size
+
+    async def relay(self, client: tuple, upstream: tuple) -> tuple:
+        c_reader, c_writer = client
+        u_reader, u_writer = upstream
+        return await asyncio.gather(self.pipe(c_reader, u_writer), self.pipe(u_reader, c_writer))
+
+    def recordTraffic(self, sent: int, received: int, status: int = None) -> None:
+        self.metrics.bytesOut.inc(sent)
+        self.metrics.bytesIn.inc(received)
+        if self.traffic is not None:
+            self.traffic.record(sent, received, status)
+
+    async def readHead(self, reader: asyncio.StreamReader, parser: HttpParser) -> Union[bytes, bool]:
+        data = b""
+        used = 0
+        while not parser.headDone:
+            data = await asyncio.wait_for(reader.read(self.raw_len), self.timeout)
+            if not data:
+                return None
+            used = parser.feed(data, head_only=True)
+        return data[used:]
+
+    async def relayMessage(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, parser: HttpParser, pending: bytes = b"") -> Union[bytes, bool]:
+        data = pending
+        used = 0
+        if pending:
+            used = parser.feed(pending)
+            writer.write(pending[:used])
+        while not parser.done:
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(self.raw_len), self.timeout)
+            if not data:
+                return b"" if parser.feedEOF() else None
+            used = parser.feed(data)
+            writer.write(data[:used] if used < len(data) else data)
+        await writer.drain()
+        return data[used:]
+
+    async def connectSocks(self, host: str, port: int) -> tuple:
+        start = monotonic()
+        try:
+            reader, writer = await socks5Connect(self.socksIP, self.socksPORT, host, port, self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self.metrics.error("connect")
+            raise
+        self.metrics.connectTime.observe(monotonic() - start)
+        return reader, writer
+
+    async def acquireSocks(self, host: str, port: int, fresh: bool = False) -> tuple:
+        upstream = self.pool.get((host, port)) if not fresh else None
+        if upstream:
+            return upstream, True
+        reader, writer = await self.connectSocks(host, port)
+        return AsyncUpstream(reader, writer), False
+
+    async def tunnel(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int, rest: bytes) -> None:
+        self.metrics.connect.inc()
+        try:
+            u_reader, u_writer = await self.connectSocks(host, port)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            writer.write(BAD_GATEWAY)
+            return
+        try:
+            writer.write(CONNECT_OK)
+            u_writer.write(rest)
+            sent, received = await self.relay((reader, writer), (u_reader, u_writer))
+            self.recordTraffic(sent + len(rest), received)
+        finally:
+            u_writer.close()
+
+    async def exchange(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request: HttpParser, host: str, port: int, head: bytes, rest: bytes) -> Union[bytes, bool]:
+        # a bodyless request on a pooled connection can be replayed once if the pooled stream went stale,
+        # on a new stream: the next pooled one may be just as stale
+        replay = request.done
+        fresh = False
+        self.metrics.http.inc()
+        while True:
+            start = monotonic()
+            try:
+                upstream, reused = await self.acquireSocks(host, port, fresh)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                writer.write(BAD_GATEWAY)
+                return None
+            response = HttpParser(method=request.method)
+            pending = leftover = None
+            sent = None
+            try:
+                upstream.writer.write(head)
+                pending = await self.relayMessage(reader, upstream.writer, request, rest)
+                if pending is not None:
+                    sent = monotonic()
+                    leftover = await self.relayMessage(upstream.reader, writer, response)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+            stale = leftover is None and reused and replay and not response.started
+            if not stale:
+                self.recordTraffic(request.size, response.size, response.status)
+                if sent and response.firstAt:
+                    self.metrics.firstByte.observe(response.firstAt - sent)
+                if leftover is not None:
+                    self.metrics.total.observe(monotonic() - start)
+                else:
+                    self.metrics.error("upstream")
+            if leftover is None:
+                upstream.writer.close()
+                if stale:
+                    fresh = True
+                    continue
+                if not response.started and not writer.is_closing():
+                    # nothing of the response went out yet: a 502 instead of a bare close
+                    writer.write(BAD_GATEWAY)
+                return None
+            if response.keepAlive and not leftover:
+                self.pool.put((host, port), upstream)
+            else:
+                upstream.writer.close()
+            return pending if not response.closeDelimited else None
+
+    async def handleReq(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        rest = b""
+        self.metrics.active.inc()
+        try:
+            while True:
+                request = HttpParser(response=False)
+                if rest:
+                    used = request.feed(rest, head_only=True)
+                    rest = rest[used:] if request.headDone else await self.readHead(reader, request)
+                else:
+                    rest = await self.readHead(reader, request)
+                if rest is None:
+                    return
+                target = parseRequest(request.head)
+                if not target:
+                    print(f"[{self.name}] Unknown protocol")
+                    self.metrics.error("protocol")
+                    return
+                method, host, port, head = target
+                if method == b"CONNECT":
+                    await self.tunnel(reader, writer, host, port, rest)
+                    return
+                if b"100-continue" in request.header(b"expect", b"").lower():
+                    writer.write(CONTINUE)
+                rest = await self.exchange(reader, writer, request, host, port, head, rest)
+                if rest is None or not request.keepAlive:
+                    return
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            # exchange() and tunnel() answer 502 themselves while no response byte went out; past that point
+            # a status line would be spliced into the response, so the connection is only closed
+            if not isinstance(e, asyncio.TimeoutError):
+                print(f"[{self.name}] [!!] ERROR: relay: {e} [!!]")
+                self.metrics.error("relay")
+        except ValueError as e:
+            print(f"[{self.name}] [!!] ERROR: relay: {e} [!!]")
+            self.metrics.error("protocol")
+        finally:
+            self.metrics.active.dec()
+            writer.close()
+
+    async def _serve(self) -> None:
+        try:
+            server = await asyncio.start_server(self.handleReq, self.ip, self.port, limit=self.maxHead, reuse_address=True)
+        except OSError as e:
+            print(f"[{self.name}] [!!] ERROR: Build Proxy Socket: {e} [!!]")
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        print(f"[{self.name}] Start Listening: {self.ip}:{self.port}")
+        while not self.stopEvent.is_set():
+            await asyncio.sleep(self.pause_conn)
+        server.close()
+        self.pool.clear()
+        await server.wait_closed()
+        print(f"[{self.name}] Stop Working")
+
+    def is_alive(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def start(self) -> None:
+        if not self.ip or not self.socksIP:
+            return
+        self._future = EventLoopEngine.submit(self._serve())
@@ -5,18 +5,24 @@ import threading
 from threading import Thread
 from time import sleep
 from typing import Union
-from random import randint
 
+from .port_allocator import freePort
+from .relay import RelayHandler
+from ..metrics import BridgeMetrics
 
-class BridgeHTTP(Thread):
+
+class BridgeHTTP(Thread, RelayHandler):
     def __init__(self, onion: object, proxy_ip_port: str = None):
         super().__init__()
         self.cfg = onion.conf
         self.name = f"HTTP_{self.cfg['Name']}"
+        self.metrics = BridgeMetrics(self.name)
         self.stopEvent = onion.stopEvent
+        self.pool = onion.socksPool
+        self.traffic = getattr(onion, "traffic", None)
         self._proxy = proxy_ip_port
-        self.raw_len = self.cfg.get("RawLen", 1024)
-        self.format = self.cfg.get("FormatCode", "utf-8")
+        self.raw_len = self.cfg.get("RawLen", 1024 * 16)
+        self.idleTimeout = self.cfg.get("BridgeTimeout", 60)
         self.pause_conn = 1
         self.ip = None
         self.port = None
@@ -28,7 +34,7 @@ class BridgeHTTP(Thread):
     def specifyIP(self) -> None:
         if not self._proxy:
             self.ip = "127.0.0.1"
-            self.port = randint(30000, 40000)
+            self.port = freePort(30000, 40000)
         else:
             if ":" in self._proxy:
                 addr = self._proxy.split(":")
@@ -37,7 +43,7 @@ class BridgeHTTP(Thread):
                     self.port = int(addr[1])
                 except (ValueError, TypeError):
                     print(f"[{self.name}] [!!] ERROR: BridgeHTTP proxy port error: {addr[1]} ... use random port number [!!]")
-                    self.port = randint(30000, 40000)
+                    self.port = freePort(30000, 40000)
             else:
                 self.ip = "127.0.0.1"
                 self.port = int(self._proxy)
@@ -45,7 +51,7 @@ class BridgeHTTP(Thread):
     def specifySocks(self) -> None:
         if self.cfg.get("LocalSocks"):
             self.socksPORT = self.cfg.get("LocalSocks")
-            self.socksIP = self.ip
+            self.socksIP = "127.0.0.1"
         elif self.cfg.get("OutSocks"):
             addr = self.cfg["OutSocks"].split(":")
             self.socksIP = addr[0]
@@ -86,53 +92,7 @@ class BridgeHTTP(Thread):
         ac.start()
         return True
     
-    def reciveMsg(self, conn_object: object, decode: bool = False) -> Union[bytes, str, bool]:
-        msg = b""
-        while True:
-            try:
-                recv = conn_object.recv(self.raw_len)
-            except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError, OSError) as e:
-                print(f"[{self.name}] [!!] ERROR: recive response: {e} [!!]")
-                return None
-            if recv:
-                if len(recv) < self.raw_len:
-                    msg += recv
-                    break
-                else:
-                    msg += recv
-            else:
-                return None
-        if decode:
-            msg = msg.decode(self.format)
-        return msg
-    
-    def readAddr(self, headers: str) -> Union[str, bool]:
-        if headers.startswith("http://"):
-            headers = headers[7:]
-        else:
-            return None
-        return headers.rstrip("/")
-        
-    def handleReq(self, conn: object) -> None:
-        resp = self.reciveMsg(conn, True)
-        if not resp:
-            conn.close()
-            return
-        headers = resp.split("\r\n")
-        print(headers)
-        head = headers[0].split(" ")
-        method = head[0]
-        if len(headers) > 1:
-            addr = self.readAddr(head[1])
-            if addr:
-                socks_resp = self.sendSocksReq(addr, resp)
-                if socks_resp:
-                    conn.send(socks_resp.encode(self.format))
-            else:
-                print(f"[{self.name}] Unknown protocol")
-        conn.close()
-    
-    def sendSocksReq(self, addr: str, msg: str) -> Union[str, bool]:
+    def connectSocks(self, host: str, port: int) -> Union[object, bool]:
         try:
             mySocks = socks.socksocket()
             mySocks.set_proxy(socks.PROXY_TYPE_SOCKS5, self.socksIP, int(self.socksPORT))
@@ -140,20 +100,13 @@ class BridgeHTTP(Thread):
             print(f"[{self.name}] [!!] ERROR: making Socks Proxy: {e} [!!]")
             return None
         try:
-            mySocks.connect((addr, 80))
+            mySocks.connect((host, port))
         except Exception as e:
-            print(f"[{self.name}] [!!] ERROR: Can not connect: {addr}. error: {e} [!!]")
+            print(f"[{self.name}] [!!] ERROR: Can not connect: {host}:{port}. error: {e} [!!]")
+            mySocks.close()
             return None
-        try:
-            mySocks.sendall(msg.encode(self.format))
-        except Exception as e:
-            print(f"[{self.name}] [!!] ERROR: send msg: {e} [!!]")
-            return None
-        resp = self.reciveMsg(mySocks, True)
-        mySocks.close()
-        print("SOCKS RESP: ", resp)
-        return resp
-    
+        return mySocks
+
     def constructor(self) -> bool:
         if not self.ip or not self.socksIP:
             return False
@@ -0,0 +1,70 @@
+import bisect
+import hashlib
+import threading
+
+from typing import Union
+
+
+class HashRing:
+    """
+    Consistent-hash ring with virtual nodes. Every backend owns `vnodes` points on the ring and a key maps
+    to the first point clockwise from its hash, so adding or removing one of N backends moves only about
+    1/N of the keys. `lookup()` skips backends the caller can not use right now without remapping the
+    keys of the others.
+    """
+    def __init__(self, backends: list = (), vnodes: int = 160):
+        self.vnodes = vnodes
+        self._lock = threading.Lock()
+        self._points = []
+        self._owners = []
+        self._backends = set()
+        for backend in backends:
+            self.add(backend)
+
+    @staticmethod
+    def hash(key: Union[str, bytes]) -> int:
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+    def label(self, backend: tuple) -> str:
+        return ":".join(str(part) for part in backend) if isinstance(backend, tuple) else str(backend)
+
+    def add(self, backend: tuple) -> None:
+        with self._lock:
+            if backend in self._backends:
+                return
+            self._backends.add(backend)
+            label = self.label(backend)
+            for i in range(self.vnodes):
+                point = self.hash(f"{label}#{i}")
+                idx = bisect.bisect(self._points, point)
+                self._points.insert(idx, point)
+                self._owners.insert(idx, backend)
+
+    def remove(self, backend: tuple) -> None:
+        with self._lock:
+            if backend not in self._backends:
+                return
+            self._backends.discard(backend)
+            keep = [(p, o) for p, o in zip(self._points, self._owners) if o != backend]
+            self._points = [p for p, _ in keep]
+            self._owners = [o for _, o in keep]
+
+    def lookup(self, key: Union[str, bytes], allowed: list = None) -> Union[tuple, bool]:
+        with self._lock:
+            if not self._points:
+                return None
+            allowed = self._backends if allowed is None else set(allowed) & self._backends
+            if not allowed:
+                return None
+            start = bisect.bisect(self._points, self.hash(key))
+            size = len(self._points)
+            for step in range(size):
+                owner = self._owners[(start + step) % size]
+                if owner in allowed:
+                    return owner
+            return None
+
+    def __len__(self) -> int:
+        return len(self._backends)
@@ -0,0 +1,93 @@
+import threading
+
+from time import monotonic
+from typing import Union
+
+
+class BackendHealth:
+    """
+    Passive health tracking for carousel backends. `max_failures` consecutive failures (connect errors,
+    timeouts, broken responses) eject a backend for a backoff that doubles with every ejection, from
+    `base_backoff` up to `max_backoff` seconds. Once the backoff is over the backend is `due()` and the
+    owner decides whether to `readmit()` it.
+    """
+    def __init__(self, max_failures: int = 3, base_backoff: float = 5, max_backoff: float = 300):
+        self.maxFailures = max_failures
+        self.baseBackoff = base_backoff
+        self.maxBackoff = max_backoff
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def add(self, backend: tuple) -> None:
+        with self._lock:
+            self._state.setdefault(backend, {"failures": 0, "ejections": 0, "ejected": False, "until": 0.0, "reason": None})
+
+    def remove(self, backend: tuple) -> None:
+        with self._lock:
+            self._state.pop(backend, None)
+
+    def record(self, backend: tuple, ok: bool, reason: str = "request failed") -> None:
+        with self._lock:
+            state = self._state.get(backend)
+            if not state:
+                return
+            if ok:
+                state["failures"] = 0
+                if not state["ejected"]:
+                    state["ejections"] = 0
+                return
+            state["failures"] += 1
+            if not state["ejected"] and state["failures"] >= self.maxFailures:
+                self._eject(backend, state, reason)
+
+    def eject(self, backend: tuple, reason: str) -> None:
+        with self._lock:
+            state = self._state.get(backend)
+            if state and not state["ejected"]:
+                self._eject(backend, state, reason)
+
+    def _eject(self, backend: tuple, state: dict, reason: str) -> None:
+        backoff = min(self.maxBackoff, self.baseBackoff * (2 ** state["ejections"]))
+        state["ejections"] += 1
+        state["ejected"] = True
+        state["until"] = monotonic() + backoff
+        state["reason"] = reason
+        print(f"[!!] Backend {backend[0]}:{backend[1]} ejected for {backoff:.0f}s: {reason} [!!]")
+
+    def readmit(self, backend: tuple) -> None:
+        with self._lock:
+            state = self._state.get(backend)
+            if state and state["ejected"]:
+                state["ejected"] = False
+                state["failures"] = 0
+                state["reason"] = None
+                print(f"Backend {backend[0]}:{backend[1]} readmitted")
+
+    def postpone(self, backend: tuple) -> None:
+        # the backend was due but is still not usable: wait another backoff period
+        with self._lock:
+            state = self._state.get(backend)
+            if state and state["ejected"]:
+                state["until"] = monotonic() + min(self.maxBackoff, self.baseBackoff * (2 ** (state["ejections"] - 1)))
+
+    def isEjected(self, backend: tuple) -> bool:
+        state = self._state.get(backend)
+        return bool(state and state["ejected"])
+
+    def available(self, backends: list) -> list:
+        return [b for b in backends if not self.isEjected(b)]
+
+    def due(self) -> list:
+        now = monotonic()
+        with self._lock:
+            return [b for b, s in self._state.items() if s["ejected"] and s["until"] <= now]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {b: dict(s) for b, s in self._state.items()}
+
+    def status(self, backend: tuple) -> Union[str, bool]:
+        state = self._state.get(backend)
+        if not state:
+            return None
+        return "ejected" if state["ejected"] else "healthy"
@@ -0,0 +1,207 @@
+from time import monotonic
+from typing import Union
+
+
+class HttpParser:
+    """
+    Incremental HTTP/1.1 message framing. Bytes are fed in whatever pieces the network delivers and the
+    parser tracks where the message ends: Content-Length, chunked transfer encoding or connection close.
+    `feed()` returns how many bytes belong to the current message, so any remainder is the start of the
+    next (pipelined) message. With `keep=True` the body is collected into a bytearray.
+    """
+    HEAD = 0
+    BODY = 1
+    CHUNK_SIZE = 2
+    CHUNK_DATA = 3
+    CHUNK_END = 4
+    TRAILER = 5
+    UNTIL_CLOSE = 6
+    DONE = 7
+
+    def __init__(self, response: bool = True, method: bytes = None, keep: bool = False, max_head: int = 65536):
+        self.response = response
+        self.method = method
+        self.keep = keep
+        self.maxHead = max_head
+        self.state = self.HEAD
+        self.head = None
+        self.startLine = None
+        self.version = None
+        self.status = None
+        self.headers = {}
+        self.body = bytearray() if keep else None
+        self.remaining = 0
+        self.closeDelimited = False
+        self.size = 0
+        self.firstAt = None
+        self._head = bytearray()
+        self._line = bytearray()
+
+    @property
+    def done(self) -> bool:
+        return self.state == self.DONE
+
+    @property
+    def headDone(self) -> bool:
+        return self.head is not None
+
+    @property
+    def started(self) -> bool:
+        return self.head is not None or bool(self._head)
+
+    @property
+    def keepAlive(self) -> bool:
+        if self.closeDelimited or self.head is None:
+            return False
+        conn = self.headers.get(b"connection", b"").lower()
+        if self.version == b"HTTP/1.0":
+            return b"keep-alive" in conn
+        return b"close" not in conn
+
+    def header(self, name: bytes, default: bytes = None) -> Union[bytes, bool]:
+        return self.headers.get(name.lower(), default)
+
+    def parseHead(self) -> None:
+        lines = bytes(self._head[:-4]).split(b"\r\n")
+        self.head = bytes(self._head)
+        self._head = bytearray()
+        self.startLine = lines[0]
+        parts = lines[0].split(b" ", 2)
+        if len(parts) < 2:
+            raise ValueError(f"malformed start line: {lines[0]!r}")
+        headers = {}
+        for line in lines[1:]:
+            key, sep, value = line.partition(b":")
+            if not sep:
+                raise ValueError(f"malformed header: {line!r}")
+            key = key.strip().lower()
+            value = value.strip()
+            headers[key] = headers[key] + b", " + value if key in headers else value
+        self.headers = headers
+        if self.response:
+            self.version = parts[0]
+            self.status = int(parts[1])
+        else:
+            self.method = parts[0]
+            self.version = parts[2] if len(parts) == 3 else b"HTTP/1.0"
+        self.state = self.bodyState()
+
+    def bodyState(self) -> int:
+        if self.response:
+            if 100 <= self.status < 200:
+                if self.status == 101:
+                    self.closeDelimited = True
+                    return self.UNTIL_CLOSE
+                # interim response, the final one follows on the same message
+                self.head = None
+                return self.HEAD
+            if self.status in (204, 304) or self.method in (b"HEAD", b"CONNECT"):
+                return self.DONE
+        elif self.method == b"CONNECT":
+            return self.DONE
+        if b"chunked" in self.headers.get(b"transfer-encoding", b"").lower():
+            return self.CHUNK_SIZE
+        length = self.headers.get(b"content-length")
+        if length is not None:
+            # repeated headers are joined with ", ": they must all agree
+            values = {value.strip() for value in length.split(b",")}
+            if len(values) != 1 or not all(value.isdigit() for value in values):
+                raise ValueError("invalid Content-Length")
+            self.remaining = int(values.pop())
+            return self.BODY if self.remaining else self.DONE
+        if not self.response:
+            return self.DONE
+        self.closeDelimited = True
+        return self.UNTIL_CLOSE
+
+    def readLine(self, view: memoryview, pos: int) -> int:
+        # appends up to and including the line ending, or the rest of the data; returns the position reached.
+        # The line is complete once self._line ends with a newline.
+        piece = view[pos:pos + self.maxHead + 1 - len(self._line)].tobytes()
+        end = piece.find(b"\n")
+        if end >= 0:
+            piece = piece[:end + 1]
+        self._line += piece
+        if end < 0 and len(self._line) > self.maxHead:
+            raise ValueError("chunk line too long")
+        return pos + len(piece)
+
+    def takeBody(self, view: memoryview, pos: int, size: int) -> int:
+        if self.keep:
+            self.body += view[pos:pos + size]
+        return pos + size
+
+    def feed(self, data: Union[bytes, bytearray, memoryview], head_only: bool = False) -> int:
+        view = memoryview(data)
+        size = len(view)
+        pos = 0
+        if self.firstAt is None and size:
+            self.firstAt = monotonic()
+        while pos < size and self.state != self.DONE:
+            if head_only and self.head is not None:
+                break
+            match self.state:
+                case self.HEAD:
+                    start = max(0, len(self._head) - 3)
+                    piece = view[pos:pos + self.maxHead + 4 - len(self._head)]
+                    self._head += piece
+                    end = self._head.find(b"\r\n\r\n", start)
+                    if end < 0:
+                        if len(self._head) > self.maxHead:
+                            raise ValueError("HTTP head too long")
+                        pos += len(piece)
+                        continue
+                    pos += len(piece) - (len(self._head) - end - 4)
+                    del self._head[end + 4:]
+                    self.parseHead()
+                case self.BODY | self.CHUNK_DATA:
+                    take = min(self.remaining, size - pos)
+                    pos = self.takeBody(view, pos, take)
+                    self.remaining -= take
+                    if not self.remaining:
+                        self.state = self.DONE if self.state == self.BODY else self.CHUNK_END
+                case self.UNTIL_CLOSE:
+                    pos = self.takeBody(view, pos, size - pos)
+                case self.CHUNK_SIZE | self.CHUNK_END | self.TRAILER:
+                    pos = self.readLine(view, pos)
+                    if not self._line.endswith(b"\n"):
+                        continue
+                    line = bytes(self._line).strip()
+                    self._line = bytearray()
+                    if self.state == self.CHUNK_SIZE:
+                        self.remaining = int(line.split(b";")[0], 16)
+                        self.state = self.CHUNK_DATA if self.remaining else self.TRAILER
+                    elif self.state == self.CHUNK_END:
+                        if line:
+                            raise ValueError("missing CRLF after chunk data")
+                        self.state = self.CHUNK_SIZE
+                    elif not line:
+                        self.state = self.DONE
+        self.size += pos
+        return pos
+
+    def feedEOF(self) -> bool:
+        """
+        Signals that the peer closed the connection. Returns True when that legitimately ends the message.
+        """
+        if self.state == self.UNTIL_CLOSE:
+            self.state = self.DONE
+        return self.state == self.DONE
+
+
+def readMessage(conn: object, parser: HttpParser, raw_len: int = 4096) -> bool:
+    """
+    Reads one complete message from a blocking socket into `parser`. Returns True when the message is
+    complete, False if the connection closed early or the framing is broken.
+    """
+    buff = bytearray(raw_len)
+    view = memoryview(buff)
+    while not parser.done:
+        size = conn.recv_into(buff)
+        if not size:
+            return parser.feedEOF()
+        try:
+            parser.feed(view[:size])
+        except ValueError:
+            return False
+    return True
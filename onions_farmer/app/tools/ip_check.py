@@ -2,6 +2,8 @@ import socket
 import socks
 from typing import Union
 
+from .http_parser import HttpParser, readMessage
+
 class IP_Checker:
     def __init__(self, socks_addr: str, conf: dict = {}):
         self.socks_addr = socks_addr
@@ -15,74 +17,62 @@ class IP_Checker:
         self.socksIP = addr[0]
         self.socksPORT = int(addr[1])
 
-    def buildSocket(self) -> bool:
+    def buildSocket(self) -> Union[object, bool]:
+        # one socket per request: a SOCKS socket can not be connected again once closed
         try:
-            self.SOCKS = socks.socksocket()
-            self.SOCKS.set_proxy(socks.PROXY_TYPE_SOCKS5, self.socksIP, self.socksPORT)
-            return True
+            sock = socks.socksocket()
+            sock.set_proxy(socks.PROXY_TYPE_SOCKS5, self.socksIP, self.socksPORT)
+            return sock
         except Exception as e:
             print(f"[!!] ERROR Build SOCKS5 Proxy Socket: {e} [!!]")
             return None
     
     def sendRequest(self, target: str) -> Union[str, bool]:
+        sock = self.buildSocket()
+        if not sock:
+            return None
+        try:
+            return self._sendRequest(sock, target)
+        finally:
+            sock.close()
+
+    def _sendRequest(self, sock: object, target: str) -> Union[str, bool]:
+        sock.settimeout(self.sockTimeout)
         try:
-            self.SOCKS.connect((target, 80))
+            sock.connect((target, 80))
         except OSError as e:
             print(f"[!!] ERROR: Cant connect: {target}. Error: {e} [!!]")
             return None
         try:
             req = f"GET / HTTP/1.1\r\nHost: {target}\r\nConnection: close\r\n\r\n".encode(self.format)
-            self.SOCKS.sendall(req)
+            sock.sendall(req)
         except Exception as e:
             print(f"[!!] ERROR Send IP request: {e} [!!]")
             return None
-        self.SOCKS.settimeout(self.sockTimeout)
-        
-        resp = b""
-        while True:
-            try:
-                recv = self.SOCKS.recv(self.raw_len)
-            except (TimeoutError, BrokenPipeError, ConnectionRefusedError, ConnectionAbortedError):
-                print("[!!] ERROR: Timeout Response [!!]")
-                return None
-            if recv:
-                if len(recv) < self.raw_len:
-                    resp += recv
-                    break
-                else:
-                    resp += recv
-            else:
-                return None
-        resp = resp.decode(self.format)
-        return resp
+        resp = HttpParser(method=b"GET", keep=True)
+        try:
+            complete = readMessage(sock, resp, self.raw_len)
+        except OSError:
+            print("[!!] ERROR: Timeout Response [!!]")
+            return None
+        if not complete or resp.status != 200:
+            return None
+        return resp.body.decode(self.format)
     
     def _checkIpAmazonaws(self) -> Union[str, bool]:
         _ip = self.sendRequest("checkip.amazonaws.com")
         if not _ip:
             return None
-        tmp = _ip.split("\r\n")
-        ip = tmp[-1].strip("\n")
-        self.SOCKS.close()
-        return ip
+        return _ip.strip()
     
     def _checkIpIpify(self) -> Union[str, bool]:
         _ip = self.sendRequest("api.ipify.org")
         if not _ip:
             return None
-        tmp = _ip.split("\r\n")
-        ip = tmp[-1].strip("\n")
-        self.SOCKS.close()
-        return ip
+        return _ip.strip()
 
-    def getIP(self):
-        if not self.buildSocket():
-            return None
+    def getIP(self) -> Union[str, bool]:
         ip = self._checkIpIpify()
         if ip:
             return ip
-        else:
-            ip = self._checkIpAmazonaws()
-            if ip:
-                return ip
-        self.SOCKS.close()
-        return None
\ No newline at end of file
+        return self._checkIpAmazonaws()
@@ -0,0 +1,270 @@
+import os
+import re
+import select
+import ctypes
+import ctypes.util
+import struct
+import threading
+
+from threading import Thread
+from time import sleep, monotonic
+from typing import Union
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVE_SELF = 0x00000800
+IN_DELETE_SELF = 0x00000400
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEAD = struct.Struct("iIII")
+
+# Oct 18 12:00:00.000 [notice] Bootstrapped 45% (requesting_descriptors): Asking for relay descriptors
+LOG_LINE = re.compile(r"^(\w{3} +\d+ [\d:.]+) \[(\w+)\] (.*)$")
+BOOTSTRAP = re.compile(r"Bootstrapped (\d+)%")
+
+
+def parseLine(name: str, line: str) -> dict:
+    # lines not written by Tor (e.g. the "Make Log Files" header) have no level
+    event = {"Onion": name, "Time": None, "Level": None, "Message": line, "Bootstrap": None, "Line": line}
+    match = LOG_LINE.match(line)
+    if match:
+        event["Time"], event["Level"], event["Message"] = match.groups()
+        progress = BOOTSTRAP.search(event["Message"])
+        if progress:
+            event["Bootstrap"] = int(progress.group(1))
+    event["Warning"] = event["Level"] in ("warn", "err")
+    return event
+
+
+def loadInotify() -> Union[object, bool]:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class LogTailer:
+    """
+    One thread tailing the log files of every Onion. Changes are read through inotify when the C library
+    provides it: only files named by an event are read, and every `recheck` seconds the paths are stat'ed to
+    follow a log replaced by a new file. Otherwise every file is polled each `interval` seconds. New lines are parsed into events
+    (time, level, message, bootstrap percent, warning flag) and handed to the subscribers of that file and to
+    the subscribers of all files. The thread ends by itself once no file is watched any more.
+    """
+    _lock = threading.Lock()
+    _shared = None
+
+    @classmethod
+    def shared(cls) -> object:
+        with cls._lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __init__(self, interval: float = 0.5, use_inotify: bool = True, recheck: float = 5):
+        self.interval = interval
+        self.recheck = recheck
+        self._lock = threading.RLock()
+        self._files = {}
+        self._byWatch = {}
+        self._subscribers = []
+        self._thread = None
+        self._libc = loadInotify() if use_inotify else None
+        self._fd = None
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._fd is not None else "polling"
+
+    def _openInotify(self) -> None:
+        if self._libc is None or self._fd is not None:
+            return
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            print(f"[!!] ERROR: inotify unavailable ({os.strerror(ctypes.get_errno())}), polling log files [!!]")
+            self._libc = None
+            return
+        self._fd = fd
+
+    def _addWatch(self, watch: dict) -> None:
+        if self._fd is None:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, watch["path"].encode(), IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF)
+        if wd >= 0:
+            watch["wd"] = wd
+            self._byWatch[wd] = watch["path"]
+
+    def _removeWatch(self, watch: dict) -> None:
+        if watch.get("wd") is not None and self._fd is not None:
+            self._libc.inotify_rm_watch(self._fd, watch["wd"])
+            self._byWatch.pop(watch["wd"], None)
+        watch["wd"] = None
+
+    def _open(self, watch: dict, from_start: bool) -> bool:
+        try:
+            f = open(watch["path"], "rb")
+        except OSError:
+            return False
+        stat = os.fstat(f.fileno())
+        watch.update({"file": f, "ino": stat.st_ino, "pos": 0 if from_start else stat.st_size, "rest": b""})
+        self._addWatch(watch)
+        return True
+
+    def _close(self, watch: dict) -> None:
+        self._removeWatch(watch)
+        if watch.get("file"):
+            watch["file"].close()
+        watch["file"] = None
+
+    def watch(self, path: str, name: str = None, from_start: bool = True) -> bool:
+        """
+        Starts tailing `path`. Watching an already watched file does nothing.
+
+        :param path: The log file.
+        :param name: Name put in the events, usually the Onion name.
+        :param from_start: Read the lines already in the file, otherwise only the ones written from now on.
+        :return: True if the file is watched, False if it can not be opened.
+        """
+        with self._lock:
+            if path in self._files:
+                return True
+            self._openInotify()
+            watch = {"path": path, "name": name or path, "file": None, "wd": None, "subscribers": []}
+            if not self._open(watch, from_start):
+                print(f"[!!] ERROR Reading Log File: {path} [!!]")
+                return False
+            self._files[path] = watch
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="LogTailer", daemon=True)
+                self._thread.start()
+        return True
+
+    def unwatch(self, path: str) -> None:
+        """
+        Stops tailing `path` after reading what is left in it, and drops its subscribers.
+        """
+        with self._lock:
+            watch = self._files.pop(path, None)
+            if watch:
+                self._read(watch)
+                self._close(watch)
+
+    def subscribe(self, callback: object, path: str = None) -> None:
+        """
+        Calls `callback(event)` for every new line of `path`, or of every watched file if `path` is None. Callbacks
+        run on the tailer thread and must not block.
+        """
+        with self._lock:
+            if path is None:
+                self._subscribers.append(callback)
+            elif path in self._files:
+                self._files[path]["subscribers"].append(callback)
+
+    def unsubscribe(self, callback: object, path: str = None) -> None:
+        with self._lock:
+            subscribers = self._subscribers if path is None else self._files.get(path, {}).get("subscribers", [])
+            if callback in subscribers:
+                subscribers.remove(callback)
+
+    @property
+    def watched(self) -> list:
+        with self._lock:
+            return list(self._files)
+
+    def _read(self, watch: dict) -> None:
+        f = watch["file"]
+        if f is None:
+            return
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size < watch["pos"]:
+                # truncated (makeLogFile on restart): start over
+                watch["pos"] = 0
+                watch["rest"] = b""
+            if size == watch["pos"]:
+                return
+            f.seek(watch["pos"])
+            data = f.read(size - watch["pos"])
+        except OSError as e:
+            print(f"[!!] ERROR Reading Log File: {watch['path']}: {e} [!!]")
+            return
+        watch["pos"] += len(data)
+        lines = (watch["rest"] + data).split(b"\n")
+        watch["rest"] = lines.pop()
+        for line in lines:
+            self._publish(watch, parseLine(watch["name"], line.decode("utf-8", "replace").rstrip("\r")))
+
+    def _publish(self, watch: dict, event: dict) -> None:
+        for callback in watch["subscribers"] + self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"[!!] ERROR: log subscriber: {e} [!!]")
+
+    def _reopenIfReplaced(self, watch: dict) -> None:
+        # a log moved away or deleted (rotation): follow the new file at the same path
+        try:
+            ino = os.stat(watch["path"]).st_ino
+        except OSError:
+            return
+        if ino != watch["ino"]:
+            self._read(watch)
+            self._close(watch)
+            self._open(watch, True)
+
+    def _inotifyEvents(self) -> set:
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        pos = 0
+        while pos + EVENT_HEAD.size <= len(data):
+            wd, mask, _, length = EVENT_HEAD.unpack_from(data, pos)
+            pos += EVENT_HEAD.size + length
+            path = self._byWatch.get(wd)
+            if path:
+                changed.add(path)
+        return changed
+
+    def _timeout(self, next_check: float) -> float:
+        # files inotify could not watch are still polled every `interval`
+        if any(w["wd"] is None for w in self._files.values()):
+            return self.interval
+        return max(0, next_check - monotonic())
+
+    def _run(self) -> None:
+        next_check = monotonic() + self.recheck
+        while True:
+            with self._lock:
+                if not self._files:
+                    self._thread = None
+                    return
+                fd = self._fd
+                timeout = self._timeout(next_check) if fd is not None else self.interval
+            if fd is None:
+                sleep(timeout)
+                with self._lock:
+                    for watch in list(self._files.values()):
+                        self._reopenIfReplaced(watch)
+                        self._read(watch)
+                continue
+            ready, _, _ = select.select([fd], [], [], timeout)
+            with self._lock:
+                changed = self._inotifyEvents() if ready else set()
+                changed.update(path for path, w in self._files.items() if w["wd"] is None)
+                if monotonic() >= next_check:
+                    next_check = monotonic() + self.recheck
+                    for watch in list(self._files.values()):
+                        if watch["path"] not in changed:
+                            self._reopenIfReplaced(watch)
+                for path in changed:
+                    watch = self._files.get(path)
+                    if watch:
+                        self._reopenIfReplaced(watch)
+                        self._read(watch)
@@ -0,0 +1,182 @@
+import os
+import json
+import socket
+import threading
+
+from random import randint
+from typing import Union
+
+
+RANGES = {
+    "socks": (8000, 29999),
+    "bridge": (30000, 40000),
+    "control": (40001, 49999),
+    "carousel": (50000, 60000),
+}
+
+
+def portFree(port: int, host: str = "127.0.0.1") -> bool:
+    # a listener (Tor, a bridge) will set SO_REUSEADDR too, so TIME_WAIT leftovers do not count as taken
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def freePort(low: int, high: int, host: str = "127.0.0.1", tries: int = 64) -> int:
+    # random free port for components created without a PortAllocator
+    for _ in range(tries):
+        port = randint(low, high)
+        if portFree(port, host):
+            return port
+    for port in range(low, high + 1):
+        if portFree(port, host):
+            return port
+    return None
+
+
+class PortAllocator:
+    """
+    Hands out local ports for Tor SOCKS listeners, HTTP bridges, control ports and carousels. Every port is
+    probed with bind() before it is given out, ports already handed out are never given out twice, and the
+    assignments are saved to `state_file` so an Onion keeps its ports across restarts as long as they are free.
+    """
+    def __init__(self, state_file: str = None, ranges: dict = None):
+        self.stateFile = state_file
+        self.ranges = dict(RANGES)
+        self.ranges.update(ranges or {})
+        self._lock = threading.RLock()
+        self._owners = {}
+        self._assigned = {}
+        self._remembered = {}
+        self.load()
+
+    def load(self) -> None:
+        if not self.stateFile or not os.path.exists(self.stateFile):
+            return
+        try:
+            with open(self.stateFile, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[!!] ERROR: Load port assignments {self.stateFile}: {e} [!!]")
+            return
+        # remembered assignments are only preferences: nothing is reserved until allocate() confirms it
+        self._remembered = {owner: {kind: int(port) for kind, port in ports.items()} for owner, ports in data.items()}
+
+    def save(self) -> None:
+        if not self.stateFile:
+            return
+        with self._lock:
+            data = dict(self._remembered)
+            data.update({owner: dict(ports) for owner, ports in self._assigned.items()})
+        tmp = f"{self.stateFile}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.stateFile)
+        except OSError as e:
+            print(f"[!!] ERROR: Save port assignments {self.stateFile}: {e} [!!]")
+
+    def owner(self, port: int) -> Union[tuple, bool]:
+        with self._lock:
+            return self._owners.get(port)
+
+    def assigned(self, owner: str) -> dict:
+        with self._lock:
+            return dict(self._assigned.get(owner, {}))
+
+    def _usable(self, port: int, owner: str, kind: str, host: str) -> bool:
+        taken = self._owners.get(port)
+        if taken and taken != (owner, kind):
+            return False
+        return portFree(port, host)
+
+    def _take(self, owner: str, kind: str, port: int) -> int:
+        old = self._assigned.setdefault(owner, {}).get(kind)
+        if old is not None and old != port:
+            self._owners.pop(old, None)
+        self._assigned[owner][kind] = port
+        self._owners[port] = (owner, kind)
+        return port
+
+    def _find(self, owner: str, kind: str, preferred: int, host: str) -> Union[int, bool]:
+        current = self._assigned.get(owner, {}).get(kind)
+        if current is not None:
+            return current
+        remembered = self._remembered.get(owner, {}).get(kind)
+        for port in (remembered, preferred):
+            if port and self._usable(port, owner, kind, host):
+                return port
+        low, high = self.ranges.get(kind, RANGES["bridge"])
+        start = preferred if preferred and low <= preferred <= high else low
+        for port in list(range(start, high + 1)) + list(range(low, start)):
+            if self._usable(port, owner, kind, host):
+                return port
+        return None
+
+    def allocate(self, kind: str, owner: str, preferred: int = None, host: str = "127.0.0.1", save: bool = True) -> Union[int, bool]:
+        """
+        Returns a free port of `kind` for `owner`: the port it already holds, the one it had before a restart,
+        `preferred`, or the next free port of the kind's range, in that order.
+        """
+        with self._lock:
+            port = self._find(owner, kind, preferred, host)
+            if port is None:
+                print(f"[!!] ERROR: No free {kind} port left in {self.ranges.get(kind)} [!!]")
+                return None
+            self._take(owner, kind, port)
+        if save:
+            self.save()
+        return port
+
+    def allocateMany(self, owner: str, kinds: list, preferred: dict = None, host: str = "127.0.0.1", save: bool = True) -> Union[dict, bool]:
+        """
+        Allocates one port of every kind in `kinds` for `owner`, all or nothing. Pass save=False when allocating
+        for many owners in a row and call save() once at the end.
+        """
+        preferred = preferred or {}
+        with self._lock:
+            before = dict(self._assigned.get(owner, {}))
+            ports = {}
+            for kind in kinds:
+                port = self._find(owner, kind, preferred.get(kind), host)
+                if port is None:
+                    # roll back what this call took
+                    for taken_kind, taken in ports.items():
+                        if before.get(taken_kind) != taken:
+                            self._owners.pop(taken, None)
+                    self._assigned[owner] = before
+                    print(f"[!!] ERROR: Can not allocate {kind} port for {owner} [!!]")
+                    return None
+                ports[kind] = self._take(owner, kind, port)
+        if save:
+            self.save()
+        return ports
+
+    def reserve(self, kind: str, owner: str, port: int, host: str = "127.0.0.1", save: bool = True) -> bool:
+        """
+        Records a port chosen by the user. Fails if another owner holds it or something else listens on it.
+        With `save=False` the state is not written (the caller saves once for a batch).
+        """
+        with self._lock:
+            if self._assigned.get(owner, {}).get(kind) != port and not self._usable(port, owner, kind, host):
+                holder = self._owners.get(port)
+                by = f"{holder[0]} ({holder[1]})" if holder else "another process"
+                print(f"[!!] ERROR: Port {port} for {owner} is already used by {by} [!!]")
+                return False
+            self._take(owner, kind, port)
+        if save:
+            self.save()
+        return True
+
+    def release(self, owner: str) -> None:
+        with self._lock:
+            for port in self._assigned.pop(owner, {}).values():
+                self._owners.pop(port, None)
+            self._remembered.pop(owner, None)
+        self.save()
@@ -0,0 +1,305 @@
+import socket
+import selectors
+
+from time import monotonic
+from typing import Union
+from urllib.parse import urlsplit
+
+from .http_parser import HttpParser
+
+
+HOP_HEADERS = (b"connection", b"proxy-connection", b"keep-alive", b"proxy-authorization", b"expect", b"x-onion-session")
+CONNECT_OK = b"HTTP/1.1 200 Connection Established\r\n\r\n"
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+BAD_GATEWAY = b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+def readHead(conn: object, parser: HttpParser, buff: bytearray, pending: bytes = b"") -> Union[bytes, bool]:
+    """
+    Reads from `conn` until `parser` has a complete HTTP head, starting with `pending` bytes already
+    read. Returns the bytes that arrived after the head (the start of the body), or None if the peer
+    closed or sent something that is not HTTP.
+    """
+    view = memoryview(buff)
+    used = size = 0
+    if pending:
+        try:
+            used = parser.feed(pending, head_only=True)
+        except ValueError:
+            return None
+        if parser.headDone:
+            return pending[used:]
+        pending = b""
+    while not parser.headDone:
+        try:
+            size = conn.recv_into(buff)
+        except OSError:
+            return None
+        if not size:
+            return None
+        try:
+            used = parser.feed(view[:size], head_only=True)
+        except ValueError:
+            return None
+    return bytes(view[used:size])
+
+
+def relayMessage(src: object, dst: object, parser: HttpParser, buff: bytearray, pending: bytes = b"") -> Union[bytes, bool]:
+    """
+    Streams the rest of the message `parser` is framing from `src` to `dst`, starting with `pending`
+    bytes already read. Stops exactly at the end of the message and returns the bytes read past it,
+    or None if the message was cut short.
+    """
+    view = memoryview(buff)
+    used = size = 0
+    if pending:
+        try:
+            used = parser.feed(pending)
+        except ValueError:
+            return None
+        dst.sendall(pending[:used])
+        if parser.done:
+            return pending[used:]
+    while not parser.done:
+        try:
+            size = src.recv_into(buff)
+        except OSError:
+            return None
+        if not size:
+            return b"" if parser.feedEOF() else None
+        try:
+            used = parser.feed(view[:size])
+        except ValueError:
+            return None
+        dst.sendall(view[:used])
+    return bytes(view[used:size])
+
+
+def parseRequest(head: bytes, keep_alive: bool = True, strip: tuple = ()) -> Union[tuple, bool]:
+    """
+    Splits a proxy request head into (method, host, port, head_for_origin). CONNECT targets are
+    `host:port`; plain requests must use the absolute `http://` form and are rewritten to origin form
+    without hop-by-hop headers and the lower case header names in `strip`, adding `Connection: close`
+    unless the upstream may be kept alive.
+    """
+    lines = head[:-4].split(b"\r\n")
+    parts = lines[0].split(b" ")
+    if len(parts) != 3:
+        return None
+    method, target, version = parts
+    if method == b"CONNECT":
+        host, _, port = target.rpartition(b":")
+        if not host or not port.isdigit():
+            return None
+        return method, host.strip(b"[]").decode("idna"), int(port), None
+    if not target.startswith(b"http://"):
+        return None
+    url = urlsplit(target.decode("latin-1"))
+    if not url.hostname:
+        return None
+    path = url.path or "/"
+    if url.query:
+        path += "?" + url.query
+    out = [b" ".join((method, path.encode("latin-1"), version))]
+    for line in lines[1:]:
+        name = line.split(b":", 1)[0].strip().lower()
+        if name not in HOP_HEADERS and name not in strip:
+            out.append(line)
+    if not keep_alive:
+        out.append(b"Connection: close")
+    return method, url.hostname, url.port or 80, b"\r\n".join(out) + b"\r\n\r\n"
+
+
+def relayStream(client: object, upstream: object, raw_len: int = 16384, idle_timeout: float = 60) -> tuple:
+    """
+    Full-duplex relay between two connected sockets with one fixed-size buffer. Each direction is
+    half-closed when its source reaches EOF; the relay ends when both are done, on error, or after
+    `idle_timeout` seconds without traffic. Returns (bytes client->upstream, bytes upstream->client).
+    """
+    peers = {client: upstream, upstream: client}
+    sent = {client: 0, upstream: 0}
+    buff = bytearray(raw_len)
+    view = memoryview(buff)
+    sel = selectors.DefaultSelector()
+    sel.register(client, selectors.EVENT_READ)
+    sel.register(upstream, selectors.EVENT_READ)
+    opened = 2
+    try:
+        while opened:
+            events = sel.select(idle_timeout)
+            if not events:
+                break
+            for key, _ in events:
+                src = key.fileobj
+                dst = peers[src]
+                try:
+                    size = src.recv_into(buff)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    return sent[client], sent[upstream]
+                if not size:
+                    sel.unregister(src)
+                    opened -= 1
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    dst.sendall(view[:size])
+                except OSError:
+                    return sent[client], sent[upstream]
+                sent[src] += size
+    finally:
+        sel.close()
+    return sent[client], sent[upstream]
+
+
+class RelayHandler:
+    """
+    Request handling shared by the threaded bridges: client keep-alive, CONNECT tunnels and upstream
+    reuse through a SocksPool. Subclasses provide `connectSocks(host, port)` returning a connected SOCKS
+    socket (or None) plus `pool`, `raw_len`, `idleTimeout`, `name` and `metrics` (a BridgeMetrics).
+    """
+    keepUpstream = True
+    # headers meant for the bridge only, e.g. a sticky session header
+    stripHeaders = ()
+    traffic = None
+
+    def sessionKey(self, conn: object, request: HttpParser, host: str) -> Union[str, bool]:
+        return None
+
+    def acquireSocks(self, host: str, port: int, fresh: bool = False, session: str = None) -> tuple:
+        # returns (socket, pool, reused, backend); the backend is handed back to releaseBackend()
+        conn = self.pool.get((host, port)) if self.pool is not None and not fresh else None
+        if conn:
+            return conn, self.pool, True, None
+        return self.connectSocks(host, port), self.pool, False, None
+
+    def releaseBackend(self, backend: object, elapsed: float = None, ok: bool = True) -> None:
+        pass
+
+    def trafficFor(self, backend: object) -> Union[object, bool]:
+        # the TrafficCounter of the Onion that carried the request
+        return self.traffic
+
+    def recordTraffic(self, backend: object, sent: int, received: int, status: int = None) -> None:
+        self.metrics.bytesOut.inc(sent)
+        self.metrics.bytesIn.inc(received)
+        counter = self.trafficFor(backend)
+        if counter is not None:
+            counter.record(sent, received, status)
+
+    def tunnel(self, conn: object, host: str, port: int, rest: bytes, session: str = None) -> None:
+        self.metrics.connect.inc()
+        start = monotonic()
+        upstream, _, _, backend = self.acquireSocks(host, port, fresh=True, session=session)
+        if not upstream:
+            self.releaseBackend(backend, monotonic() - start, False)
+            self.metrics.error("connect")
+            conn.sendall(BAD_GATEWAY)
+            return
+        self.metrics.connectTime.observe(monotonic() - start)
+        self.releaseBackend(backend, monotonic() - start)
+        try:
+            conn.sendall(CONNECT_OK)
+            if rest:
+                upstream.sendall(rest)
+            sent, received = relayStream(conn, upstream, self.raw_len, self.idleTimeout)
+            self.recordTraffic(backend, sent + len(rest), received)
+        finally:
+            upstream.close()
+
+    def exchange(self, conn: object, request: HttpParser, host: str, port: int, head: bytes, rest: bytes, buff: bytearray, session: str = None) -> Union[bytes, bool]:
+        # a bodyless request on a pooled connection can be replayed once if the pooled stream went stale,
+        # on a new stream: the next pooled one may be just as stale
+        replay = request.done
+        fresh = False
+        self.metrics.http.inc()
+        while True:
+            start = monotonic()
+            upstream, pool, reused, backend = self.acquireSocks(host, port, fresh=fresh, session=session)
+            if not upstream:
+                self.releaseBackend(backend, monotonic() - start, False)
+                self.metrics.error("connect")
+                conn.sendall(BAD_GATEWAY)
+                return None
+            if not reused:
+                self.metrics.connectTime.observe(monotonic() - start)
+            response = HttpParser(method=request.method)
+            pending = leftover = None
+            sent = None
+            try:
+                upstream.settimeout(self.idleTimeout)
+                upstream.sendall(head)
+                pending = relayMessage(conn, upstream, request, buff, rest)
+                if pending is not None:
+                    sent = monotonic()
+                    leftover = relayMessage(upstream, conn, response, buff)
+            except OSError:
+                pass
+            stale = leftover is None and reused and replay and not response.started
+            if stale:
+                # not the backend's fault: the pooled stream was closed while idle
+                self.releaseBackend(backend)
+                fresh = True
+            else:
+                end = monotonic()
+                self.releaseBackend(backend, end - start, leftover is not None)
+                self.recordTraffic(backend, request.size, response.size, response.status)
+                if sent and response.firstAt:
+                    self.metrics.firstByte.observe(response.firstAt - sent)
+                if leftover is not None:
+                    self.metrics.total.observe(end - start)
+                else:
+                    self.metrics.error("upstream")
+            if leftover is None:
+                upstream.close()
+                if stale:
+                    continue
+                if not response.started:
+                    # nothing of the response went out yet: tell the client instead of just hanging up
+                    try:
+                        conn.sendall(BAD_GATEWAY)
+                    except OSError:
+                        pass
+                return None
+            if pool is not None and response.keepAlive and not leftover:
+                pool.put((host, port), upstream)
+            else:
+                upstream.close()
+            return pending if not response.closeDelimited else None
+
+    def handleReq(self, conn: object) -> None:
+        buff = bytearray(self.raw_len)
+        rest = b""
+        self.metrics.active.inc()
+        try:
+            conn.settimeout(self.idleTimeout)
+            while True:
+                request = HttpParser(response=False)
+                rest = readHead(conn, request, buff, rest)
+                if rest is None:
+                    return
+                target = parseRequest(request.head, self.keepUpstream, self.stripHeaders)
+                if not target:
+                    print(f"[{self.name}] Unknown protocol")
+                    self.metrics.error("protocol")
+                    return
+                method, host, port, head = target
+                session = self.sessionKey(conn, request, host)
+                if method == b"CONNECT":
+                    self.tunnel(conn, host, port, rest, session)
+                    return
+                if b"100-continue" in request.header(b"expect", b"").lower():
+                    conn.sendall(CONTINUE)
+                rest = self.exchange(conn, request, host, port, head, rest, buff, session)
+                if rest is None or not request.keepAlive:
+                    return
+        except OSError as e:
+            print(f"[{self.name}] [!!] ERROR: relay: {e} [!!]")
+            self.metrics.error("relay")
+        finally:
+            self.metrics.active.dec()
+            conn.close()
@@ -3,33 +3,53 @@ import socks
 import threading
 
 from threading import Thread
-from time import sleep
+from time import sleep, monotonic
 from typing import Union
-from random import randint
 
+from .port_allocator import freePort
+from .relay import RelayHandler
+from .balancer import makeBalancer
+from .health import BackendHealth
+from .hash_ring import HashRing
+from ..metrics import BridgeMetrics
 
-class CarouselProxyHttp(Thread):
-    def __init__(self, onions_bag: object, proxy_ip_port: str = None):
+
+class CarouselProxyHttp(Thread, RelayHandler):
+    def __init__(self, onions_bag: object, proxy_ip_port: str = None, strategy: Union[str, object] = "round_robin", probe_target: str = None, max_failures: int = 3, sticky: str = None):
         super().__init__()
         self.name = "CarouselHTTP"
+        self.metrics = BridgeMetrics(self.name)
         self.onions = onions_bag.openBag()
         self.bag = onions_bag
         self._ip_port = proxy_ip_port
+        self.stopEvent = threading.Event()
         self.stopEvents = [o.stopEvent for o in self.onions]
         self.ip = None
         self.port = None
         self.socksAddr = []
-        self.raw_len = self.findConf("RawLen", 1024)
-        self.format = self.findConf("FormatCode", "utf-8")
+        self.pools = {}
+        self.backendOnion = {}
+        self.health = BackendHealth(max_failures)
+        self.sticky = sticky
+        self.stickyHeader = b"x-onion-session"
+        self.ring = None
+        self.probeTarget = None
+        self.probeInterval = self.findConf("ProbeInterval", 30)
+        self.raw_len = self.findConf("RawLen", 1024 * 16)
+        self.idleTimeout = self.findConf("BridgeTimeout", 60)
         self._pause_conn = 1
-        self._lastUsed = None
+        if probe_target:
+            host, _, port = probe_target.rpartition(":")
+            self.probeTarget = (host, int(port)) if host else (probe_target, 80)
         self.specifyIP()
         self.getSocksAddr()
+        self.balancer = makeBalancer(strategy, self.socksAddr) or makeBalancer("round_robin", self.socksAddr)
+        self.prepareSticky()
         self.updateBagInfo()
     
     def specifyIP(self) -> None:
         if not self._ip_port:
-            self.port = randint(50000, 60000)
+            self.port = freePort(50000, 60000)
             self.ip = "127.0.0.1"
         elif ":" in self._ip_port:
             addr = self._ip_port.split(":")
@@ -39,16 +59,66 @@ class CarouselProxyHttp(Thread):
             self.ip = "127.0.0.1"
             self.port = int(self._ip_port)
     
+    def backendAddr(self, onion: object) -> Union[tuple, bool]:
+        loc = onion.conf.get("LocalSocks")
+        if loc:
+            return ("127.0.0.1", int(loc))
+        out = onion.conf.get("OutSocks")
+        if not out:
+            return None
+        out = out.split(":")
+        return (out[0], int(out[1]))
+
     def getSocksAddr(self) -> None:
         for onion in self.onions:
-            loc = onion.conf.get("LocalSocks")
-            if loc:
-                self.socksAddr.append(("127.0.0.1", int(loc)))
+            addr = self.backendAddr(onion)
+            if not addr:
                 continue
-            out = onion.conf.get("OutSocks")
-            if out:
-                addr = out.split(":")
-                self.socksAddr.append(addr[0], int(addr[1]))
+            self.socksAddr.append(addr)
+            self.pools[addr] = onion.socksPool
+            self.backendOnion[addr] = onion
+            self.health.add(addr)
+
+    def addOnion(self, onion: object) -> bool:
+        """
+        Adds an Onion to a running carousel, e.g. one planted by an autoscaler once it is bootstrapped. Add it to
+        the bag first with OnionsBag.addOnion(): the carousel's Onion list is the bag's own.
+
+        :return: True if the Onion now gets requests, False if it has no SOCKS address or is already a backend.
+        """
+        addr = self.backendAddr(onion)
+        if not addr or addr in self.backendOnion:
+            return False
+        self.pools[addr] = onion.socksPool
+        self.backendOnion[addr] = onion
+        self.health.add(addr)
+        self.balancer.add(addr)
+        if self.ring:
+            self.ring.add(addr)
+        # lists are replaced, not changed in place: request threads may be iterating them
+        self.stopEvents = self.stopEvents + [onion.stopEvent]
+        self.socksAddr = self.socksAddr + [addr]
+        onion._httpBridge = f"{self.ip}:{self.port}"
+        return True
+
+    def removeOnion(self, onion: object) -> bool:
+        """
+        Stops routing requests to an Onion. Requests already relayed through it run to their end.
+
+        :return: True if the Onion was a backend.
+        """
+        addr = self.backendAddr(onion)
+        if not addr or self.backendOnion.get(addr) is not onion:
+            return False
+        self.socksAddr = [b for b in self.socksAddr if b != addr]
+        self.stopEvents = [e for e in self.stopEvents if e is not onion.stopEvent]
+        self.balancer.remove(addr)
+        if self.ring:
+            self.ring.remove(addr)
+        self.health.remove(addr)
+        self.backendOnion.pop(addr, None)
+        self.pools.pop(addr, None)
+        return True
     
     def findConf(self, key: str, default: Union[str, int, bool]) -> Union[str, int, bool]:
         for o in self.onions:
@@ -67,10 +137,51 @@ class CarouselProxyHttp(Thread):
         return True
     
     def checkStopEvents(self) -> bool:
+        # the carousel keeps serving while at least one of its Onions is still running
+        if self.stopEvent.is_set():
+            return True
         for stop in self.stopEvents:
-            if stop.is_set():
-                return True
-        return False
+            if not stop.is_set():
+                return False
+        return True
+
+    def stop(self) -> None:
+        self.stopEvent.set()
+
+    def liveBackends(self) -> list:
+        # an Onion whose Tor is being restarted by the supervisor has no SOCKS port for now, a draining one takes
+        # no new requests
+        live = []
+        for b in self.socksAddr:
+            onion = self.backendOnion.get(b)
+            if onion and not onion.stopEvent.is_set() and not getattr(onion, "restarting", False) \
+                    and not getattr(onion, "draining", False):
+                live.append(b)
+        return live
+
+    def probe(self, backend: tuple) -> bool:
+        conn = self.connectSocks(self.probeTarget[0], self.probeTarget[1], backend)
+        if not conn:
+            return False
+        conn.close()
+        return True
+
+    def _healthCheck(self) -> None:
+        last_probe = monotonic()
+        while not self.checkStopEvents():
+            sleep(self._pause_conn)
+            for backend in self.health.due():
+                onion = self.backendOnion.get(backend)
+                if onion is None or onion.stopEvent.is_set():
+                    continue
+                if onion.Farmer.checkTorConn() and (not self.probeTarget or self.probe(backend)):
+                    self.health.readmit(backend)
+                else:
+                    self.health.postpone(backend)
+            if self.probeTarget and monotonic() - last_probe >= self.probeInterval:
+                last_probe = monotonic()
+                for backend in self.health.available(self.liveBackends()):
+                    self.health.record(backend, self.probe(backend), "probe failed")
     
     def updateBagInfo(self) -> None:
         for onion in self.onions:
@@ -108,6 +219,8 @@ class CarouselProxyHttp(Thread):
             return False
         ac = Thread(target=self._acceptConn)
         ac.start()
+        hc = Thread(target=self._healthCheck, daemon=True)
+        hc.start()
         return True
     
     def prepareProxy(self) -> bool:
@@ -121,85 +234,96 @@ class CarouselProxyHttp(Thread):
         else:
             return False
     
-    def reciveMsg(self, conn_object: object, decode: bool = False) -> Union[bytes, str, bool]:
-        msg = b""
-        while True:
-            try:
-                recv = conn_object.recv(self.raw_len)
-            except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError, OSError) as e:
-                print(f"[{self.name}] [!!] ERROR: recive response: {e} [!!]")
-                return None
-            if recv:
-                if len(recv) < self.raw_len:
-                    msg += recv
-                    break
-                else:
-                    msg += recv
-            else:
-                return None
-        if decode:
-            msg = msg.decode(self.format)
-        return msg
-    
-    def readAddr(self, headers: str) -> Union[str, bool]:
-        if headers.startswith("http://"):
-            headers = headers[7:]
-        else:
-            return None
-        return headers.rstrip("/")
-        
-    def handleReq(self, conn: object) -> None:
-        resp = self.reciveMsg(conn, True)
-        if not resp:
-            conn.close()
+    def prepareSticky(self) -> None:
+        # sticky: "client_ip", "host", "header" (X-Onion-Session) or "header:<Name>"
+        if not self.sticky:
             return
-        headers = resp.split("\r\n")
-        print(headers)
-        head = headers[0].split(" ")
-        method = head[0]
-        if len(headers) > 1:
-            addr = self.readAddr(head[1])
-            if addr:
-                socks_resp = self.sendSocksReq(addr, resp)
-                if socks_resp:
-                    conn.send(socks_resp.encode(self.format))
-            else:
-                print(f"[{self.name}] Unknown protocol")
-        conn.close()
-    
-    def getSocks(self) -> tuple:
-        if self._lastUsed:
-            while True:
-                sock = randint(0, len(self.socksAddr) - 1)
-                if sock == self._lastUsed:
-                    continue
-                self._lastUsed = self.socksAddr[sock]
-                return self.socksAddr[sock]
-        sock = randint(0, len(self.socksAddr) - 1)
-        self._lastUsed = self.socksAddr[sock]
-        return self.socksAddr[sock]
+        mode, _, header = self.sticky.partition(":")
+        if mode not in ("client_ip", "host", "header"):
+            print(f"[{self.name}] [!!] ERROR: Unknown sticky mode: {self.sticky} ... sessions disabled [!!]")
+            self.sticky = None
+            return
+        self.sticky = mode
+        if header:
+            self.stickyHeader = header.strip().lower().encode("latin-1")
+        if mode == "header":
+            # the session key is for the carousel only, never for the origin
+            self.stripHeaders = (self.stickyHeader, )
+        self.ring = HashRing(self.socksAddr, self.findConf("HashVnodes", 160))
+
+    def sessionKey(self, conn: object, request: object, host: str) -> Union[str, bool]:
+        match self.sticky:
+            case "client_ip":
+                try:
+                    return conn.getpeername()[0]
+                except OSError:
+                    return None
+            case "host":
+                return host
+            case "header":
+                key = request.header(self.stickyHeader)
+                return key.decode("latin-1") if key else None
+        return None
+
+    def getSocks(self, exclude: tuple = None, session: str = None) -> Union[tuple, bool]:
+        live = [b for b in self.liveBackends() if b != exclude]
+        healthy = self.health.available(live)
+        if not healthy and live:
+            # every running backend is ejected: keep routing rather than fail every request
+            healthy = live
+        if not session:
+            # Onions rebuilding their circuit under a RotationScheduler get no new requests while others can
+            settled = [b for b in healthy if not getattr(self.backendOnion.get(b), "rotating", False)]
+            healthy = settled or healthy
+        if session and self.ring:
+            # only sessions of an unusable backend move: to the next backend on the ring
+            owner = self.ring.lookup(session, healthy)
+            if owner:
+                healthy = [owner]
+        return self.balancer.choose(healthy)
+
+    def acquireSocks(self, host: str, port: int, fresh: bool = False, session: str = None) -> tuple:
+        socksAddr = self.getSocks(session=session)
+        if not socksAddr:
+            return None, None, False, None
+        pool = self.pools.get(socksAddr)
+        conn = pool.get((host, port)) if pool is not None and not fresh else None
+        if conn:
+            return conn, pool, True, socksAddr
+        start = monotonic()
+        conn = self.connectSocks(host, port, socksAddr)
+        if not conn and len(self.liveBackends()) > 1:
+            # a failed connect costs nothing on the client side yet: give one other backend a try
+            self.releaseBackend(socksAddr, monotonic() - start, False)
+            socksAddr = self.getSocks(exclude=socksAddr, session=session)
+            pool = self.pools.get(socksAddr)
+            conn = self.connectSocks(host, port, socksAddr) if socksAddr else None
+        return conn, pool, False, socksAddr
 
-    def sendSocksReq(self, addr: str, msg: str) -> Union[str, bool]:
+    def releaseBackend(self, backend: tuple, elapsed: float = None, ok: bool = True) -> None:
+        if backend:
+            self.balancer.finish(backend, elapsed, ok)
+            if elapsed is not None:
+                self.health.record(backend, ok)
+
+    def trafficFor(self, backend: tuple) -> Union[object, bool]:
+        onion = self.backendOnion.get(backend)
+        return getattr(onion, "traffic", None)
+
+    def connectSocks(self, host: str, port: int, socksAddr: tuple) -> Union[object, bool]:
         try:
             mySocks = socks.socksocket()
-            socksAddr = self.getSocks()
             mySocks.set_proxy(socks.PROXY_TYPE_SOCKS5, socksAddr[0], socksAddr[1])
         except Exception as e:
             print(f"[{self.name}] [!!] ERROR: making Socks Proxy: {e} [!!]")
             return None
         try:
-            mySocks.connect((addr, 80))
-        except Exception as e:
-            print(f"[{self.name}] [!!] ERROR: Can not connect: {addr}. error: {e} [!!]")
-            return None
-        try:
-            mySocks.sendall(msg.encode(self.format))
+            mySocks.connect((host, port))
         except Exception as e:
-            print(f"[{self.name}] [!!] ERROR: send msg: {e} [!!]")
+            print(f"[{self.name}] [!!] ERROR: Can not connect: {host}:{port}. error: {e} [!!]")
+            mySocks.close()
             return None
-        resp = self.reciveMsg(mySocks, True)
-        mySocks.close()
-        return resp
+        return mySocks
     
     def run(self) -> None:
         if not self.prepareProxy():
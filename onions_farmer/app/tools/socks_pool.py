@@ -0,0 +1,110 @@
+import select
+import threading
+
+from time import monotonic
+from collections import deque, OrderedDict
+from typing import Union
+
+
+def socketAlive(conn: object) -> bool:
+    # an idle upstream must have nothing to read: EOF or stray bytes both mean it can not be reused
+    try:
+        poller = select.poll()
+        poller.register(conn, select.POLLIN)
+        return not poller.poll(0)
+    except (OSError, ValueError):
+        return False
+
+
+class SocksPool:
+    """
+    Idle upstream connections (already through SOCKS and connected to the origin) keyed by (host, port).
+    Connections older than `idle_timeout` are dropped, each key keeps at most `max_per_host`, and the
+    least recently released connection is evicted once the pool holds `max_size`.
+    """
+    def __init__(self, max_size: int = 32, idle_timeout: float = 30, max_per_host: int = 8, check: object = socketAlive):
+        self.maxSize = max_size
+        self.idleTimeout = idle_timeout
+        self.maxPerHost = max_per_host
+        self.check = check
+        self._lock = threading.Lock()
+        self._byKey = {}
+        self._order = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _drop(self, conn: object) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evictIdle(self, now: float) -> list:
+        dead = []
+        while self._order:
+            conn, (key, stamp) = next(iter(self._order.items()))
+            if now - stamp < self.idleTimeout:
+                break
+            del self._order[conn]
+            self._byKey[key].popleft()
+            if not self._byKey[key]:
+                del self._byKey[key]
+            dead.append(conn)
+        return dead
+
+    def get(self, key: tuple) -> Union[object, bool]:
+        now = monotonic()
+        found = None
+        with self._lock:
+            dead = self._evictIdle(now)
+            idle = self._byKey.get(key)
+            while idle:
+                conn = idle.pop()
+                del self._order[conn]
+                if self.check(conn):
+                    found = conn
+                    break
+                dead.append(conn)
+            if idle is not None and not idle:
+                del self._byKey[key]
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for conn in dead:
+            self._drop(conn)
+        return found
+
+    def put(self, key: tuple, conn: object) -> None:
+        if not self.maxSize:
+            self._drop(conn)
+            return
+        now = monotonic()
+        with self._lock:
+            dead = self._evictIdle(now)
+            idle = self._byKey.setdefault(key, deque())
+            if len(idle) >= self.maxPerHost:
+                old = idle.popleft()
+                del self._order[old]
+                dead.append(old)
+            idle.append(conn)
+            self._order[conn] = (key, now)
+            while len(self._order) > self.maxSize:
+                old, (old_key, _) = self._order.popitem(last=False)
+                self._byKey[old_key].popleft()
+                if not self._byKey[old_key]:
+                    del self._byKey[old_key]
+                dead.append(old)
+        for old in dead:
+            self._drop(old)
+
+    def clear(self) -> None:
+        with self._lock:
+            dead = list(self._order)
+            self._order.clear()
+            self._byKey.clear()
+        for conn in dead:
+            self._drop(conn)
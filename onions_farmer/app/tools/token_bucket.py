@@ -0,0 +1,39 @@
+import threading
+
+from time import monotonic
+
+
+class TokenBucket:
+    """
+    Token bucket pacing: `rate` tokens per second, at most `burst` saved up. A rate of 0 or None disables pacing.
+    """
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = self.burst
+        self._stamp = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def tryTake(self, tokens: float = 1) -> float:
+        # 0 when the tokens were taken, otherwise seconds until they will be available
+        if not self.rate:
+            return 0
+        with self._lock:
+            self._refill(monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def take(self, tokens: float = 1, stop: threading.Event = None) -> bool:
+        stop = stop or threading.Event()
+        while True:
+            wait = self.tryTake(tokens)
+            if not wait:
+                return True
+            if stop.wait(wait):
+                return False
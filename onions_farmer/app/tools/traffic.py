@@ -0,0 +1,62 @@
+import threading
+
+from time import monotonic
+
+
+# origin answers that usually mean the exit IP is blocked or rate limited
+BLOCK_STATUS = (403, 429, 503)
+
+
+class TrafficCounter:
+    """
+    Per-Onion traffic seen by its bridges since the last reset (usually the last circuit rotation): requests,
+    bytes in both directions and consecutive block-like responses.
+    """
+    def __init__(self, block_status: tuple = BLOCK_STATUS):
+        self.blockStatus = block_status
+        self._lock = threading.Lock()
+        self.totalRequests = 0
+        self.totalBytes = 0
+        self._clear()
+
+    def _clear(self) -> None:
+        self.requests = 0
+        self.bytesOut = 0
+        self.bytesIn = 0
+        self.blocks = 0
+        self.lastStatus = None
+        self.since = monotonic()
+
+    def record(self, sent: int = 0, received: int = 0, status: int = None) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytesOut += sent
+            self.bytesIn += received
+            self.totalRequests += 1
+            self.totalBytes += sent + received
+            if status is not None:
+                self.lastStatus = status
+                self.blocks = self.blocks + 1 if status in self.blockStatus else 0
+
+    @property
+    def bytes(self) -> int:
+        return self.bytesOut + self.bytesIn
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "Requests": self.requests,
+                "BytesOut": self.bytesOut,
+                "BytesIn": self.bytesIn,
+                "Blocks": self.blocks,
+                "LastStatus": self.lastStatus,
+                "Seconds": monotonic() - self.since,
+                "TotalRequests": self.totalRequests,
+                "TotalBytes": self.totalBytes
+            }
+
+    def reset(self) -> dict:
+        with self._lock:
+            snap = {"Requests": self.requests, "Bytes": self.bytesOut + self.bytesIn, "Blocks": self.blocks}
+            self._clear()
+        return snap
@@ -1,3 +1,4 @@
+import os
 import threading
 
 from time import sleep
@@ -6,6 +7,10 @@ from typing import Union
 from .app.onion import Onion
 from .app.constructor import TorConstructor
 from .app.onions_bag import OnionsBag
+from .app.tools.port_allocator import PortAllocator
+from .app.shard import ShardPool
+from .app.autoscaler import BagAutoscaler
+from .app.metrics import REGISTRY
 
 
 
@@ -18,16 +23,24 @@ class OnionsFarmer:
     bulk operations. Key functionalities include creating single Onion instances, managing collections of Onions,
     and performing actions like starting, stopping, and configuring Onion instances.
     """
-    def __init__(self, onions_dir_path: str = None):
+    def __init__(self, onions_dir_path: str = None, workers: int = 0, start_method: str = "spawn"):
         """
         Initializes the OnionsFarmer with optional directory path settings for Tor configurations.
         It sets up the environment necessary for managing Onion instances by initializing the TorConstructor,
         preparing storage for Onion objects and their corresponding stop events, and a list to hold OnionsBag
-        objects for group management of Onions.
+        objects for group management of Onions. A PortAllocator hands out the SOCKS, HTTP bridge and control ports
+        of every Onion and remembers them in "ports.json" across restarts.
 
         :param onions_dir_path: Optional. Specifies the base directory path for storing Tor configurations and related files.
+        :param workers: Optional. Number of worker processes to spread the Onions (with their Farmers and HTTP bridges)
+                        over. 0 (default) keeps everything in this process. With workers, plantOnion() returns
+                        OnionProxy objects and makeOnionsBag() a ShardedBag, which offer the same API over IPC.
+                        Create the OnionsFarmer under an `if __name__ == "__main__":` guard when using workers.
+        :param start_method: Optional. multiprocessing start method of the worker processes.
         """
         self.Constructor = TorConstructor(onions_dir_path)
+        self.Shards = ShardPool(workers, start_method) if workers else None
+        self.Ports = PortAllocator(os.path.join(self.Constructor.dirMainOnions, "ports.json"))
         self.Onions = {}
         self.StopEvents = {}
         self.Bags = []
@@ -44,14 +57,32 @@ class OnionsFarmer:
         :param outside_socks_ip: Optional. The IP address for an outside SOCKS proxy.
         :param torrc: Optional. Path to a custom Tor configuration file.
         :param print_log: Optional. Enables printing Tor logs to the console.
-        :param http_bridge: Optional. Specifies if and how an HTTP bridge should be configured.
+        :param http_bridge: Optional. Specifies if and how an HTTP bridge should be configured. Prefix the value with
+                            "async" (e.g. "async", "async:5000", "async:192.168.0.22:5000") to serve the bridge from the
+                            shared asyncio event loop instead of one thread per client connection.
         :param config: Optional. A dictionary of additional configuration options.
         :return: The created Onion object or None if the creation failed.
         """
 
-        conf = config
+        conf = self._onionConf(name, local_socks_port, outside_socks_ip, torrc, print_log, http_bridge, config)
+        if not self._assignPorts(conf):
+            return None
+        onion_cfg = self.Constructor.makeConfig(conf)
+        if not onion_cfg:
+            return None
+        return self._addOnion(onion_cfg)
+    
+    def _onionConf(self, name: str, local_socks_port: Union[str, int], outside_socks_ip: str, torrc: str, print_log: bool, http_bridge: str, config: dict, offset: int = 0) -> dict:
+        """
+        A private method that builds the configuration dictionary of a new Onion from the plantOnion() parameters.
+
+        :param offset: Number of Onions already prepared in the current batch but not yet registered, used to keep
+                       default names unique.
+        :return: The configuration dictionary, ready for TorConstructor.makeConfig().
+        """
+        conf = dict(config)
         if not name:
-            conf["Name"] = f"myOnion{len(self.Onions) + 1}"
+            conf["Name"] = f"myOnion{len(self.Onions) + offset + 1}"
         else:
             conf["Name"] = name
         conf["LocalSocks"] = local_socks_port
@@ -60,13 +91,70 @@ class OnionsFarmer:
         conf["PrintLog"] = print_log
         if http_bridge:
             conf["HttpBridge"] = http_bridge
-        onion_cfg = self.Constructor.makeConfig(conf)
-        if not onion_cfg:
-            return None
-        stop = threading.Event()
-        onion = Onion(onion_cfg, stop)
-        self.Onions[onion_cfg["Name"]] = onion
-        self.StopEvents[onion_cfg["Name"]] = stop
+        return conf
+    
+    def _assignPorts(self, conf: dict, preferred: int = None, save: bool = True) -> bool:
+        """
+        A private method that checks and assigns every port of a new Onion before anything is written, so a
+        collision is reported at once instead of when Tor or the HTTP bridge fails to bind. Ports given by the user
+        are reserved as they are; the SOCKS port (default 9050), a "random" HTTP bridge port and a "ControlPort"
+        set to True are taken from the PortAllocator. The chosen ports are written back into `conf`.
+
+        :param conf: Configuration dictionary built by _onionConf().
+        :param preferred: Optional. Preferred SOCKS port when the configuration does not name one.
+        :param save: If False, the allocator state is not written to disk (the caller saves once for a batch).
+        :return: True if all ports could be assigned, False otherwise.
+        """
+        name = conf["Name"]
+        ok = True
+        if conf.get("LocalSocks"):
+            ok = self.Ports.reserve("socks", name, int(conf["LocalSocks"]), save=save)
+        elif conf.get("OutSocks"):
+            host, _, port = str(conf["OutSocks"]).rpartition(":")
+            ok = self.Ports.reserve("socks", name, int(port), host or "127.0.0.1", save)
+        else:
+            port = self.Ports.allocate("socks", name, preferred or 9050, save=save)
+            ok = port is not None
+            conf["LocalSocks"] = str(port)
+        bridge = conf.get("HttpBridge")
+        if ok and bridge:
+            prefix = "async:" if bridge.startswith("async") else ""
+            addr = bridge[6:] if prefix else bridge
+            if not addr or addr == "random":
+                port = self.Ports.allocate("bridge", name, save=save)
+                ok = port is not None
+                conf["HttpBridge"] = f"{prefix}127.0.0.1:{port}"
+            else:
+                host, _, port = addr.rpartition(":")
+                ok = port.isdigit() and self.Ports.reserve("bridge", name, int(port), host or "127.0.0.1", save)
+        control = conf.get("ControlPort")
+        if ok and control:
+            if control is True:
+                port = self.Ports.allocate("control", name, save=save)
+                ok = port is not None
+                conf["ControlPort"] = port
+            else:
+                ok = self.Ports.reserve("control", name, int(control), save=save)
+        if not ok:
+            print(f"[!!] ERROR: Can not assign ports for Onion: {name} [!!]")
+            self.Ports.release(name)
+        return ok
+    
+    def _addOnion(self, onion_cfg: dict) -> object:
+        """
+        A private method that creates an Onion from a prepared configuration and registers it with its stop event.
+        With worker processes the Onion is created in the least loaded worker and an OnionProxy is returned.
+
+        :param onion_cfg: Configuration dictionary returned by TorConstructor.makeConfig().
+        :return: The created Onion object.
+        """
+        if self.Shards:
+            return self._registerOnion(self.Shards.plant(onion_cfg))
+        return self._registerOnion(Onion(onion_cfg, threading.Event()))
+    
+    def _registerOnion(self, onion: object) -> object:
+        self.Onions[onion.name] = onion
+        self.StopEvents[onion.name] = onion.stopEvent
         return onion
     
     def getOnion(self, name: str = None) -> Union[bool, object, dict]:
@@ -102,6 +190,73 @@ class OnionsFarmer:
             return
         stop.set()
     
+    def removeOnion(self, name: str, timeout: float = 30) -> bool:
+        """
+        Stops an Onion, waits for its Tor process to terminate and forgets it: its ports go back to the
+        PortAllocator and the name can be planted again. Remove it from its OnionsBag and carousel first.
+
+        :param name: The name of the Onion instance to remove.
+        :param timeout: Seconds to wait for the Onion thread to end.
+        :return: True if the Onion was removed, False if it does not exist.
+        """
+        onion = self.Onions.get(name)
+        if not onion:
+            print(f"[!!] ERROR: Onion: {name} does not exists [!!]")
+            return False
+        onion.stop()
+        if not self.Shards and onion.is_alive():
+            onion.join(timeout)
+        self.Ports.release(name)
+        self.Onions.pop(name, None)
+        self.StopEvents.pop(name, None)
+        return True
+
+    def autoscaleBag(self, bag: object, carousel: object = None, **kwargs) -> Union[object, bool]:
+        """
+        Grows and shrinks a running OnionsBag (and the CarouselProxyHttp serving it) with the load on its bridges.
+        See BagAutoscaler for the keyword arguments: bounds, targets, cool-downs and drain timeout.
+
+        :param bag: The OnionsBag to scale, from makeOnionsBag().
+        :param carousel: Optional. The CarouselProxyHttp serving the bag.
+        :return: The started BagAutoscaler, or None for a bag living in worker processes.
+        """
+        if self.Shards:
+            print("[!!] ERROR: Autoscaling is not supported with worker processes [!!]")
+            return None
+        scaler = BagAutoscaler(self, bag, carousel, **kwargs)
+        scaler.start()
+        return scaler
+
+    def stopWorkers(self) -> None:
+        """
+        Stops every Onion and shuts the worker processes down, waiting for each worker to terminate its Tor
+        processes. Does nothing when the OnionsFarmer runs without workers.
+        """
+        if not self.Shards:
+            return
+        self.stopOnion()
+        self.Shards.shutdown()
+
+    def metrics(self) -> dict:
+        """
+        Returns the current metrics of every Onion, Farmer and bridge (worker processes included) as Python
+        values: bootstrap, circuit build and new circuit times, control command round trips, bridge requests,
+        bytes, latencies, active connections and errors. Histograms come with count, sum, mean and p50/p90/p99.
+
+        :return: Dictionary metric name -> {label values joined with ",": value}.
+        """
+        return REGISTRY.snapshot()
+
+    def serveMetrics(self, host: str = "127.0.0.1", port: int = 9100) -> Union[tuple, bool]:
+        """
+        Exposes the metrics in the Prometheus text format at http://host:port/metrics.
+
+        :param host: Address to listen on.
+        :param port: Port to listen on, 0 for any free port.
+        :return: The (host, port) the endpoint listens on, or None if it can not bind.
+        """
+        return REGISTRY.serve(host, port)
+    
     def makeOnionsBag(self, onions_count: int = 1, name: str = None, local_sock_port_num_start: int = 8000, out_proxy_ip: str = None, torrc: str = None, print_log: bool = False, http_bridge_ip: str = None) -> object:
         """
         Creates a collection of Onion instances, known as an OnionsBag, with the ability to configure each Onion
@@ -115,23 +270,34 @@ class OnionsFarmer:
         :param torrc: Optional. Path to a custom Tor configuration file for the Onions.
         :param print_log: Optional. Enables printing Tor logs to the console for each Onion.
         :param http_bridge_ip: Optional. Specifies if and how an HTTP bridge should be configured for each Onion.
-        :return: The created OnionsBag object containing the newly created Onion instances.
+        :return: The created OnionsBag object containing the newly created Onion instances (a ShardedBag when the
+                 OnionsFarmer runs worker processes).
         """
         self._tmpOnion = []
         if not name:
             name = "myOnion"
-        for _ in range(onions_count):
-            onion_id = len(self.Onions) + 1
+        confs = []
+        for i in range(onions_count):
+            onion_id = len(self.Onions) + i + 1
             newname = f"{name}{onion_id}"
-            port = str(local_sock_port_num_start + (onion_id * 20))
+            port = local_sock_port_num_start + (onion_id * 20)
             if out_proxy_ip:
-                out_proxy = f"{out_proxy_ip}:{port}"
+                port = self.Ports.allocate("socks", newname, port, out_proxy_ip, save=False)
+                out_proxy = f"{out_proxy_ip}:{port}" if port else None
             else:
-                out_proxy = out_proxy_ip
-            onion = self.plantOnion(newname, port, out_proxy, torrc, print_log, http_bridge_ip)
-            if onion:
-                self._tmpOnion.append(onion)
-        bag = OnionsBag(self._tmpOnion)
+                out_proxy = None
+            conf = self._onionConf(newname, None, out_proxy, torrc, print_log, http_bridge_ip, {})
+            if (not out_proxy_ip or out_proxy) and self._assignPorts(conf, port, save=False):
+                confs.append(conf)
+        self.Ports.save()
+        # every torrc is written in one pass before any Onion is created
+        cfgs = [cfg for cfg in self.Constructor.makeConfigs(confs) if cfg]
+        if self.Shards:
+            self._tmpOnion = [self._registerOnion(proxy) for proxy in self.Shards.plantMany(cfgs)]
+            bag = self.Shards.makeBag(self._tmpOnion)
+        else:
+            self._tmpOnion = [self._addOnion(cfg) for cfg in cfgs]
+            bag = OnionsBag(self._tmpOnion)
         self.Bags.append(bag)
         self._tmpOnion = []
         return bag
@@ -0,0 +1,66 @@
+import subprocess
+import sys
+import threading
+import time
+
+from onions_farmer.app import exit_ip
+from onions_farmer.app.exit_ip import collectExits
+
+
+HANG = threading.Event()
+
+
+class StubOnion:
+    def __init__(self, name: str, fingerprint: str, hang: bool = False, hang_circuit: bool = False):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.hang = hang
+        self.hangCircuit = hang_circuit
+        self.renewed = 0
+
+    def exitInfo(self) -> dict:
+        if self.hang:
+            HANG.wait()
+        return {"IP": f"10.0.0.{len(self.fingerprint)}", "Country": None, "Fingerprint": self.fingerprint, "Circuit": "1"}
+
+    def newCircuit(self, wait: bool = False) -> None:
+        if self.hangCircuit:
+            HANG.wait()
+        self.renewed += 1
+        self.fingerprint += "x"
+
+
+def test_hanging_checkers_do_not_block_queued_onions():
+    onions = [StubOnion("a", "A", hang=True), StubOnion("b", "B", hang=True), StubOnion("c", "C"), StubOnion("d", "D")]
+    start = time.monotonic()
+    exits, report = collectExits(onions, concurrency=2, timeout=1)
+    assert time.monotonic() - start < 3
+    assert exits["a"] is None and exits["b"] is None
+    assert exits["c"]["Fingerprint"] == "C" and exits["d"]["Fingerprint"] == "D"
+    assert report["Failed"] == ["a", "b"]
+    assert report["Resolved"] == 2
+
+
+def test_hanging_new_circuit_is_given_up(monkeypatch):
+    monkeypatch.setattr(exit_ip, "NEWNYM_WAIT", 0)
+    onions = [StubOnion("a", "A"), StubOnion("b", "A", hang_circuit=True), StubOnion("c", "A")]
+    start = time.monotonic()
+    exits, report = collectExits(onions, concurrency=1, timeout=1, unique=True, rounds=1)
+    assert time.monotonic() - start < 6
+    assert report["Rounds"] == 1
+    assert onions[2].renewed == 1
+    assert exits["c"]["Fingerprint"] == "Ax"
+
+
+def test_interpreter_exits_with_hanging_checker():
+    code = (
+        "import threading\n"
+        "from onions_farmer.app.exit_ip import collectExits\n"
+        "class O:\n"
+        "    name = 'a'\n"
+        "    def exitInfo(self):\n"
+        "        threading.Event().wait()\n"
+        "print(collectExits([O()], timeout=0.5)[1]['Failed'])\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=10)
+    assert "['a']" in out.stdout
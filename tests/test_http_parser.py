@@ -0,0 +1,127 @@
+import random
+
+import pytest
+
+from onions_farmer.app.tools.http_parser import HttpParser
+
+
+NEXT = b"GET /next HTTP/1.1\r\nHost: example.com\r\n\r\n"
+
+LONG_EXT = b";ext=" + b"x" * 1100
+LONG_TRAILER = b"X-Trailer: " + b"t" * 1500 + b"\r\n"
+
+RESPONSES = {
+    "content-length": (b"HTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\nhello world", b"hello world"),
+    "empty": (b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n", b""),
+    "no-body": (b"HTTP/1.1 204 No Content\r\n\r\n", b""),
+    "chunked": (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n", b"hello world"),
+    "chunked-long-ext": (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         b"5" + LONG_EXT + b"\r\nhello\r\n0" + LONG_EXT + b"\r\n\r\n", b"hello"),
+    "chunked-trailers": (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         b"b\r\nhello world\r\n0\r\n" + LONG_TRAILER + b"X-Other: 1\r\n\r\n", b"hello world"),
+    "interim": (b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok", b"ok"),
+}
+
+REQUESTS = {
+    "get": (b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n", b""),
+    "post": (b"POST /form HTTP/1.1\r\nHost: example.com\r\nContent-Length: 7\r\n\r\na=1&b=2", b"a=1&b=2"),
+    "chunked": (b"POST /up HTTP/1.1\r\nHost: example.com\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"3" + LONG_EXT + b"\r\nabc\r\n0\r\n" + LONG_TRAILER + b"\r\n", b"abc"),
+}
+
+CLOSE_DELIMITED = b"HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\nuntil the connection closes"
+
+
+def byteByByte(data: bytes) -> list:
+    return [data[i:i + 1] for i in range(len(data))]
+
+
+def randomSplits(data: bytes, seed: int) -> list:
+    rnd = random.Random(seed)
+    cuts = sorted(rnd.sample(range(1, len(data)), min(len(data) - 1, rnd.randint(1, 8))))
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+def feedAll(parser: HttpParser, pieces: list) -> bytes:
+    # feeds until the message is done, returns what was left over for the next message
+    leftover = bytearray()
+    for piece in pieces:
+        if parser.done:
+            leftover += piece
+            continue
+        used = parser.feed(piece)
+        assert 0 <= used <= len(piece)
+        leftover += piece[used:]
+    return bytes(leftover)
+
+
+def splits(data: bytes) -> list:
+    return [[data], byteByByte(data)] + [randomSplits(data, seed) for seed in range(20)]
+
+
+@pytest.mark.parametrize("name", RESPONSES)
+def test_responses(name):
+    message, body = RESPONSES[name]
+    for pieces in splits(message + NEXT):
+        parser = HttpParser(method=b"GET", keep=True)
+        leftover = feedAll(parser, pieces)
+        assert parser.done
+        assert bytes(parser.body) == body
+        assert parser.size == len(message)
+        assert leftover == NEXT
+
+
+@pytest.mark.parametrize("name", REQUESTS)
+def test_requests(name):
+    message, body = REQUESTS[name]
+    for pieces in splits(message + NEXT):
+        parser = HttpParser(response=False, keep=True)
+        leftover = feedAll(parser, pieces)
+        assert parser.done
+        assert bytes(parser.body) == body
+        assert parser.size == len(message)
+        assert leftover == NEXT
+
+
+def test_close_delimited():
+    body = CLOSE_DELIMITED.split(b"\r\n\r\n", 1)[1]
+    for pieces in splits(CLOSE_DELIMITED):
+        parser = HttpParser(method=b"GET", keep=True)
+        assert feedAll(parser, pieces) == b""
+        assert not parser.done
+        assert parser.feedEOF()
+        assert parser.done
+        assert bytes(parser.body) == body
+        assert parser.size == len(CLOSE_DELIMITED)
+        assert not parser.keepAlive
+
+
+def test_early_close():
+    parser = HttpParser(method=b"GET")
+    parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nshort")
+    assert not parser.feedEOF()
+
+
+def test_chunk_line_too_long():
+    parser = HttpParser(method=b"GET", max_head=2048)
+    parser.feed(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+    with pytest.raises(ValueError):
+        for piece in randomSplits(b"5;" + b"x" * 4096, 1):
+            parser.feed(piece)
+
+
+@pytest.mark.parametrize("length", [b"-5", b"+3", b"3x", b"", b"0x10", b"3, 4", b"5,-5"])
+def test_invalid_content_length(length):
+    message = b"HTTP/1.1 200 OK\r\nContent-Length: " + length + b"\r\n\r\nhello"
+    for pieces in splits(message):
+        parser = HttpParser(method=b"GET")
+        with pytest.raises(ValueError, match="invalid Content-Length"):
+            feedAll(parser, pieces)
+
+
+def test_repeated_content_length():
+    message = b"POST / HTTP/1.1\r\nContent-Length: 5\r\nContent-Length: 5\r\n\r\nhello"
+    parser = HttpParser(response=False, keep=True)
+    assert feedAll(parser, [message + NEXT]) == NEXT
+    assert parser.done and bytes(parser.body) == b"hello"